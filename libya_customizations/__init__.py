@@ -10,8 +10,24 @@ try:
     import frappe
     import erpnext
     from erpnext.stock.stock_ledger import update_entries_after
-    from libya_customizations.overrides.repost_sl import process_sle
+    from libya_customizations.overrides.repost_sl import (
+        build,
+        get_dependent_entries_to_fix,
+        get_future_entries_to_fix,
+        process_sle,
+    )
 
+    update_entries_after.build = build
+    update_entries_after.get_dependent_entries_to_fix = get_dependent_entries_to_fix
+    update_entries_after.get_future_entries_to_fix = get_future_entries_to_fix
     update_entries_after.process_sle = process_sle
+except Exception as e:
+    pass
+
+try:
+    from frappe.core.doctype.report.report import Report
+    from libya_customizations.report_cache import execute_query_report
+
+    Report.execute_query_report = execute_query_report
 except Exception as e:
     pass
\ No newline at end of file
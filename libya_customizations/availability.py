@@ -0,0 +1,85 @@
+import frappe
+from frappe.utils import flt
+
+from libya_customizations.libya_customizations.doctype.item_availability.item_availability import (
+	AVAILABILITY_MEMO_KEY,
+	QTY_FIELDS,
+	get_availability_name,
+)
+
+
+def get_availability(keys, memo=False):
+	"""Returns actual and future available quantities for (item_code, production_year, warehouse) keys.
+
+	All keys are read from Item Availability with one query and the result is keyed by
+	(item_code, production_year, warehouse), production_year normalized to "". With `memo`
+	the rows are kept for the rest of the request, so keys asked for again are not re-read;
+	the memo is dropped whenever Item Availability is written to.
+	"""
+	keys = {(item_code, production_year or "", warehouse) for item_code, production_year, warehouse in keys}
+	if not keys:
+		return {}
+
+	cache = frappe.local.cache.setdefault(AVAILABILITY_MEMO_KEY, {}) if memo else {}
+	missing = {get_availability_name(*key): key for key in keys if key not in cache}
+
+	if missing:
+		rows = frappe.db.sql(f"""
+			SELECT name, {", ".join(QTY_FIELDS)}
+			FROM `tabItem Availability`
+			WHERE name IN %(names)s
+		""", {"names": list(missing)}, as_dict=True)
+
+		fetched = {missing[row.pop("name")]: row for row in rows}
+		for key in missing.values():
+			cache[key] = _with_available_qty(fetched.get(key) or frappe._dict.fromkeys(QTY_FIELDS, 0.0))
+
+	return {key: cache[key] for key in keys}
+
+
+def get_availability_any_year(pairs):
+	"""Returns available quantities for (item_code, warehouse) pairs, summed over every production year."""
+	pairs = set(pairs)
+	if not pairs:
+		return {}
+
+	rows = frappe.db.sql(f"""
+		SELECT item_code, warehouse, {", ".join(f"SUM({field}) AS {field}" for field in QTY_FIELDS)}
+		FROM `tabItem Availability`
+		WHERE (item_code, warehouse) IN ({", ".join(["(%s, %s)"] * len(pairs))})
+		GROUP BY item_code, warehouse
+	""", [value for pair in pairs for value in pair], as_dict=True)
+
+	fetched = {(row.pop("item_code"), row.pop("warehouse")): row for row in rows}
+	return {
+		pair: _with_available_qty(fetched.get(pair) or frappe._dict.fromkeys(QTY_FIELDS, 0.0))
+		for pair in pairs
+	}
+
+
+def get_item_totals(item_code, production_year):
+	"""Returns the quantities of an item / production year summed over all warehouses."""
+	return frappe.db.sql("""
+		SELECT
+			IFNULL(SUM(actual_qty), 0) AS actual_qty,
+			IFNULL(SUM(qty_to_deliver), 0) AS qty_to_deliver,
+			IFNULL(SUM(future_qty_to_deliver), 0) AS future_qty_to_deliver,
+			IFNULL(SUM(virtual_receipt_qty), 0) AS virtual_receipt_qty
+		FROM `tabItem Availability`
+		WHERE item_code = %s AND production_year = %s
+	""", (item_code, production_year or ""), as_dict=True)[0]
+
+
+def get_item_availability(item_code, production_year, warehouse, memo=False):
+	key = (item_code, production_year or "", warehouse)
+	return get_availability([key], memo=memo)[key]
+
+
+def _with_available_qty(row):
+	# reservations against future receipts that the virtual receipts cannot cover eat into actual stock
+	uncovered_future_qty = max(flt(row.future_qty_to_deliver) - flt(row.virtual_receipt_qty), 0)
+	row.actual_available_qty = flt(row.actual_qty) - flt(row.qty_to_deliver) - uncovered_future_qty
+	row.future_available_qty = (
+		flt(row.actual_qty) + flt(row.virtual_receipt_qty) - flt(row.qty_to_deliver) - flt(row.future_qty_to_deliver)
+	)
+	return row
@@ -0,0 +1,113 @@
+"""Compares libya_customizations.availability with the per-row ledger query it replaced.
+
+bench --site [site] execute libya_customizations.benchmarks.availability.run --kwargs "{'warehouse': 'Stores - LC', 'limit': 150}"
+"""
+
+import time
+
+import frappe
+from frappe.utils import flt
+
+from libya_customizations.availability import get_availability
+
+
+def run(warehouse, limit=150, rounds=5):
+	keys = frappe.db.sql("""
+		SELECT item_code, production_year, warehouse
+		FROM `tabItem Availability`
+		WHERE warehouse = %s
+		ORDER BY actual_qty DESC
+		LIMIT %s
+	""", (warehouse, int(limit)))
+	if not keys:
+		frappe.throw(f"No Item Availability rows found for warehouse {warehouse}")
+
+	legacy = _timed(rounds, lambda: {key: get_legacy_availability(*key) for key in keys})
+	batched = _timed(rounds, lambda: get_availability(keys))
+
+	mismatches = [
+		key for key in keys
+		if flt(legacy["result"][key].actual_available_qty, 6) != flt(batched["result"][key].actual_available_qty, 6)
+		or flt(legacy["result"][key].future_available_qty, 6) != flt(batched["result"][key].future_available_qty, 6)
+	]
+
+	result = {
+		"keys": len(keys),
+		"rounds": rounds,
+		"legacy_seconds": legacy["seconds"],
+		"batched_seconds": batched["seconds"],
+		"speedup": legacy["seconds"] / batched["seconds"] if batched["seconds"] else None,
+		"mismatches": mismatches,
+	}
+	print(result)
+	return result
+
+
+def get_legacy_availability(item_code, production_year, warehouse):
+	"""The per-row availability query Sales Order and Purchase Receipt Management used to run."""
+	values = {
+		"item_code": item_code,
+		"production_year": production_year or "",
+		"warehouse": warehouse,
+		"future": "Reserve against Future Receipts",
+	}
+	stock = frappe.db.sql("""
+		SELECT COALESCE(SUM(actual_qty), 0)
+		FROM `tabStock Ledger Entry`
+		WHERE is_cancelled = 0
+			AND item_code = %(item_code)s
+			AND IFNULL(production_year, '') = %(production_year)s
+			AND warehouse = %(warehouse)s
+	""", values)[0][0]
+	virtual = frappe.db.sql("""
+		SELECT COALESCE(SUM(purchase_receipt_item.qty), 0)
+		FROM `tabPurchase Receipt Item` purchase_receipt_item
+		INNER JOIN `tabPurchase Receipt` purchase_receipt ON purchase_receipt_item.parent = purchase_receipt.name
+		WHERE purchase_receipt_item.docstatus = 0
+			AND purchase_receipt.docstatus = 0
+			AND purchase_receipt.virtual_receipt = 1
+			AND purchase_receipt_item.item_code = %(item_code)s
+			AND IFNULL(purchase_receipt_item.production_year, '') = %(production_year)s
+			AND purchase_receipt_item.warehouse = %(warehouse)s
+	""", values)[0][0]
+	actual_to_deliver, future_to_deliver = frappe.db.sql("""
+		SELECT
+			COALESCE(SUM(IF(reservation_status NOT IN (%(future)s), qty_to_deliver, 0)), 0),
+			COALESCE(SUM(IF(reservation_status IN (%(future)s), qty_to_deliver, 0)), 0)
+		FROM (
+			SELECT
+				sales_order.reservation_status,
+				sales_order_item.item_code,
+				IFNULL(sales_order_item.production_year, '') AS production_year,
+				sales_order.set_warehouse,
+				IF(SUM(sales_order_item.qty - sales_order_item.delivered_qty) > 0,
+					SUM(sales_order_item.qty - sales_order_item.delivered_qty), 0) AS qty_to_deliver
+			FROM `tabSales Order Item` sales_order_item
+			INNER JOIN `tabSales Order` sales_order ON sales_order_item.parent = sales_order.name
+			INNER JOIN `tabItem` item ON sales_order_item.item_code = item.name
+			WHERE sales_order.docstatus = 1
+				AND sales_order_item.docstatus = 1
+				AND sales_order.status NOT IN ('Completed', 'Closed')
+				AND (sales_order_item.qty - sales_order_item.delivered_qty) > 0
+				AND item.is_stock_item = 1
+			GROUP BY sales_order.reservation_status, sales_order_item.item_code,
+				IFNULL(sales_order_item.production_year, ''), sales_order.set_warehouse
+		) sales_order_item
+		WHERE item_code = %(item_code)s
+			AND production_year = %(production_year)s
+			AND set_warehouse = %(warehouse)s
+	""", values)[0]
+
+	stock, virtual = flt(stock), flt(virtual)
+	actual_to_deliver, future_to_deliver = flt(actual_to_deliver), flt(future_to_deliver)
+	return frappe._dict(
+		actual_available_qty=stock - actual_to_deliver - max(future_to_deliver - virtual, 0),
+		future_available_qty=stock + virtual - actual_to_deliver - future_to_deliver,
+	)
+
+
+def _timed(rounds, fn):
+	result, start = None, time.perf_counter()
+	for _ in range(rounds):
+		result = fn()
+	return {"result": result, "seconds": (time.perf_counter() - start) / rounds}
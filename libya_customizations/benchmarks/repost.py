@@ -0,0 +1,89 @@
+"""Measures repost throughput, in ledger entries per second, for the baseline and the current override.
+
+The baseline is the override this app shipped before the repost work, loaded from git at BASELINE_COMMIT
+and run through the upstream build; the current override also swaps build and the entry fetches.
+Needs the app installed from its git checkout.
+
+Every run reposts the item / warehouse inside a transaction that is rolled back afterwards.
+
+bench --site [site] execute libya_customizations.benchmarks.repost.run --kwargs "{'item_code': 'ITEM-0001', 'warehouse': 'Stores - LC'}"
+"""
+
+import os
+import subprocess
+import time
+import types
+
+import frappe
+from erpnext.stock.stock_ledger import update_entries_after
+
+from libya_customizations.overrides import repost_sl
+
+# the commit whose overrides/repost_sl.py wrote every entry back with db_update and refreshed its Item Price
+BASELINE_COMMIT = "d0ee224"
+BASELINE_PATH = "libya_customizations/overrides/repost_sl.py"
+
+
+def run(item_code, warehouse, posting_date="1900-01-01", rounds=3):
+	args = frappe._dict(item_code=item_code, warehouse=warehouse, posting_date=posting_date, posting_time="00:00:00")
+	entries = frappe.db.count(
+		"Stock Ledger Entry",
+		{"item_code": item_code, "warehouse": warehouse, "is_cancelled": 0, "posting_date": (">=", posting_date)},
+	)
+	if not entries:
+		frappe.throw(f"No Stock Ledger Entries found for {item_code} in {warehouse}")
+
+	implementations = {
+		"baseline": {
+			"build": repost_sl._build,
+			"get_future_entries_to_fix": repost_sl._get_future_entries_to_fix,
+			"get_dependent_entries_to_fix": repost_sl._get_dependent_entries_to_fix,
+			"process_sle": load_baseline().process_sle,
+		},
+		"override": {
+			"build": repost_sl.build,
+			"get_future_entries_to_fix": repost_sl.get_future_entries_to_fix,
+			"get_dependent_entries_to_fix": repost_sl.get_dependent_entries_to_fix,
+			"process_sle": repost_sl.process_sle,
+		},
+	}
+
+	result = {"entries": entries, "rounds": rounds}
+	for label, methods in implementations.items():
+		seconds = _timed(rounds, args, methods)
+		result[f"{label}_entries_per_second"] = entries / seconds if seconds else None
+
+	print(result)
+	return result
+
+
+def load_baseline():
+	"""The baseline repost_sl module, read from the app's git history instead of shipping a copy."""
+	app_root = os.path.dirname(frappe.get_app_path("libya_customizations"))
+	source = subprocess.run(
+		["git", "show", f"{BASELINE_COMMIT}:{BASELINE_PATH}"],
+		cwd=app_root,
+		capture_output=True,
+		text=True,
+		check=True,
+	).stdout
+	module = types.ModuleType("baseline_repost_sl")
+	exec(compile(source, f"{BASELINE_COMMIT}:{BASELINE_PATH}", "exec"), module.__dict__)
+	return module
+
+
+def _timed(rounds, args, methods):
+	current = {name: getattr(update_entries_after, name) for name in methods}
+	for name, method in methods.items():
+		setattr(update_entries_after, name, method)
+	try:
+		total = 0
+		for _ in range(rounds):
+			start = time.perf_counter()
+			update_entries_after(args, allow_negative_stock=True)
+			total += time.perf_counter() - start
+			frappe.db.rollback()
+		return total / rounds
+	finally:
+		for name, method in current.items():
+			setattr(update_entries_after, name, method)
@@ -0,0 +1,171 @@
+import json
+import time
+
+import frappe
+from frappe.utils import flt, nowdate
+
+
+# the figures are dropped by the doc_events below whenever they change, the TTL only bounds memory
+CACHE_TTL = 6 * 60 * 60
+STATS_KEY = "customer_metrics_stats"
+
+
+def get_cache_key(customer):
+	# overdue figures move with the date, so a new day never reuses yesterday's entry
+	return f"customer_metrics:{nowdate()}:{customer}"
+
+
+def get_customer_metrics(customer):
+	"""Returns the credit figures of a customer, from Redis when they are cached."""
+	if not customer:
+		return {}
+	return get_customers_metrics([customer]).get(customer, {})
+
+
+def get_customers_metrics(customers):
+	"""Returns the credit figures of many customers keyed by customer.
+
+	Cached customers come from Redis, the rest are computed together with
+	`query_customers_info` and cached for the next lookup.
+	"""
+	metrics, missing = {}, []
+	for customer in set(filter(None, customers)):
+		cached_data = frappe.cache().get_value(get_cache_key(customer))
+		if cached_data:
+			metrics[customer] = json.loads(cached_data)
+		else:
+			missing.append(customer)
+
+	if metrics:
+		_count("hits", len(metrics))
+	if not missing:
+		return metrics
+
+	start = time.perf_counter()
+	rows = query_customers_info(missing)
+	_count("misses", len(missing))
+	_count("recompute_ms", (time.perf_counter() - start) * 1000)
+
+	for row in rows:
+		customer = row.pop("customer")
+		metrics[customer] = row
+		frappe.cache().set_value(get_cache_key(customer), json.dumps(row), expires_in_sec=CACHE_TTL)
+	return metrics
+
+
+def query_customers_info(customers):
+	"""The `get_customer_info` figures of many customers, each subquery grouped by customer."""
+	return frappe.db.sql("""
+		SELECT
+			customer.name AS customer,
+			customer.customer_balance,
+			customer.customer_actual_overdues,
+			customer.customer_potential_overdues,
+			customer.customer_credit_limit,
+			customer.unbilled_sales_orders,
+			IF((customer.customer_balance + customer.unbilled_sales_orders > customer.customer_credit_limit AND customer.customer_credit_limit > 0) OR customer.customer_actual_overdues > 0, '#FF0000',
+				IF((customer.customer_balance + customer.unbilled_sales_orders > customer.customer_credit_limit * 0.85 AND customer.customer_credit_limit > 0) OR customer.customer_potential_overdues > 0, '#FFA500', '#008000')) AS customer_index
+		FROM (
+			SELECT
+				customer.name,
+				COALESCE(gl_entry.customer_balance, 0) AS customer_balance,
+				COALESCE(sales_invoice.customer_actual_overdues, 0) AS customer_actual_overdues,
+				COALESCE(sales_invoice.customer_potential_overdues, 0) AS customer_potential_overdues,
+				COALESCE(customer_credit_limit.customer_credit_limit, 0) AS customer_credit_limit,
+				COALESCE(sales_order_item.unbilled_sales_orders, 0) AS unbilled_sales_orders
+			FROM `tabCustomer` customer
+			LEFT JOIN (
+				SELECT party AS customer, SUM(debit - credit) AS customer_balance
+				FROM `tabGL Entry`
+				WHERE is_cancelled = 0
+					AND party_type = 'Customer'
+					AND party IN %(customers)s
+				GROUP BY party
+			) gl_entry ON gl_entry.customer = customer.name
+			LEFT JOIN (
+				SELECT
+					sales_invoice.customer,
+					SUM(IF(DATE(DATE_ADD(NOW(), INTERVAL 2 HOUR)) >= DATE_ADD(sales_invoice.posting_date, INTERVAL credit_days.credit_days DAY),
+						sales_invoice.outstanding_amount, 0)) AS customer_actual_overdues,
+					SUM(IF(DATE(DATE_ADD(NOW(), INTERVAL 2 HOUR)) < DATE_ADD(sales_invoice.posting_date, INTERVAL credit_days.credit_days DAY)
+						AND DATE(DATE_ADD(NOW(), INTERVAL 2 HOUR)) >= DATE_ADD(sales_invoice.posting_date, INTERVAL FLOOR(credit_days.credit_days * 0.85) DAY),
+						sales_invoice.outstanding_amount, 0)) AS customer_potential_overdues
+				FROM `tabSales Invoice` sales_invoice
+				LEFT JOIN (
+					SELECT customer.name, COALESCE(payment_terms_template_detail.credit_days, 0) AS credit_days
+					FROM `tabCustomer` customer
+					LEFT JOIN `tabPayment Terms Template Detail` payment_terms_template_detail
+						ON customer.payment_terms = payment_terms_template_detail.parent
+					WHERE customer.name IN %(customers)s
+				) credit_days ON sales_invoice.customer = credit_days.name
+				WHERE sales_invoice.docstatus = 1
+					AND sales_invoice.is_return = 0
+					AND sales_invoice.outstanding_amount > 0
+					AND sales_invoice.customer IN %(customers)s
+				GROUP BY sales_invoice.customer
+			) sales_invoice ON sales_invoice.customer = customer.name
+			LEFT JOIN (
+				SELECT parent AS customer, SUM(credit_limit) AS customer_credit_limit
+				FROM `tabCustomer Credit Limit`
+				WHERE parenttype = 'Customer'
+					AND parent IN %(customers)s
+				GROUP BY parent
+			) customer_credit_limit ON customer_credit_limit.customer = customer.name
+			LEFT JOIN (
+				SELECT
+					sales_order.customer,
+					SUM((sales_order_item.amount - sales_order_item.billed_amt) * sales_order.grand_total / sales_order.total) AS unbilled_sales_orders
+				FROM `tabSales Order Item` sales_order_item
+				INNER JOIN `tabSales Order` sales_order ON sales_order_item.parent = sales_order.name
+				WHERE sales_order_item.docstatus = 1
+					AND sales_order.docstatus = 1
+					AND sales_order.status NOT IN ('Closed', 'Completed')
+					AND sales_order_item.amount - sales_order_item.billed_amt > 0
+					AND sales_order.customer IN %(customers)s
+				GROUP BY sales_order.customer
+			) sales_order_item ON sales_order_item.customer = customer.name
+			WHERE customer.name IN %(customers)s
+		) customer
+	""", {"customers": list(customers)}, as_dict=True)
+
+
+def invalidate_customer_metrics(doc, method=None):
+	"""doc_events handler dropping the cached figures of the customer a document belongs to."""
+	if doc.doctype == "GL Entry":
+		customer = doc.party if doc.party_type == "Customer" else None
+	elif doc.doctype == "Customer":
+		customer = doc.name
+	else:
+		customer = doc.get("customer")
+
+	if not customer:
+		return
+
+	cache_key = get_cache_key(customer)
+	frappe.cache().delete_value(cache_key)
+	# a request reading the figures before this transaction commits would cache the old ones again
+	frappe.db.after_commit.add(lambda: frappe.cache().delete_value(cache_key))
+
+
+@frappe.whitelist()
+def get_cache_stats():
+	"""Hit ratio and average recompute latency of the customer metrics cache."""
+	frappe.only_for("System Manager")
+
+	stats = {field: flt((frappe.cache().get(_stats_key(field)) or b"0").decode()) for field in ("hits", "misses", "recompute_ms")}
+	lookups = stats["hits"] + stats["misses"]
+	return {
+		"hits": int(stats["hits"]),
+		"misses": int(stats["misses"]),
+		"hit_ratio": stats["hits"] / lookups if lookups else 0,
+		"avg_recompute_ms": stats["recompute_ms"] / stats["misses"] if stats["misses"] else 0,
+	}
+
+
+def _stats_key(field):
+	return frappe.cache().make_key(f"{STATS_KEY}:{field}")
+
+
+def _count(field, amount=1):
+	# plain redis counters so concurrent workers add up without losing increments
+	frappe.cache().incrbyfloat(_stats_key(field), amount)
@@ -1,35 +1,368 @@
+import json
+import time
+
 import frappe
+from frappe.utils import add_to_date, cint, get_datetime, now, time_diff_in_seconds
+from erpnext.accounts.doctype.unreconcile_payment.unreconcile_payment import (
+    create_unreconcile_doc_for_selection,
+    get_linked_payments_for_doc,
+)
+from erpnext.stock.doctype.repost_item_valuation.repost_item_valuation import (
+    get_repost_item_valuation_entries,
+    in_configured_timeslot,
+    repost,
+)
+from libya_customizations.utils import get_reconciliation_candidates, reconcile_payments
+
+# customers per background job when the reconciliation run fans out
+RECONCILIATION_CHUNK_SIZE = 25
+# modified timestamp up to which the ledger has been checked for variances
+VARIANCE_WATERMARK_KEY = "stock_ledger_variance_watermark"
+
+# adaptive repost scheduling, intervals in minutes
+REPOST_LAST_RUN_KEY = "repost_item_valuation_last_run"
+REPOST_BUSY_INTERVAL = 5
+REPOST_CATCH_UP_INTERVAL = 1
+REPOST_CATCH_UP_BACKLOG = 20
+REPOST_CATCH_UP_AGE = 60
+REPOSTS_PER_RUN = 10
+# seconds a run may take, past which a repost left In Progress is taken for a dead worker's
+REPOST_RUN_TIMEOUT = 3600
+
 def repost_incorrect_sles():
+    """Daily: reposts the vouchers whose ledger entries disagree with the running totals of their
+    item / warehouse, checking only the item / warehouses touched since the previous scan."""
+    scan_started = now()
+    watermark = frappe.db.get_global(VARIANCE_WATERMARK_KEY)
     stock_closing_date = frappe.db.get_single_value('Stock Settings', 'stock_frozen_upto')
     company = frappe.db.get_default('Company')
 
-    voucher_set = set()
+    vouchers = get_ledger_variances(company, watermark, stock_closing_date)
+    pending = {
+        (repost.voucher_type, repost.voucher_no)
+        for repost in frappe.get_all(
+            "Repost Item Valuation",
+            {"docstatus": 1, "based_on": "Transaction", "status": ["in", ["Queued", "In Progress"]]},
+            ["voucher_type", "voucher_no"],
+        )
+    }
+
+    for voucher in vouchers:
+        if (voucher.voucher_type, voucher.voucher_no) in pending:
+            continue
 
-    for diff_filter in ['Qty', 'Value', 'Valuation']:
-        result = frappe.call(
-            "frappe.desk.query_report.run",
-            report_name="Stock Ledger Variance",
-            filters={"company": company, "difference_in": diff_filter},
-            ignore_prepared_report=True
+        posting_datetime = get_datetime(voucher.posting_datetime)
+        repost_entry = frappe.get_doc({
+            'doctype': 'Repost Item Valuation',
+            'based_on': 'Transaction',
+            'posting_date': posting_datetime.date(),
+            'posting_time': posting_datetime.time(),
+            'voucher_type': voucher.voucher_type,
+            'voucher_no': voucher.voucher_no
+        })
+        repost_entry.insert()
+        repost_entry.submit()
+        frappe.db.commit()
+
+    frappe.db.set_global(VARIANCE_WATERMARK_KEY, scan_started)
+    frappe.db.commit()
+
+
+def get_ledger_variances(company, modified_after=None, stock_closing_date=None):
+    """The first voucher with a qty, value or valuation variance after the closing date in each
+    item / warehouse ledger with entries modified after `modified_after` (all when not set).
+
+    The variances are the ones the Stock Ledger Variance report checks: qty_after_transaction and
+    stock_value against the running sums of actual_qty and stock_value_difference, and the valuation
+    rate against stock_value / qty_after_transaction. A Stock Reconciliation sets the qty and value
+    outright, so the running sums start over from each reconciliation entry.
+    """
+    return frappe.db.sql(f"""
+        WITH touched AS (
+            SELECT DISTINCT item_code, warehouse
+            FROM `tabStock Ledger Entry`
+            WHERE company = %(company)s
+                {"AND modified > %(modified_after)s" if modified_after else ""}
+        ),
+        entries AS (
+            SELECT
+                sle.item_code,
+                sle.warehouse,
+                sle.voucher_type,
+                sle.voucher_no,
+                sle.posting_date,
+                sle.posting_time,
+                sle.creation,
+                sle.qty_after_transaction,
+                sle.stock_value,
+                sle.valuation_rate,
+                IF(sle.voucher_type = 'Stock Reconciliation', sle.qty_after_transaction, sle.actual_qty) AS qty_step,
+                IF(sle.voucher_type = 'Stock Reconciliation', sle.stock_value, sle.stock_value_difference) AS value_step,
+                -- entries from one reconciliation up to the next
+                SUM(sle.voucher_type = 'Stock Reconciliation') OVER (
+                    PARTITION BY sle.item_code, sle.warehouse
+                    ORDER BY sle.posting_date, sle.posting_time, sle.creation
+                    ROWS UNBOUNDED PRECEDING
+                ) AS reconciliation_count
+            FROM `tabStock Ledger Entry` sle
+            INNER JOIN touched ON sle.item_code = touched.item_code AND sle.warehouse = touched.warehouse
+            WHERE sle.is_cancelled = 0
+                AND sle.company = %(company)s
+        ),
+        ledger AS (
+            SELECT
+                item_code,
+                warehouse,
+                voucher_type,
+                voucher_no,
+                posting_date,
+                posting_time,
+                creation,
+                qty_after_transaction - SUM(qty_step) OVER running AS difference_in_qty,
+                stock_value - SUM(value_step) OVER running AS diff_value_diff,
+                IF(qty_after_transaction = 0, 0, valuation_rate - stock_value / qty_after_transaction) AS valuation_diff
+            FROM entries
+            WINDOW running AS (
+                PARTITION BY item_code, warehouse, reconciliation_count
+                ORDER BY posting_date, posting_time, creation
+                ROWS UNBOUNDED PRECEDING
+            )
+        ),
+        variances AS (
+            SELECT
+                voucher_type,
+                voucher_no,
+                TIMESTAMP(posting_date, posting_time) AS posting_datetime,
+                ROW_NUMBER() OVER (
+                    PARTITION BY item_code, warehouse
+                    ORDER BY posting_date, posting_time, creation
+                ) AS variance_index
+            FROM ledger
+            WHERE (ABS(difference_in_qty) > 0 OR ABS(diff_value_diff) > 0.0009 OR ABS(valuation_diff) > 0.0009)
+                {"AND posting_date > %(stock_closing_date)s" if stock_closing_date else ""}
         )
+        SELECT voucher_type, voucher_no, MIN(posting_datetime) AS posting_datetime
+        FROM variances
+        WHERE variance_index = 1
+        GROUP BY voucher_type, voucher_no
+        ORDER BY MIN(posting_datetime)
+    """, {"company": company, "modified_after": modified_after, "stock_closing_date": stock_closing_date}, as_dict=True)
+
+
+def schedule_repost_item_valuation():
+    """Every minute: starts a repost run when the backlog calls for one.
+
+    Nothing is started while the queue is empty. With a backlog a run starts every
+    REPOST_BUSY_INTERVAL minutes, and every REPOST_CATCH_UP_INTERVAL minutes once the backlog
+    grows past REPOST_CATCH_UP_BACKLOG requests or its oldest request past REPOST_CATCH_UP_AGE minutes.
+    """
+    backlog, oldest_minutes = get_repost_backlog()
+    if not backlog:
+        return
+
+    if backlog >= REPOST_CATCH_UP_BACKLOG or oldest_minutes >= REPOST_CATCH_UP_AGE:
+        interval = REPOST_CATCH_UP_INTERVAL
+    else:
+        interval = REPOST_BUSY_INTERVAL
+
+    last_run = frappe.db.get_global(REPOST_LAST_RUN_KEY)
+    if last_run and time_diff_in_seconds(now(), last_run) < interval * 60:
+        return
+
+    frappe.db.set_global(REPOST_LAST_RUN_KEY, now())
+    frappe.db.commit()
+    # one run at a time, so a worker never holds more than REPOSTS_PER_RUN reposts
+    frappe.enqueue(
+        "libya_customizations.events.run_repost_item_valuation",
+        queue="long",
+        timeout=REPOST_RUN_TIMEOUT,
+        job_id="run_repost_item_valuation",
+        deduplicate=True,
+    )
+
+
+def run_repost_item_valuation():
+    """Merges the pending reposts, runs up to `reposts_per_run` (site config) of them and logs the throughput."""
+    if not in_configured_timeslot() or repost_in_progress():
+        return
+
+    run_at = now()
+    backlog, oldest_minutes = get_repost_backlog()
+    skipped = plan_repost_item_valuations()
+    frappe.db.commit()
+
+    limit = cint(frappe.conf.get("reposts_per_run")) or REPOSTS_PER_RUN
+    frappe.flags.reposted_sle_count = 0
+    start = time.perf_counter()
+    processed = 0
+    for entry in get_repost_item_valuation_entries()[:limit]:
+        repost(frappe.get_doc("Repost Item Valuation", entry.name))
+        processed += 1
+    duration = time.perf_counter() - start
+
+    entries = frappe.flags.reposted_sle_count or 0
+    frappe.get_doc({
+        "doctype": "Repost Throughput Log",
+        "run_at": run_at,
+        "backlog": backlog,
+        "oldest_backlog_minutes": oldest_minutes,
+        "skipped_reposts": skipped,
+        "reposts_processed": processed,
+        "entries_reposted": entries,
+        "duration_seconds": duration,
+        "entries_per_minute": entries / duration * 60 if duration else 0,
+    }).insert(ignore_permissions=True)
+    frappe.db.commit()
+
+
+def repost_in_progress():
+    """Whether a repost is being run elsewhere, e.g. by a manual or leftover upstream repost_entries job.
+
+    A running repost saves its progress as it goes, so one not touched for REPOST_RUN_TIMEOUT
+    belongs to a worker that died and does not hold the queue back.
+    """
+    return bool(frappe.db.exists("Repost Item Valuation", {
+        "docstatus": 1,
+        "status": "In Progress",
+        "modified": (">", add_to_date(now(), seconds=-REPOST_RUN_TIMEOUT)),
+    }))
+
+
+def get_repost_backlog():
+    """Pending Repost Item Valuations and the age of the oldest one in minutes."""
+    backlog, oldest = frappe.db.sql("""
+        SELECT COUNT(*), MIN(creation)
+        FROM `tabRepost Item Valuation`
+        WHERE docstatus = 1 AND status IN ('Queued', 'In Progress')
+    """)[0]
+    return backlog, time_diff_in_seconds(now(), oldest) / 60 if oldest else 0
+
+
+def plan_repost_item_valuations():
+    """Skips queued Repost Item Valuations whose work another queued repost already does.
+
+    Running reposts are left out: nothing records when they started, so a request posted after a
+    running repost went past its date could not be told apart from one it still covers.
+
+    - queued item / warehouse reposts of the same key are merged into the first one, which is moved
+      back to the earliest posting date queued for that key
+    - voucher reposts whose item / warehouses all have such a merged repost are folded into it, and
+      repeated reposts of one voucher are merged into the earliest
+
+    Returns the number of skipped requests.
+    """
+    queued = frappe.get_all(
+        "Repost Item Valuation",
+        {"docstatus": 1, "status": "Queued"},
+        ["name", "based_on", "item_code", "warehouse", "voucher_type", "voucher_no", "posting_date", "posting_time"],
+        order_by="posting_date, posting_time, creation",
+    )
+    if not queued:
+        return 0
+
+    voucher_keys = get_voucher_item_warehouses({repost.voucher_no for repost in queued if repost.based_on == "Transaction"})
+    for repost in queued:
+        repost.start = get_datetime(f"{repost.posting_date} {repost.posting_time}")
+        if repost.based_on == "Transaction":
+            repost.keys = voucher_keys.get((repost.voucher_type, repost.voucher_no), set())
+        else:
+            repost.keys = {(repost.item_code, repost.warehouse)}
+
+    skipped = []
+    # the first queued item / warehouse repost of each key absorbs the others
+    earliest, survivors = {}, {}
+    for repost in queued:
+        for key in repost.keys:
+            earliest.setdefault(key, repost.start)
+    for repost in queued:
+        if repost.based_on == "Transaction":
+            continue
+        key = next(iter(repost.keys))
+        if key in survivors:
+            skipped.append(repost.name)
+        else:
+            survivors[key] = repost
+            if earliest[key] < repost.start:
+                frappe.db.set_value("Repost Item Valuation", repost.name, {
+                    "posting_date": earliest[key].date(),
+                    "posting_time": earliest[key].time(),
+                })
+
+    seen_vouchers = set()
+    for repost in queued:
+        if repost.based_on != "Transaction":
+            continue
+        voucher = (repost.voucher_type, repost.voucher_no)
+        if voucher in seen_vouchers or (repost.keys and repost.keys <= survivors.keys()):
+            skipped.append(repost.name)
+        seen_vouchers.add(voucher)
+
+    if skipped:
+        frappe.db.sql("""
+            UPDATE `tabRepost Item Valuation`
+            SET status = 'Skipped', modified = %s
+            WHERE name IN %s AND status = 'Queued'
+        """, (now(), skipped))
+    return len(skipped)
+
+
+def get_voucher_item_warehouses(voucher_nos):
+    """(item_code, warehouse) keys of each voucher's ledger entries, keyed by (voucher_type, voucher_no)."""
+    keys = {}
+    if not voucher_nos:
+        return keys
+
+    for voucher_type, voucher_no, item_code, warehouse in frappe.db.sql("""
+        SELECT DISTINCT voucher_type, voucher_no, item_code, warehouse
+        FROM `tabStock Ledger Entry`
+        WHERE voucher_no IN %s
+    """, (list(voucher_nos),)):
+        keys.setdefault((voucher_type, voucher_no), set()).add((item_code, warehouse))
+    return keys
+
+
+def auto_reconcile_payments():
+    """Daily (long): unreconciles payments from over-allocated invoices, then reconciles every
+    customer that has both outstanding invoices and unallocated credit, spread over background jobs."""
+    for invoice in frappe.get_all("Sales Invoice", [["is_return", "=", 0], ["docstatus", "=", 1], ["outstanding_amount", "<", 0]], ["name", "company"]):
+        for elem in get_linked_payments_for_doc(company=invoice.company, doctype="Sales Invoice", docname=invoice.name):
+            if elem.voucher_type != "Payment Entry":
+                continue
+            try:
+                create_unreconcile_doc_for_selection(selections=json.dumps([{
+                    "company": elem.company,
+                    "voucher_type": elem.voucher_type,
+                    "voucher_no": elem.voucher_no,
+                    "against_voucher_type": "Sales Invoice",
+                    "against_voucher_no": invoice.name,
+                }]))
+            except Exception:
+                continue
+    frappe.db.commit()
+
+    for company in frappe.get_all("Company", pluck="name"):
+        account = frappe.db.get_value("Company", company, "default_receivable_account")
+        if not account:
+            continue
+
+        customers = get_reconciliation_candidates(company, account)
+        for start in range(0, len(customers), RECONCILIATION_CHUNK_SIZE):
+            frappe.enqueue(
+                "libya_customizations.events.reconcile_customers",
+                queue="long",
+                company=company,
+                account=account,
+                customers=customers[start:start + RECONCILIATION_CHUNK_SIZE],
+            )
+
+
+def reconcile_customers(company, account, customers):
+    for customer in customers:
+        try:
+            reconcile_payments(company, account, customer)
+            frappe.db.commit()
+        except Exception:
+            frappe.db.rollback()
+            frappe.log_error(f"Payment reconciliation failed for {customer} ({account})")
 
-        for i in result.get("result", []):
-            if i.posting_date > stock_closing_date and (
-                abs(i.difference_in_qty) > 0
-                or abs(i.diff_value_diff) > 0.0009
-                or abs(i.valuation_diff) > 0.0009
-            ):
-                voucher = (i.voucher_type, i.voucher_no)
-                if voucher not in voucher_set:
-                    voucher_set.add(voucher)
-                    repost_entry = frappe.get_doc({
-                        'doctype': 'Repost Item Valuation',
-                        'based_on': 'Transaction',
-                        'posting_date': i.posting_date,
-                        'posting_time': i.posting_time,
-                        'voucher_type': i.voucher_type,
-                        'voucher_no': i.voucher_no
-                    })
-                    repost_entry.insert()
-                    repost_entry.submit()
-                    frappe.db.commit()
\ No newline at end of file
+    frappe.call("erpnext.accounts.doctype.process_payment_reconciliation.process_payment_reconciliation.trigger_reconciliation_for_queued_docs")
@@ -191,7 +191,10 @@ doc_events = {
     },
     "Item": {
         # "after_insert": "libya_customizations.server_script.Item.after_insert_item",
-        "on_update": "libya_customizations.server_script.Item.after_update_item"
+        "on_update": [
+            "libya_customizations.server_script.Item.after_update_item",
+            "libya_customizations.libya_customizations.doctype.sales_fact.sales_fact.update_item_brand"
+        ]
     },
     "Purchase Invoice":{
         "on_update": "libya_customizations.server_script.purchase_invoice.handle_title_change",
@@ -206,7 +209,8 @@ doc_events = {
             "libya_customizations.server_script.sales_invoice.after_submit_sales_invoice_dn",
             "libya_customizations.server_script.sales_invoice.after_submit_amended_sales_invoice",
 			"libya_customizations.server_script.sales_invoice.reconcile_payments",
-			"libya_customizations.server_script.sales_invoice.reconcile_everything"
+			"libya_customizations.customer_metrics.invalidate_customer_metrics",
+			"libya_customizations.libya_customizations.doctype.sales_fact.sales_fact.mark_sales_voucher"
         ],
         "before_cancel":[
             "libya_customizations.server_script.sales_invoice.before_cancel_sales_invoice_so",
@@ -219,38 +223,75 @@ doc_events = {
 			"libya_customizations.server_script.sales_invoice.delete_linked_payment_log",
 			"libya_customizations.server_script.sales_invoice.delete_linked_payment"
 		],
+        "on_cancel": [
+			"libya_customizations.customer_metrics.invalidate_customer_metrics",
+			"libya_customizations.libya_customizations.doctype.sales_fact.sales_fact.mark_sales_voucher"
+		],
         "on_update_after_submit": [
 			"libya_customizations.server_script.sales_invoice.create_payment",
 			"libya_customizations.server_script.sales_invoice.reconcile_payments",
-			"libya_customizations.server_script.sales_invoice.reconcile_everything"
+			"libya_customizations.customer_metrics.invalidate_customer_metrics"
 		]
     },
+    "Delivery Note": {
+        "on_submit": "libya_customizations.libya_customizations.doctype.sales_fact.sales_fact.mark_sales_voucher",
+        "on_cancel": "libya_customizations.libya_customizations.doctype.sales_fact.sales_fact.mark_sales_voucher"
+    },
     "Sales Order": {
         "on_submit": [
+            "libya_customizations.server_script.sales_order.update_item_availability",
             "libya_customizations.server_script.sales_order.after_submit_sales_order",
-            "libya_customizations.server_script.sales_order.update_prices"
+            "libya_customizations.server_script.sales_order.update_prices",
+            "libya_customizations.customer_metrics.invalidate_customer_metrics"
         ],
         "before_submit": [
             "libya_customizations.server_script.sales_order.validate_before_submit_sales_order",
             "libya_customizations.server_script.sales_order.before_submit_sales_order"
         ],
         "before_save": "libya_customizations.server_script.sales_order.before_save_sales_order",
-        "on_update_after_submit": ["libya_customizations.server_script.sales_order.after_update_after_submit_sales_order",
+        "on_update_after_submit": ["libya_customizations.server_script.sales_order.update_item_availability",
+            "libya_customizations.server_script.sales_order.after_update_after_submit_sales_order",
 			"libya_customizations.server_script.sales_order.validate_item_prices_after_submit",
 			"libya_customizations.server_script.sales_order.validate_before_submit_sales_order",
             "libya_customizations.server_script.sales_order.update_available_qty_on_sales_order",
+            "libya_customizations.customer_metrics.invalidate_customer_metrics",
 		],
         "on_cancel": [
+            "libya_customizations.server_script.sales_order.update_item_availability",
             "libya_customizations.server_script.sales_order.update_available_qty_on_sales_order",
-            "libya_customizations.server_script.sales_order.update_prices"
+            "libya_customizations.server_script.sales_order.update_prices",
+            "libya_customizations.customer_metrics.invalidate_customer_metrics"
         ]
     },
     "Purchase Receipt": {
-        "on_submit": "libya_customizations.server_script.purchase_receipt.on_submit",
-        "on_update_after_submit": "libya_customizations.server_script.purchase_receipt.on_update_after_submit"
+        "on_update": "libya_customizations.server_script.purchase_receipt.update_item_availability",
+        "on_submit": [
+            "libya_customizations.server_script.purchase_receipt.update_item_availability",
+            "libya_customizations.server_script.purchase_receipt.on_submit"
+        ],
+        "on_update_after_submit": "libya_customizations.server_script.purchase_receipt.on_update_after_submit",
+        "after_delete": "libya_customizations.server_script.purchase_receipt.update_item_availability"
+    },
+    "GL Entry": {
+        "on_submit": [
+            "libya_customizations.customer_metrics.invalidate_customer_metrics",
+            "libya_customizations.libya_customizations.doctype.account_balance_snapshot.account_balance_snapshot.mark_gl_entry"
+        ],
+        "on_cancel": [
+            "libya_customizations.customer_metrics.invalidate_customer_metrics",
+            "libya_customizations.libya_customizations.doctype.account_balance_snapshot.account_balance_snapshot.mark_gl_entry"
+        ]
+    },
+    "Customer": {
+        # credit limits are a child table of Customer
+        "on_update": "libya_customizations.customer_metrics.invalidate_customer_metrics"
     },
     "Stock Ledger Entry": {
-        "on_cancel": "libya_customizations.server_script.stock_ledger_entry.update_item_price"
+        "on_submit": "libya_customizations.server_script.stock_ledger_entry.update_item_availability",
+        "on_cancel": [
+            "libya_customizations.server_script.stock_ledger_entry.update_item_availability",
+            "libya_customizations.server_script.stock_ledger_entry.update_item_price"
+        ]
     }
 }
 
@@ -264,12 +305,22 @@ doc_events = {
 #     }
 # }
 scheduler_events = {
+	"cron": {
+		"* * * * *": [
+			"libya_customizations.utils.process_reconciliation_queue",
+			"libya_customizations.events.schedule_repost_item_valuation"
+		]
+	},
 # 	"all": [
 # 		"libya_customizations.tasks.all"
 # 	],
 	"daily": [
 		"libya_customizations.events.repost_incorrect_sles"
 	],
+	# the Auto-Payment Reconcilliation server script it replaces ran as Daily Long
+	"daily_long": [
+		"libya_customizations.events.auto_reconcile_payments"
+	],
 # 	"hourly": [
 # 		"libya_customizations.tasks.hourly"
 # 	],
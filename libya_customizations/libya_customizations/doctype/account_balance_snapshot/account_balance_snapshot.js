@@ -0,0 +1,8 @@
+// Copyright (c) 2026, Ahmed Zaytoon and contributors
+// For license information, please see license.txt
+
+// frappe.ui.form.on("Account Balance Snapshot", {
+// 	refresh(frm) {
+
+// 	},
+// });
@@ -0,0 +1,95 @@
+# Copyright (c) 2026, Ahmed Zaytoon and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import getdate, now
+
+from libya_customizations.report_cache import bump_table_version
+from libya_customizations.utils import HASHED_NAME_SEPARATOR, defer_until_commit, hashed_name
+
+# frappe.flags key collecting the (account, party_type, party, posting_date, is_opening) keys touched in a transaction
+DIRTY_KEYS_FLAG = "account_balance_snapshot_keys"
+
+
+class AccountBalanceSnapshot(Document):
+	pass
+
+
+def on_doctype_update():
+	frappe.db.add_index("Account Balance Snapshot", ["account", "posting_date"])
+	frappe.db.add_index("Account Balance Snapshot", ["party_type", "party", "posting_date"])
+
+
+def get_snapshot_key(account, party_type, party, posting_date, is_opening):
+	return (account, party_type or "", party or "", str(getdate(posting_date)), is_opening or "No")
+
+
+def get_snapshot_name(account, party_type, party, posting_date, is_opening):
+	# mirrored by SNAPSHOT_NAME in SQL, so rows written from Python and from INSERT ... SELECT share their names
+	return hashed_name(*get_snapshot_key(account, party_type, party, posting_date, is_opening))
+
+
+SNAPSHOT_NAME = """LEFT(SHA1(CONCAT_WS(%(separator)s, account, IFNULL(party_type, ''), IFNULL(party, ''),
+	posting_date, IFNULL(is_opening, 'No'))), 20)"""
+
+
+def mark_gl_entry(doc, method=None):
+	"""doc_events handler queueing the snapshot day of a GL Entry for a refresh before the transaction commits.
+
+	Cancellations flag the original entries with raw SQL and post reversing entries, so the
+	day is recomputed from the ledger rather than shifted by the entry's own amounts.
+	"""
+	defer_until_commit(
+		DIRTY_KEYS_FLAG,
+		[get_snapshot_key(doc.account, doc.party_type, doc.party, doc.posting_date, doc.is_opening)],
+		refresh_balance_snapshots,
+	)
+
+
+def refresh_balance_snapshots(keys):
+	"""Recomputes the snapshot rows of (account, party_type, party, posting_date, is_opening) keys from the ledger."""
+	keys = {get_snapshot_key(*key) for key in keys}
+	if not keys:
+		return
+
+	bump_table_version("Account Balance Snapshot")
+	names = [get_snapshot_name(*key) for key in keys]
+	frappe.db.delete("Account Balance Snapshot", {"name": ("in", names)})
+	_insert_from_ledger(
+		"AND account IN %(accounts)s AND posting_date IN %(dates)s",
+		"HAVING snapshot_name IN %(names)s",
+		{"accounts": list({key[0] for key in keys}), "dates": list({key[3] for key in keys}), "names": names},
+	)
+
+
+def rebuild_account_balance_snapshot():
+	"""Recomputes the whole table from the ledger.
+
+	bench --site [site] execute libya_customizations.libya_customizations.doctype.account_balance_snapshot.account_balance_snapshot.rebuild_account_balance_snapshot
+	"""
+	bump_table_version("Account Balance Snapshot")
+	frappe.db.delete("Account Balance Snapshot")
+	_insert_from_ledger()
+
+
+def _insert_from_ledger(conditions="", having="", values=None):
+	frappe.db.sql(f"""
+		INSERT INTO `tabAccount Balance Snapshot`
+			(name, creation, modified, owner, modified_by, account, party_type, party, posting_date, is_opening, debit, credit)
+		SELECT
+			{SNAPSHOT_NAME} AS snapshot_name,
+			%(timestamp)s, %(timestamp)s, %(user)s, %(user)s,
+			account,
+			IFNULL(party_type, '') AS party_type,
+			IFNULL(party, '') AS party,
+			posting_date,
+			IFNULL(is_opening, 'No') AS is_opening,
+			SUM(debit) AS debit,
+			SUM(credit) AS credit
+		FROM `tabGL Entry`
+		WHERE is_cancelled = 0
+			{conditions}
+		GROUP BY account, IFNULL(party_type, ''), IFNULL(party, ''), posting_date, IFNULL(is_opening, 'No')
+		{having}
+	""", {"separator": HASHED_NAME_SEPARATOR, "timestamp": now(), "user": frappe.session.user, **(values or {})})
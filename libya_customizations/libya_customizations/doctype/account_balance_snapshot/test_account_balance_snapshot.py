@@ -0,0 +1,56 @@
+# Copyright (c) 2026, Ahmed Zaytoon and Contributors
+# See license.txt
+
+import frappe
+from erpnext.accounts.doctype.journal_entry.test_journal_entry import make_journal_entry
+from frappe.utils import flt, today
+
+from libya_customizations.libya_customizations.doctype.account_balance_snapshot.account_balance_snapshot import (
+	rebuild_account_balance_snapshot,
+)
+from libya_customizations.tests.utils import LedgerTestCase
+
+ACCOUNTS = ("_Test Bank - _TC", "_Test Cash - _TC")
+
+
+class TestAccountBalanceSnapshot(LedgerTestCase):
+	def test_refresh_follows_the_ledger(self):
+		journal_entry = make_journal_entry(ACCOUNTS[0], ACCOUNTS[1], 250, posting_date=today(), submit=True)
+		self.run_before_commit()
+		self.assertEqual(get_snapshot(), get_ledger())
+
+		journal_entry.cancel()
+		self.run_before_commit()
+		self.assertEqual(get_snapshot(), get_ledger())
+
+	def test_rebuild_matches_refresh(self):
+		make_journal_entry(ACCOUNTS[0], ACCOUNTS[1], 100, posting_date=today(), submit=True)
+		make_journal_entry(ACCOUNTS[1], ACCOUNTS[0], 40, posting_date=today(), submit=True)
+		self.run_before_commit()
+		refreshed = get_snapshot()
+
+		rebuild_account_balance_snapshot()
+		self.assertEqual(get_snapshot(), refreshed)
+		self.assertEqual(refreshed, get_ledger())
+
+
+def get_snapshot():
+	return normalize(frappe.db.sql("""
+		SELECT account, party_type, party, posting_date, is_opening, debit, credit
+		FROM `tabAccount Balance Snapshot`
+		WHERE account IN %s AND posting_date = %s
+	""", (ACCOUNTS, today())))
+
+
+def get_ledger():
+	return normalize(frappe.db.sql("""
+		SELECT account, IFNULL(party_type, ''), IFNULL(party, ''), posting_date, IFNULL(is_opening, 'No'),
+			SUM(debit), SUM(credit)
+		FROM `tabGL Entry`
+		WHERE is_cancelled = 0 AND account IN %s AND posting_date = %s
+		GROUP BY account, IFNULL(party_type, ''), IFNULL(party, ''), posting_date, IFNULL(is_opening, 'No')
+	""", (ACCOUNTS, today())))
+
+
+def normalize(rows):
+	return sorted((*row[:5], flt(row[5], 2), flt(row[6], 2)) for row in rows)
@@ -6,8 +6,7 @@ from frappe.model.document import Document
 from frappe import _
 from frappe.utils import flt
 from libya_customizations.utils import update_remarks
-from libya_customizations.utils import reconcile_payments as reconcile_payments_entries
-from erpnext.accounts.doctype.process_payment_reconciliation.process_payment_reconciliation import trigger_reconciliation_for_queued_docs
+from libya_customizations.utils import queue_reconciliation
 
 
 class ClearingVoucher(Document):
@@ -102,7 +101,7 @@ class ClearingVoucher(Document):
 			for customer_info in party_info:
 				customer = customer_info['party']
 				account = customer_info['account']
-				reconcile_payments_entries(
+				queue_reconciliation(
 					customer=customer,
 					account=account,
 					company=company
@@ -110,6 +109,6 @@ class ClearingVoucher(Document):
 				
 
 	def reconcile_everything(self):
+		# the queued parties are reconciled by process_reconciliation_queue
 		self.reconcile_payments()
-		trigger_reconciliation_for_queued_docs()
 		
\ No newline at end of file
@@ -0,0 +1,174 @@
+# Copyright (c) 2026, Ahmed Zaytoon and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import flt, now
+
+from libya_customizations.utils import hashed_name
+
+FUTURE_RESERVATION = "Reserve against Future Receipts"
+QTY_FIELDS = ("actual_qty", "qty_to_deliver", "future_qty_to_deliver", "virtual_receipt_qty")
+# frappe.local.cache key of the per-request memo kept by libya_customizations.availability
+AVAILABILITY_MEMO_KEY = "item_availability"
+
+
+class ItemAvailability(Document):
+	pass
+
+
+def on_doctype_update():
+	frappe.db.add_index("Item Availability", ["item_code", "production_year", "warehouse"])
+
+
+def get_availability_name(item_code, production_year, warehouse):
+	return hashed_name(item_code, production_year, warehouse)
+
+
+def add_actual_qty(entries):
+	"""Shifts actual_qty by ledger quantities given as (item_code, production_year, warehouse, qty)."""
+	totals = {}
+	for item_code, production_year, warehouse, qty in entries:
+		key = (item_code, production_year or "", warehouse)
+		totals[key] = totals.get(key, 0) + flt(qty)
+
+	_upsert(
+		[
+			frappe._dict(item_code=key[0], production_year=key[1], warehouse=key[2], actual_qty=qty)
+			for key, qty in totals.items()
+			if qty
+		],
+		["actual_qty"],
+		increment=True,
+	)
+
+
+def refresh_reserved_qty(pairs):
+	"""Recomputes the open Sales Order reservations of (item_code, production_year) pairs in every warehouse."""
+	pairs = {(item_code, production_year or "") for item_code, production_year in pairs}
+	if not pairs:
+		return
+
+	_reset(pairs, ["qty_to_deliver", "future_qty_to_deliver"])
+	_upsert(
+		[row for row in get_reserved_qty(list({pair[0] for pair in pairs})) if (row.item_code, row.production_year) in pairs],
+		["qty_to_deliver", "future_qty_to_deliver"],
+	)
+
+
+def refresh_virtual_receipt_qty(pairs):
+	"""Recomputes the virtual receipt quantities of (item_code, production_year) pairs in every warehouse."""
+	pairs = {(item_code, production_year or "") for item_code, production_year in pairs}
+	if not pairs:
+		return
+
+	_reset(pairs, ["virtual_receipt_qty"])
+	_upsert(
+		[row for row in get_virtual_receipt_qty(list({pair[0] for pair in pairs})) if (row.item_code, row.production_year) in pairs],
+		["virtual_receipt_qty"],
+	)
+
+
+def rebuild_item_availability():
+	"""Recomputes the whole table from the ledgers.
+
+	bench --site [site] execute libya_customizations.libya_customizations.doctype.item_availability.item_availability.rebuild_item_availability
+	"""
+	frappe.db.delete("Item Availability")
+	_clear_memo()
+	_upsert(get_actual_qty(), ["actual_qty"])
+	_upsert(get_reserved_qty(), ["qty_to_deliver", "future_qty_to_deliver"])
+	_upsert(get_virtual_receipt_qty(), ["virtual_receipt_qty"])
+
+
+def get_actual_qty(item_codes=None):
+	return frappe.db.sql(f"""
+		SELECT item_code, IFNULL(production_year, '') AS production_year, warehouse, SUM(actual_qty) AS actual_qty
+		FROM `tabStock Ledger Entry`
+		WHERE is_cancelled = 0
+			{"AND item_code IN %(item_codes)s" if item_codes else ""}
+		GROUP BY item_code, IFNULL(production_year, ''), warehouse
+	""", {"item_codes": item_codes}, as_dict=True)
+
+
+def get_reserved_qty(item_codes=None):
+	return frappe.db.sql(f"""
+		SELECT
+			sales_order_item.item_code,
+			IFNULL(sales_order_item.production_year, '') AS production_year,
+			sales_order.set_warehouse AS warehouse,
+			-- an order without a reservation status reserves nothing, as NOT IN / IN left it out of both
+			SUM(IF(sales_order.reservation_status NOT IN (%(future)s), sales_order_item.qty - sales_order_item.delivered_qty, 0)) AS qty_to_deliver,
+			SUM(IF(sales_order.reservation_status IN (%(future)s), sales_order_item.qty - sales_order_item.delivered_qty, 0)) AS future_qty_to_deliver
+		FROM `tabSales Order Item` sales_order_item
+		INNER JOIN `tabSales Order` sales_order ON sales_order_item.parent = sales_order.name
+		INNER JOIN `tabItem` item ON sales_order_item.item_code = item.name
+		WHERE sales_order.docstatus = 1
+			AND sales_order_item.docstatus = 1
+			AND sales_order.status NOT IN ('Completed', 'Closed')
+			AND sales_order_item.qty - sales_order_item.delivered_qty > 0
+			AND item.is_stock_item = 1
+			{"AND sales_order_item.item_code IN %(item_codes)s" if item_codes else ""}
+		GROUP BY sales_order_item.item_code, IFNULL(sales_order_item.production_year, ''), sales_order.set_warehouse
+	""", {"future": FUTURE_RESERVATION, "item_codes": item_codes}, as_dict=True)
+
+
+def get_virtual_receipt_qty(item_codes=None):
+	return frappe.db.sql(f"""
+		SELECT
+			purchase_receipt_item.item_code,
+			IFNULL(purchase_receipt_item.production_year, '') AS production_year,
+			purchase_receipt_item.warehouse,
+			SUM(purchase_receipt_item.qty) AS virtual_receipt_qty
+		FROM `tabPurchase Receipt Item` purchase_receipt_item
+		INNER JOIN `tabPurchase Receipt` purchase_receipt ON purchase_receipt_item.parent = purchase_receipt.name
+		WHERE purchase_receipt_item.docstatus = 0
+			AND purchase_receipt.docstatus = 0
+			AND purchase_receipt.virtual_receipt = 1
+			AND purchase_receipt.is_return = 0
+			AND purchase_receipt_item.qty > 0
+			{"AND purchase_receipt_item.item_code IN %(item_codes)s" if item_codes else ""}
+		GROUP BY purchase_receipt_item.item_code, IFNULL(purchase_receipt_item.production_year, ''), purchase_receipt_item.warehouse
+	""", {"item_codes": item_codes}, as_dict=True)
+
+
+def _clear_memo():
+	frappe.local.cache.pop(AVAILABILITY_MEMO_KEY, None)
+
+
+def _reset(pairs, fields):
+	_clear_memo()
+	pairs = list(pairs)
+	frappe.db.sql(f"""
+		UPDATE `tabItem Availability`
+		SET {", ".join(f"`{field}` = 0" for field in fields)}
+		WHERE (item_code, production_year) IN ({", ".join(["(%s, %s)"] * len(pairs))})
+	""", [value for pair in pairs for value in pair])
+
+
+def _upsert(rows, fields, increment=False, chunk_size=1000):
+	_clear_memo()
+	columns = ["name", "creation", "modified", "owner", "modified_by", "item_code", "production_year", "warehouse", *fields]
+	if increment:
+		updates = [f"`{field}` = `{field}` + VALUES(`{field}`)" for field in fields]
+	else:
+		updates = [f"`{field}` = VALUES(`{field}`)" for field in fields]
+	updates.append("`modified` = VALUES(`modified`)")
+
+	timestamp = now()
+	for start in range(0, len(rows), chunk_size):
+		chunk = rows[start:start + chunk_size]
+		values = []
+		for row in chunk:
+			values.extend((
+				get_availability_name(row.item_code, row.production_year, row.warehouse),
+				timestamp, timestamp, frappe.session.user, frappe.session.user,
+				row.item_code, row.production_year or "", row.warehouse,
+				*(flt(row.get(field)) for field in fields),
+			))
+
+		frappe.db.sql(f"""
+			INSERT INTO `tabItem Availability` ({", ".join(f"`{column}`" for column in columns)})
+			VALUES {", ".join(["(" + ", ".join(["%s"] * len(columns)) + ")"] * len(chunk))}
+			ON DUPLICATE KEY UPDATE {", ".join(updates)}
+		""", values)
@@ -0,0 +1,91 @@
+# Copyright (c) 2026, Ahmed Zaytoon and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from erpnext.selling.doctype.sales_order.test_sales_order import make_sales_order
+from erpnext.stock.doctype.item.test_item import make_item
+from erpnext.stock.doctype.purchase_receipt.test_purchase_receipt import make_purchase_receipt
+from erpnext.stock.doctype.stock_entry.stock_entry_utils import make_stock_entry
+from frappe.tests.utils import FrappeTestCase
+
+from libya_customizations.availability import get_availability_any_year, get_item_availability
+from libya_customizations.libya_customizations.doctype.item_availability.item_availability import (
+	add_actual_qty,
+	get_actual_qty,
+)
+
+WAREHOUSE = "_Test Warehouse - _TC"
+
+
+class TestItemAvailability(FrappeTestCase):
+	def setUp(self):
+		self.item_code = make_item("_Test Item Availability Item", {"is_stock_item": 1}).name
+
+	def tearDown(self):
+		frappe.db.rollback()
+
+	def test_ledger_entries_move_actual_qty(self):
+		make_stock_entry(item_code=self.item_code, target=WAREHOUSE, qty=10, basic_rate=100)
+		stock_entry = make_stock_entry(item_code=self.item_code, source=WAREHOUSE, qty=3)
+		self.assertEqual(get_item_availability(self.item_code, None, WAREHOUSE).actual_qty, 7)
+		self.assert_matches_ledger()
+
+		stock_entry.cancel()
+		self.assertEqual(get_item_availability(self.item_code, None, WAREHOUSE).actual_qty, 10)
+		self.assert_matches_ledger()
+
+	@patch("libya_customizations.server_script.sales_order.update_prices")
+	@patch("libya_customizations.server_script.sales_order.before_submit_sales_order")
+	@patch("libya_customizations.server_script.sales_order.validate_before_submit_sales_order")
+	def test_sales_order_reserves_and_releases(self, *mocks):
+		make_stock_entry(item_code=self.item_code, target=WAREHOUSE, qty=10, basic_rate=100)
+		sales_order = make_sales_order(item_code=self.item_code, warehouse=WAREHOUSE, qty=4, do_not_save=True)
+		sales_order.set_warehouse = WAREHOUSE
+		sales_order.insert()
+		sales_order.submit()
+
+		balances = get_item_availability(self.item_code, None, WAREHOUSE)
+		self.assertEqual(balances.qty_to_deliver, 4)
+		self.assertEqual(balances.actual_available_qty, 6)
+
+		sales_order.cancel()
+		self.assertEqual(get_item_availability(self.item_code, None, WAREHOUSE).qty_to_deliver, 0)
+
+	@patch("libya_customizations.server_script.sales_order.update_prices")
+	@patch("libya_customizations.server_script.sales_order.before_submit_sales_order")
+	@patch("libya_customizations.server_script.sales_order.validate_before_submit_sales_order")
+	def test_only_explicit_reservation_statuses_reserve(self, *mocks):
+		make_stock_entry(item_code=self.item_code, target=WAREHOUSE, qty=10, basic_rate=100)
+		for reservation_status, qty in (("Reserve against Future Receipts", 2), (None, 3)):
+			sales_order = make_sales_order(item_code=self.item_code, warehouse=WAREHOUSE, qty=qty, do_not_save=True)
+			sales_order.set_warehouse = WAREHOUSE
+			sales_order.insert()
+			sales_order.db_set("reservation_status", reservation_status)
+			sales_order.submit()
+
+		balances = get_item_availability(self.item_code, None, WAREHOUSE)
+		self.assertEqual(balances.qty_to_deliver, 0)
+		self.assertEqual(balances.future_qty_to_deliver, 2)
+
+	def test_blank_production_year_reads_every_year(self):
+		add_actual_qty([(self.item_code, "2024", WAREHOUSE, 5), (self.item_code, "2025", WAREHOUSE, 2)])
+
+		self.assertEqual(get_item_availability(self.item_code, None, WAREHOUSE).actual_qty, 0)
+		self.assertEqual(get_availability_any_year([(self.item_code, WAREHOUSE)])[(self.item_code, WAREHOUSE)].actual_qty, 7)
+
+	def test_virtual_receipt_qty_follows_the_draft(self):
+		purchase_receipt = make_purchase_receipt(item_code=self.item_code, warehouse=WAREHOUSE, qty=5, do_not_save=True)
+		purchase_receipt.virtual_receipt = 1
+		purchase_receipt.insert()
+		self.assertEqual(get_item_availability(self.item_code, None, WAREHOUSE).virtual_receipt_qty, 5)
+
+		purchase_receipt.delete()
+		self.assertEqual(get_item_availability(self.item_code, None, WAREHOUSE).virtual_receipt_qty, 0)
+
+	def assert_matches_ledger(self):
+		for row in get_actual_qty([self.item_code]):
+			self.assertEqual(
+				get_item_availability(row.item_code, row.production_year, row.warehouse).actual_qty, row.actual_qty
+			)
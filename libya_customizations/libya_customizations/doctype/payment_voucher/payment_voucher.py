@@ -5,7 +5,7 @@ import frappe
 from frappe.model.document import Document
 from frappe.utils import flt
 from frappe import _
-from libya_customizations.utils import reconcile_payments as reconcile_payments_entries
+from libya_customizations.utils import queue_reconciliation
 from libya_customizations.utils import unreconcile_payments
 
 
@@ -119,8 +119,8 @@ class PaymentVoucher(Document):
 
 	def reconcile_payments(self):
 		if self.party_type == 'Customer':
-			reconcile_payments_entries(self.company, self.paid_to, self.party)
+			queue_reconciliation(self.company, self.paid_to, self.party)
 
 	def reconcile_everything(self):
-		self.reconcile_payments()
-		frappe.call("erpnext.accounts.doctype.process_payment_reconciliation.process_payment_reconciliation.trigger_reconciliation_for_queued_docs")
\ No newline at end of file
+		# the queued parties are reconciled by process_reconciliation_queue
+		self.reconcile_payments()
\ No newline at end of file
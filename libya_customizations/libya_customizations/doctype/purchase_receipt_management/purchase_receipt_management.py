@@ -7,18 +7,16 @@ from frappe.model.document import Document
 from openpyxl import Workbook
 from frappe.utils.file_manager import save_file
 from frappe.utils import get_site_path
+from libya_customizations.availability import get_availability
+from libya_customizations.server_script.purchase_receipt import update_item_availability
 
 class PurchaseReceiptManagement(Document):
 	pass
 
-def production_year_filter(column, value):
-	if value:
-		return f'AND {column} = "{value}"'
-	return f'AND ({column} IS NULL OR {column} = "")'
-
 @frappe.whitelist()
 def update_is_virtual(docname, virtual_receipt):
 	frappe.db.set_value('Purchase Receipt', docname, 'virtual_receipt', virtual_receipt)
+	update_item_availability(frappe.get_doc('Purchase Receipt', docname))
 	frappe.db.commit()
 
 @frappe.whitelist()
@@ -73,89 +71,18 @@ def submit_receipt(docname, posting_date):
 def get_values_for_validation(purchase_receipt):
 	doc = frappe.get_doc("Purchase Receipt", purchase_receipt)
 	entries = []
+	availability = get_availability(
+		[(row.item_code, row.production_year, doc.set_warehouse) for row in doc.items], memo=True
+	)
 
 	for row in doc.items:
-		production_filter = production_year_filter("production_year", row.production_year)
-
-		sql = frappe.db.sql(f"""
-			SELECT
-				IF(sales_future.future_qty_to_deliver > purchase_future.future_balance,
-					stock_actual.actual_balance - (sales_actual.actual_qty_to_deliver + (sales_future.future_qty_to_deliver - purchase_future.future_balance)),
-					stock_actual.actual_balance - sales_actual.actual_qty_to_deliver) AS actual_available_qty,
-				(stock_actual.actual_balance + purchase_future.future_balance) - (sales_actual.actual_qty_to_deliver + sales_future.future_qty_to_deliver) AS future_available_qty
-			FROM
-				(
-					SELECT COALESCE(SUM(actual_qty), 0) AS actual_balance
-					FROM `tabStock Ledger Entry`
-					WHERE is_cancelled = 0
-						AND item_code = "{row.item_code}"
-						{production_filter}
-						AND warehouse = "{doc.set_warehouse}"
-				) stock_actual
-			LEFT JOIN (
-				SELECT COALESCE(SUM(purchase_receipt_item.qty), 0) AS future_balance
-				FROM `tabPurchase Receipt Item` purchase_receipt_item
-				INNER JOIN `tabPurchase Receipt` purchase_receipt ON purchase_receipt_item.parent = purchase_receipt.name
-				WHERE purchase_receipt_item.docstatus = 0
-					AND purchase_receipt.docstatus = 0
-					AND purchase_receipt.virtual_receipt = 1
-					AND purchase_receipt_item.item_code = "{row.item_code}"
-					{production_filter}
-					AND purchase_receipt_item.warehouse = "{doc.set_warehouse}"
-			) purchase_future ON TRUE
-			LEFT JOIN (
-				SELECT COALESCE(SUM(qty_to_deliver), 0) AS actual_qty_to_deliver
-				FROM (
-					SELECT
-						sales_order_item.item_code,
-						sales_order_item.production_year,
-						sales_order.set_warehouse,
-						IF(SUM(sales_order_item.qty - sales_order_item.delivered_qty) > 0,
-							SUM(sales_order_item.qty - sales_order_item.delivered_qty), 0) AS qty_to_deliver
-					FROM `tabSales Order Item` sales_order_item
-					INNER JOIN `tabSales Order` sales_order ON sales_order_item.parent = sales_order.name
-					INNER JOIN `tabItem` item ON sales_order_item.item_code = item.name
-					WHERE sales_order.docstatus = 1
-						AND sales_order_item.docstatus = 1
-						AND sales_order.status NOT IN ('Completed', 'Closed')
-						AND sales_order.reservation_status NOT IN ('Reserve against Future Receipts')
-						AND (sales_order_item.qty - sales_order_item.delivered_qty) > 0
-						AND item.is_stock_item = 1
-					GROUP BY sales_order_item.item_code, sales_order_item.production_year, sales_order.set_warehouse
-				) sales_order_item
-				WHERE item_code = "{row.item_code}"
-					{production_filter}
-					AND set_warehouse = "{doc.set_warehouse}"
-			) sales_actual ON TRUE
-			LEFT JOIN (
-				SELECT COALESCE(SUM(qty_to_deliver), 0) AS future_qty_to_deliver
-				FROM (
-					SELECT
-						sales_order_item.item_code,
-						sales_order_item.production_year,
-						sales_order.set_warehouse,
-						IF(SUM(sales_order_item.qty - sales_order_item.delivered_qty) > 0,
-							SUM(sales_order_item.qty - sales_order_item.delivered_qty), 0) AS qty_to_deliver
-					FROM `tabSales Order Item` sales_order_item
-					INNER JOIN `tabSales Order` sales_order ON sales_order_item.parent = sales_order.name
-					INNER JOIN `tabItem` item ON sales_order_item.item_code = item.name
-					WHERE sales_order.docstatus = 1
-						AND sales_order_item.docstatus = 1
-						AND sales_order.status NOT IN ('Completed', 'Closed')
-						AND sales_order.reservation_status IN ('Reserve against Future Receipts')
-						AND (sales_order_item.qty - sales_order_item.delivered_qty) > 0
-						AND item.is_stock_item = 1
-					GROUP BY sales_order_item.item_code, sales_order_item.production_year, sales_order.set_warehouse
-				) sales_order_item
-				WHERE item_code = "{row.item_code}"
-					{production_filter}
-					AND set_warehouse = "{doc.set_warehouse}"
-			) sales_future ON TRUE
-		""", as_dict=True)
-
-		sql[0]["qty"] = row.qty
-		sql[0]["item_code"] = row.item_name
-		entries.append(sql[0])
+		balances = availability[(row.item_code, row.production_year or "", doc.set_warehouse)]
+		entries.append(frappe._dict({
+			"actual_available_qty": balances.actual_available_qty,
+			"future_available_qty": balances.future_available_qty,
+			"qty": row.qty,
+			"item_code": row.item_name,
+		}))
 
 	return entries
 
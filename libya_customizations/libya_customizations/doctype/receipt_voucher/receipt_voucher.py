@@ -3,7 +3,7 @@
 
 import frappe
 from frappe.model.document import Document
-from libya_customizations.utils import reconcile_payments as reconcile_payments_entries
+from libya_customizations.utils import queue_reconciliation
 from frappe import _
 from frappe.utils import flt
 from libya_customizations.utils import unreconcile_payments
@@ -156,11 +156,11 @@ class ReceiptVoucher(Document):
 
 	def reconcile_payments(self):
 		if self.party_type == 'Customer':
-			reconcile_payments_entries(self.company, self.paid_from, self.party)
+			queue_reconciliation(self.company, self.paid_from, self.party)
 
 	def reconcile_everything(self):
+		# the queued parties are reconciled by process_reconciliation_queue
 		self.reconcile_payments()
-		frappe.call("erpnext.accounts.doctype.process_payment_reconciliation.process_payment_reconciliation.trigger_reconciliation_for_queued_docs")
 
 	def update_status(self, status):
 		self.set("status", status)
\ No newline at end of file
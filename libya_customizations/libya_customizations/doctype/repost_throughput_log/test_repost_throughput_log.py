@@ -0,0 +1,49 @@
+# Copyright (c) 2026, Ahmed Zaytoon and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from erpnext.stock.doctype.item.test_item import make_item
+from erpnext.stock.doctype.stock_entry.stock_entry_utils import make_stock_entry
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_days, today
+
+from libya_customizations.events import run_repost_item_valuation
+from libya_customizations.tests.test_repost_planner import WAREHOUSE, get_status, make_repost
+
+
+@patch("libya_customizations.events.in_configured_timeslot", return_value=True)
+@patch("frappe.db.commit")
+class TestRepostThroughputLog(FrappeTestCase):
+	def setUp(self):
+		self.item_code = make_item("_Test Repost Throughput Item", {"is_stock_item": 1}).name
+		make_stock_entry(item_code=self.item_code, target=WAREHOUSE, qty=10, basic_rate=100, posting_date=add_days(today(), -3))
+
+	def tearDown(self):
+		frappe.db.rollback()
+
+	def test_run_logs_its_reposts(self, *mocks):
+		first = make_repost(item_code=self.item_code, posting_date=add_days(today(), -3))
+		second = make_repost(item_code=self.item_code, posting_date=add_days(today(), -2))
+		logs = frappe.db.count("Repost Throughput Log")
+
+		run_repost_item_valuation()
+
+		self.assertEqual(get_status(first.name), "Completed")
+		self.assertEqual(get_status(second.name), "Skipped")
+		self.assertEqual(frappe.db.count("Repost Throughput Log"), logs + 1)
+		log = frappe.get_last_doc("Repost Throughput Log")
+		self.assertEqual(log.skipped_reposts, 1)
+		self.assertEqual(log.reposts_processed, 1)
+		self.assertGreater(log.entries_reposted, 0)
+
+	def test_run_waits_for_a_repost_in_progress(self, *mocks):
+		make_repost(item_code=self.item_code, posting_date=add_days(today(), -3)).db_set("status", "In Progress")
+		queued = make_repost(item_code=self.item_code, posting_date=add_days(today(), -2))
+		logs = frappe.db.count("Repost Throughput Log")
+
+		run_repost_item_valuation()
+
+		self.assertEqual(get_status(queued.name), "Queued")
+		self.assertEqual(frappe.db.count("Repost Throughput Log"), logs)
@@ -0,0 +1,133 @@
+# Copyright (c) 2026, Ahmed Zaytoon and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import getdate, now
+
+from libya_customizations.report_cache import bump_table_version
+from libya_customizations.utils import HASHED_NAME_SEPARATOR, defer_until_commit
+
+# vouchers whose ledger entries make up the cost of sales
+SALES_VOUCHER_TYPES = ("Sales Invoice", "Delivery Note")
+# frappe.flags key collecting the (posting_date, item_code) keys touched in a transaction
+DIRTY_KEYS_FLAG = "sales_fact_keys"
+
+
+class SalesFact(Document):
+	pass
+
+
+def on_doctype_update():
+	frappe.db.add_index("Sales Fact", ["posting_date", "item_code"])
+	frappe.db.add_index("Sales Fact", ["customer", "posting_date"])
+
+
+def mark_sales_voucher(doc, method=None):
+	"""doc_events handler of Sales Invoice and Delivery Note queueing their days / items for a refresh."""
+	mark_sales_facts((doc.posting_date, row.item_code) for row in doc.items)
+
+
+def mark_sales_facts(keys):
+	"""Queues (posting_date, item_code) keys to be recomputed right before the transaction commits."""
+	defer_until_commit(
+		DIRTY_KEYS_FLAG,
+		((str(getdate(posting_date)), item_code) for posting_date, item_code in keys if item_code),
+		refresh_sales_facts,
+	)
+
+
+def update_item_brand(doc, method=None):
+	"""doc_events handler of Item carrying a brand change over to its facts."""
+	if doc.has_value_changed("brand"):
+		frappe.db.sql("UPDATE `tabSales Fact` SET brand = %s WHERE item_code = %s", (doc.brand, doc.name))
+		bump_table_version("Sales Fact")
+
+
+def refresh_sales_facts(keys, chunk_size=200):
+	"""Recomputes the facts of (posting_date, item_code) keys, for every customer and production year."""
+	keys = list({(str(getdate(posting_date)), item_code) for posting_date, item_code in keys})
+	if keys:
+		bump_table_version("Sales Fact")
+	for start in range(0, len(keys), chunk_size):
+		chunk = keys[start:start + chunk_size]
+		# facts are rewritten over dates x items, which covers every key of the chunk
+		values = {"dates": list({key[0] for key in chunk}), "item_codes": list({key[1] for key in chunk})}
+		frappe.db.sql("""
+			DELETE FROM `tabSales Fact`
+			WHERE posting_date IN %(dates)s AND item_code IN %(item_codes)s
+		""", values)
+		_insert_facts("AND {posting_date} IN %(dates)s AND {item_code} IN %(item_codes)s", values)
+
+
+def backfill_sales_facts(from_date=None):
+	"""Recomputes the facts from the invoices and the ledger, all of them or those posted since `from_date`.
+
+	bench --site [site] execute libya_customizations.libya_customizations.doctype.sales_fact.sales_fact.backfill_sales_facts
+	"""
+	bump_table_version("Sales Fact")
+	if from_date:
+		frappe.db.delete("Sales Fact", {"posting_date": (">=", from_date)})
+		_insert_facts("AND {posting_date} >= %(from_date)s", {"from_date": from_date})
+	else:
+		frappe.db.delete("Sales Fact")
+		_insert_facts()
+
+
+def _insert_facts(conditions="", values=None):
+	# `conditions` name the columns as {posting_date} / {item_code}, filled in for both sources
+	frappe.db.sql(f"""
+		INSERT INTO `tabSales Fact`
+			(name, creation, modified, owner, modified_by, posting_date, item_code, production_year, brand, customer, qty, net_amount, cogs)
+		SELECT
+			LEFT(SHA1(CONCAT_WS(%(separator)s, fact.posting_date, fact.item_code, fact.production_year, fact.customer)), 20),
+			%(timestamp)s, %(timestamp)s, %(user)s, %(user)s,
+			fact.posting_date,
+			fact.item_code,
+			fact.production_year,
+			item.brand,
+			fact.customer,
+			SUM(fact.qty),
+			SUM(fact.net_amount),
+			SUM(fact.cogs)
+		FROM (
+			SELECT
+				sales_invoice.posting_date,
+				sales_invoice_item.item_code,
+				IFNULL(sales_invoice_item.production_year, '') AS production_year,
+				sales_invoice.customer,
+				sales_invoice_item.qty,
+				sales_invoice_item.net_amount,
+				0 AS cogs
+			FROM `tabSales Invoice Item` sales_invoice_item
+			INNER JOIN `tabSales Invoice` sales_invoice ON sales_invoice_item.parent = sales_invoice.name
+			WHERE sales_invoice_item.docstatus = 1
+				AND sales_invoice.docstatus = 1
+				{conditions.format(posting_date="sales_invoice.posting_date", item_code="sales_invoice_item.item_code")}
+			UNION ALL
+			SELECT
+				stock_ledger_entry.posting_date,
+				stock_ledger_entry.item_code,
+				IFNULL(stock_ledger_entry.production_year, '') AS production_year,
+				IFNULL(sales_invoice.customer, delivery_note.customer) AS customer,
+				0 AS qty,
+				0 AS net_amount,
+				-stock_ledger_entry.stock_value_difference AS cogs
+			FROM `tabStock Ledger Entry` stock_ledger_entry
+			LEFT JOIN `tabSales Invoice` sales_invoice
+				ON stock_ledger_entry.voucher_type = 'Sales Invoice' AND stock_ledger_entry.voucher_no = sales_invoice.name
+			LEFT JOIN `tabDelivery Note` delivery_note
+				ON stock_ledger_entry.voucher_type = 'Delivery Note' AND stock_ledger_entry.voucher_no = delivery_note.name
+			WHERE stock_ledger_entry.is_cancelled = 0
+				AND stock_ledger_entry.voucher_type IN %(voucher_types)s
+				{conditions.format(posting_date="stock_ledger_entry.posting_date", item_code="stock_ledger_entry.item_code")}
+		) fact
+		LEFT JOIN `tabItem` item ON fact.item_code = item.name
+		GROUP BY fact.posting_date, fact.item_code, fact.production_year, fact.customer
+	""", {
+		"separator": HASHED_NAME_SEPARATOR,
+		"timestamp": now(),
+		"user": frappe.session.user,
+		"voucher_types": SALES_VOUCHER_TYPES,
+		**(values or {}),
+	})
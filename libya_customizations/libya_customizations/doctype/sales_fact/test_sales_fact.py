@@ -0,0 +1,66 @@
+# Copyright (c) 2026, Ahmed Zaytoon and Contributors
+# See license.txt
+
+import frappe
+from erpnext.stock.doctype.delivery_note.test_delivery_note import create_delivery_note
+from frappe.utils import flt, today
+
+from libya_customizations.libya_customizations.doctype.sales_fact.sales_fact import backfill_sales_facts
+from libya_customizations.tests.utils import WAREHOUSE, LedgerTestCase, make_stock_item, receive_stock
+
+
+class TestSalesFact(LedgerTestCase):
+	def setUp(self):
+		self.item_code = make_stock_item("_Test Sales Fact Item")
+
+	def test_refresh_follows_the_ledger(self):
+		receive_stock(self.item_code, 10, 100, days_ago=2)
+		delivery_note = create_delivery_note(item_code=self.item_code, warehouse=WAREHOUSE, qty=4, rate=300)
+		self.run_before_commit()
+		self.assertEqual(get_cogs(self.item_code), 400)
+		self.assertEqual(get_cogs(self.item_code), get_ledger_cogs(self.item_code))
+
+		delivery_note.cancel()
+		self.run_before_commit()
+		self.assertEqual(get_cogs(self.item_code), 0)
+
+	def test_repost_moves_the_cost_of_sales(self):
+		receive_stock(self.item_code, 10, 100, days_ago=2)
+		create_delivery_note(item_code=self.item_code, warehouse=WAREHOUSE, qty=4, rate=300)
+		# a cheaper receipt ahead of the delivery reposts its valuation
+		receive_stock(self.item_code, 10, 40, days_ago=3)
+		self.run_before_commit()
+		self.assertEqual(get_cogs(self.item_code), get_ledger_cogs(self.item_code))
+
+	def test_backfill_matches_refresh(self):
+		receive_stock(self.item_code, 10, 100, days_ago=2)
+		create_delivery_note(item_code=self.item_code, warehouse=WAREHOUSE, qty=3, rate=300)
+		create_delivery_note(item_code=self.item_code, warehouse=WAREHOUSE, qty=2, rate=250)
+		self.run_before_commit()
+		refreshed = get_facts(self.item_code)
+
+		backfill_sales_facts(from_date=today())
+		self.assertEqual(get_facts(self.item_code), refreshed)
+
+
+def get_facts(item_code):
+	return sorted(
+		(str(row.posting_date), row.production_year, row.customer, flt(row.qty), flt(row.net_amount, 2), flt(row.cogs, 2))
+		for row in frappe.get_all(
+			"Sales Fact",
+			{"item_code": item_code},
+			["posting_date", "production_year", "customer", "qty", "net_amount", "cogs"],
+		)
+	)
+
+
+def get_cogs(item_code):
+	return flt(sum(fact[5] for fact in get_facts(item_code)), 2)
+
+
+def get_ledger_cogs(item_code):
+	return -flt(frappe.db.sql("""
+		SELECT SUM(stock_value_difference)
+		FROM `tabStock Ledger Entry`
+		WHERE item_code = %s AND is_cancelled = 0 AND voucher_type IN ('Sales Invoice', 'Delivery Note')
+	""", (item_code,))[0][0], 2)
@@ -102,10 +102,9 @@ def execute(filters=None):
             SUM(credit) AS credit,
             NULL AS remarks
         FROM
-            `tabGL Entry`
+            `tabAccount Balance Snapshot`
         WHERE
-            is_cancelled = 0
-            AND is_opening = 'No'
+            is_opening = 'No'
             AND account = %(account)s
             AND posting_date < %(from_date)s
     ),
@@ -118,10 +117,9 @@ def execute(filters=None):
             SUM(credit) AS credit,
             NULL AS remarks
         FROM
-            `tabGL Entry`
+            `tabAccount Balance Snapshot`
         WHERE
-            is_cancelled = 0
-            AND is_opening = 'Yes'
+            is_opening = 'Yes'
             AND account = %(account)s
     ),
     opening AS (
@@ -225,9 +223,8 @@ def execute(filters=None):
             SUM(debit) AS debit,
             SUM(credit) AS credit,
             (SELECT SUM(debit) - SUM(credit)
-             FROM `tabGL Entry`
-             WHERE is_cancelled = 0
-               AND account = %(account)s
+             FROM `tabAccount Balance Snapshot`
+             WHERE account = %(account)s
                AND posting_date <= %(to_date)s) AS balance,
             NULL AS against,
             NULL AS remarks,
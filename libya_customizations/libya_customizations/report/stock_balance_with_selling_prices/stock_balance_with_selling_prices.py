@@ -3,6 +3,83 @@
 
 import frappe
 from frappe import _
+from frappe.utils import getdate, today
+
+LEDGER_STOCK_CTES = """
+stock_ledger_entry AS (
+    SELECT item_code, IFNULL(production_year, "") AS production_year, SUM(actual_qty) AS actual_qty
+    FROM `tabStock Ledger Entry`
+    WHERE is_cancelled = 0
+    AND posting_date <= %(to_date)s
+    GROUP BY item_code, IFNULL(production_year, "")
+    HAVING SUM(actual_qty) > 0
+),
+sales_order_item AS (
+    SELECT item_code, production_year, SUM(qty_to_deliver) AS qty_to_deliver FROM (
+        SELECT
+            soi.item_code,
+            IFNULL(soi.production_year, "") AS production_year,
+            IF(SUM(soi.qty - soi.delivered_qty) > 0, SUM(soi.qty - soi.delivered_qty), 0) AS qty_to_deliver
+        FROM `tabSales Order Item` soi
+        INNER JOIN `tabSales Order` so ON soi.parent = so.name
+        WHERE so.docstatus = 1
+          AND soi.docstatus = 1
+          AND so.status NOT IN ('Completed', 'Closed')
+          AND (soi.qty - soi.delivered_qty) > 0
+          AND so.transaction_date <= %(to_date)s
+        GROUP BY so.name, soi.item_code, IFNULL(soi.production_year, "")
+    ) t
+    GROUP BY item_code, production_year
+),
+"""
+
+LEDGER_AVAILABILITY_CTES = """
+purchase_receipt_item_virtual AS (
+    SELECT pri.item_code, IFNULL(pri.production_year, "") AS production_year, SUM(pri.qty) AS qty
+    FROM `tabPurchase Receipt Item` pri
+    INNER JOIN `tabPurchase Receipt` pr ON pri.parent = pr.name
+    WHERE pri.docstatus = 0
+    AND pri.qty > 0
+    AND pr.is_return = 0
+    AND pr.docstatus = 0
+    AND pr.virtual_receipt = 1
+    GROUP BY pri.item_code, IFNULL(pri.production_year, "")
+),
+item AS (
+    SELECT i.name, i.item_name, i.brand, i.is_stock_item, i.tire_size, IFNULL(sle.production_year, "") AS production_year
+    FROM `tabItem` i
+    LEFT JOIN `tabStock Ledger Entry` sle ON i.name = sle.item_code
+    WHERE (sle.is_cancelled = 0 OR sle.is_cancelled IS NULL)
+    GROUP BY i.name, IFNULL(sle.production_year, "")
+)
+"""
+
+CURRENT_STOCK_CTES = """
+stock_ledger_entry AS (
+    SELECT item_code, production_year, SUM(actual_qty) AS actual_qty
+    FROM `tabItem Availability`
+    GROUP BY item_code, production_year
+    HAVING SUM(actual_qty) > 0
+),
+sales_order_item AS (
+    SELECT item_code, production_year, SUM(qty_to_deliver + future_qty_to_deliver) AS qty_to_deliver
+    FROM `tabItem Availability`
+    GROUP BY item_code, production_year
+),
+"""
+
+CURRENT_AVAILABILITY_CTES = """
+purchase_receipt_item_virtual AS (
+    SELECT item_code, production_year, SUM(virtual_receipt_qty) AS qty
+    FROM `tabItem Availability`
+    GROUP BY item_code, production_year
+),
+item AS (
+    SELECT i.name, i.item_name, i.brand, i.is_stock_item, i.tire_size, IFNULL(ia.production_year, "") AS production_year
+    FROM `tabItem` i
+    LEFT JOIN (SELECT DISTINCT item_code, production_year FROM `tabItem Availability`) ia ON i.name = ia.item_code
+)
+"""
 
 def execute(filters=None):
     if not filters:
@@ -30,34 +107,18 @@ def execute(filters=None):
 
     brand_condition = f" AND {' AND '.join(conditions)}" if conditions else ""
 
+    # Item Availability holds today's balances, older dates are summed from the ledgers
+    if getdate(filters["to_date"]) >= getdate(today()):
+        stock_ctes = CURRENT_STOCK_CTES
+        availability_ctes = CURRENT_AVAILABILITY_CTES
+    else:
+        stock_ctes = LEDGER_STOCK_CTES
+        availability_ctes = LEDGER_AVAILABILITY_CTES
+
     # --- Query ---
     query = f"""
     WITH
-    stock_ledger_entry AS (
-        SELECT item_code, IFNULL(production_year, "") AS production_year, SUM(actual_qty) AS actual_qty
-        FROM `tabStock Ledger Entry`
-        WHERE is_cancelled = 0
-        AND posting_date <= %(to_date)s
-        GROUP BY item_code, IFNULL(production_year, "")
-        HAVING SUM(actual_qty) > 0
-    ),
-    sales_order_item AS (
-        SELECT item_code, production_year, SUM(qty_to_deliver) AS qty_to_deliver FROM (
-            SELECT
-                soi.item_code,
-                IFNULL(soi.production_year, "") AS production_year,
-                IF(SUM(soi.qty - soi.delivered_qty) > 0, SUM(soi.qty - soi.delivered_qty), 0) AS qty_to_deliver
-            FROM `tabSales Order Item` soi
-            INNER JOIN `tabSales Order` so ON soi.parent = so.name
-            WHERE so.docstatus = 1
-              AND soi.docstatus = 1
-              AND so.status NOT IN ('Completed', 'Closed')
-              AND (soi.qty - soi.delivered_qty) > 0
-              AND so.transaction_date <= %(to_date)s
-            GROUP BY so.name, soi.item_code, IFNULL(soi.production_year, "")
-        ) t
-        GROUP BY item_code, production_year
-    ),
+    {stock_ctes}
     item_price AS (
         SELECT item_code, price_list_rate, IFNULL(production_year, "") AS production_year
         FROM `tabItem Price`
@@ -67,24 +128,7 @@ def execute(filters=None):
             WHERE doctype = 'Selling Settings' AND field = 'selling_price_list'
         )
     ),
-	purchase_receipt_item_virtual AS (
-		SELECT pri.item_code, IFNULL(pri.production_year, "") AS production_year, SUM(pri.qty) AS qty
-		FROM `tabPurchase Receipt Item` pri
-		INNER JOIN `tabPurchase Receipt` pr ON pri.parent = pr.name
-		WHERE pri.docstatus = 0
-		AND pri.qty > 0
-		AND pr.is_return = 0
-		AND pr.docstatus = 0
-		AND pr.virtual_receipt = 1
-		GROUP BY pri.item_code, IFNULL(pri.production_year, "")
-	),
-    item AS (
-        SELECT i.name, i.item_name, i.brand, i.is_stock_item, i.tire_size, IFNULL(sle.production_year, "") AS production_year
-        FROM `tabItem` i
-        LEFT JOIN `tabStock Ledger Entry` sle ON i.name = sle.item_code
-        WHERE (sle.is_cancelled = 0 OR sle.is_cancelled IS NULL)
-        GROUP BY i.name, IFNULL(sle.production_year, "")
-    )
+    {availability_ctes}
     SELECT
         i.name AS item_code,
         i.item_name,
@@ -1,4 +1,5 @@
 import frappe, erpnext, json
+from array import array
 from frappe.utils import cint, flt, now
 from erpnext.stock.stock_ledger import (
     get_inventory_dimensions,
@@ -6,13 +7,102 @@ from erpnext.stock.stock_ledger import (
     get_incoming_rate_for_inter_company_transfer,
     get_stock_value_difference,
     get_previous_sle_of_current_voucher,
+    update_entries_after,
 )
-from libya_customizations.server_script.stock_ledger_entry import update_item_price
+from libya_customizations.server_script.stock_ledger_entry import (
+    RESERVATION_VOUCHER_TYPES,
+    update_item_prices_by_delta,
+)
+from libya_customizations.libya_customizations.doctype.item_availability.item_availability import add_actual_qty
+from libya_customizations.libya_customizations.doctype.sales_fact.sales_fact import (
+    SALES_VOUCHER_TYPES,
+    mark_sales_facts,
+)
+from libya_customizations.utils import bulk_set_values
+
+# columns process_sle can change on a ledger entry, written back in batches
+SLE_WRITE_FIELDS = (
+	"actual_qty",
+	"incoming_rate",
+	# set by reset_actual_qty_for_stock_reco when a reconciliation no longer moves any qty
+	"is_cancelled",
+	"outgoing_rate",
+	"qty_after_transaction",
+	"valuation_rate",
+	"stock_value",
+	"stock_queue",
+	"stock_value_difference",
+)
+
+_build = update_entries_after.build
+_get_dependent_entries_to_fix = update_entries_after.get_dependent_entries_to_fix
+_get_future_entries_to_fix = update_entries_after.get_future_entries_to_fix
+
+def build(self):
+	# Item Price figures are refreshed once per touched key when the repost finishes
+	self.item_price_deltas = {}
+	# qty rewritten on reposted entries, which Item Availability counted at their old qty
+	self.availability_deltas = []
+	# resolved once per repost instead of once per ledger entry
+	self.dimension_fields = frozenset(dimension.get("fieldname") for dimension in get_inventory_dimensions())
+	self.batchwise_valuation = {}
+	self.sle_write_buffer = {}
+	# rows per multi-row UPDATE, set `sle_write_batch_size` in site_config.json to tune
+	self.sle_write_batch_size = cint(frappe.conf.get("sle_write_batch_size")) or 200
+	_build(self)
+	flush_sle_write_buffer(self)
+	add_actual_qty(self.availability_deltas)
+	update_item_prices_by_delta(self.item_price_deltas)
+
+def get_future_entries_to_fix(self):
+	entries = _get_future_entries_to_fix(self)
+	prefetch_batchwise_valuation(self, entries)
+	return entries
+
+def get_dependent_entries_to_fix(self, entries_to_fix, sle):
+	# the dependent entries are read back from the database
+	flush_sle_write_buffer(self)
+	entries = _get_dependent_entries_to_fix(self, entries_to_fix, sle)
+	prefetch_batchwise_valuation(self, entries)
+	return entries
+
+def prefetch_batchwise_valuation(self, entries):
+	batches = list({sle.batch_no for sle in entries if sle.batch_no} - set(self.batchwise_valuation))
+	if batches:
+		self.batchwise_valuation.update(
+			frappe.db.sql("SELECT name, use_batchwise_valuation FROM `tabBatch` WHERE name IN %s", (batches,))
+		)
+
+def use_batchwise_valuation(self, batch_no):
+	if batch_no not in self.batchwise_valuation:
+		self.batchwise_valuation[batch_no] = frappe.db.get_value("Batch", batch_no, "use_batchwise_valuation")
+	return self.batchwise_valuation[batch_no]
+
+def buffer_sle_update(self, sle):
+	self.sle_write_buffer[sle.name] = {field: sle.get(field) for field in SLE_WRITE_FIELDS}
+	self.sle_write_buffer[sle.name]["stock_queue"] = pack_stock_queue(sle.stock_queue)
+	# read by events.run_repost_item_valuation for its throughput log
+	frappe.flags.reposted_sle_count = (frappe.flags.reposted_sle_count or 0) + 1
+	# the cost of sales moved with the valuation
+	if sle.voucher_type in SALES_VOUCHER_TYPES:
+		mark_sales_facts([(sle.posting_date, sle.item_code)])
+	if len(self.sle_write_buffer) >= self.sle_write_batch_size:
+		flush_sle_write_buffer(self)
+
+def flush_sle_write_buffer(self):
+	if getattr(self, "sle_write_buffer", None):
+		for values in self.sle_write_buffer.values():
+			values["stock_queue"] = dump_stock_queue(values["stock_queue"])
+		bulk_set_values("Stock Ledger Entry", self.sle_write_buffer, chunk_size=self.sle_write_batch_size)
+		self.sle_write_buffer = {}
 
 def process_sle(self, sle):
+		old_actual_qty = flt(sle.actual_qty)
+
 		# previous sle data for this warehouse
 		key = (sle.item_code, sle.warehouse)
 		if key not in self.prev_sle_dict:
+			flush_sle_write_buffer(self)
 			prev_sle = get_previous_sle_of_current_voucher(sle)
 			if prev_sle:
 				self.prev_sle_dict[key] = prev_sle
@@ -30,7 +120,12 @@ def process_sle(self, sle):
 
 		self.wh_data = self.prev_sle_dict.get(key)
 
-		if self.wh_data.stock_queue and isinstance(self.wh_data.stock_queue, str):
+		# Moving Average never reads the queue, the stored one is passed through untouched
+		if (
+			self.valuation_method != "Moving Average"
+			and self.wh_data.stock_queue
+			and isinstance(self.wh_data.stock_queue, str)
+		):
 			self.wh_data.stock_queue = json.loads(self.wh_data.stock_queue)
 
 		if not self.wh_data.prev_stock_value:
@@ -46,6 +141,9 @@ def process_sle(self, sle):
 				return
 		# Get dynamic incoming/outgoing rate
 		if not self.args.get("sle_id"):
+			if sle.recalculate_rate:
+				# returns take their rate from the original voucher's entries
+				flush_sle_write_buffer(self)
 			self.get_dynamic_incoming_outgoing_rate(sle)
 
 		if (
@@ -65,17 +163,15 @@ def process_sle(self, sle):
 		):
 			sle.outgoing_rate = get_incoming_rate_for_inter_company_transfer(sle)
 
-		dimensions = get_inventory_dimensions()
-		has_dimensions = False
-		if dimensions:
-			for dimension in dimensions:
-				if sle.get(dimension.get("fieldname")):
-					has_dimensions = True
+		has_dimensions = any(sle.get(fieldname) for fieldname in self.dimension_fields)
 
+		# serial and batch valuations are summed from the earlier entries of the serial / batch
 		if sle.serial_and_batch_bundle:
+			flush_sle_write_buffer(self)
 			self.calculate_valuation_for_serial_batch_bundle(sle)
 		elif sle.serial_no and not self.args.get("sle_id"):
 			# Only run in reposting
+			flush_sle_write_buffer(self)
 			self.get_serialized_values(sle)
 			self.wh_data.qty_after_transaction += flt(sle.actual_qty)
 			if sle.voucher_type == "Stock Reconciliation" and not sle.batch_no:
@@ -86,10 +182,11 @@ def process_sle(self, sle):
 			)
 		elif (
 			sle.batch_no
-			and frappe.db.get_value("Batch", sle.batch_no, "use_batchwise_valuation", cache=True)
 			and not self.args.get("sle_id")
+			and use_batchwise_valuation(self, sle.batch_no)
 		):
 			# Only run in reposting
+			flush_sle_write_buffer(self)
 			self.update_batched_values(sle)
 		else:
 			if (
@@ -136,7 +233,8 @@ def process_sle(self, sle):
 		sle.qty_after_transaction = flt(self.wh_data.qty_after_transaction, self.flt_precision)
 		sle.valuation_rate = self.wh_data.valuation_rate
 		sle.stock_value = self.wh_data.stock_value
-		sle.stock_queue = json.dumps(self.wh_data.stock_queue)
+		# kept as a list for the next entry of the key, serialized when the write buffer flushes
+		sle.stock_queue = self.wh_data.stock_queue
 
 		old_stock_value_difference = sle.stock_value_difference
 
@@ -150,6 +248,7 @@ def process_sle(self, sle):
 				or flt(sle.stock_value_difference, self.currency_precision) == 0
 			)
 		):
+			flush_sle_write_buffer(self)
 			sle.stock_value_difference = (
 				get_stock_value_difference(
 					sle.item_code,
@@ -164,14 +263,17 @@ def process_sle(self, sle):
 
 		sle.doctype = "Stock Ledger Entry"
 		sle.modified = now()
-		frappe.get_doc(sle).db_update()
-		update_item_price(sle)
+		buffer_sle_update(self, sle)
+		collect_item_price_delta(self, sle, old_actual_qty, old_stock_value_difference)
 
 		self.prev_sle_dict[key] = sle
 
 		if not self.args.get("sle_id") or (
 			sle.serial_and_batch_bundle and sle.auto_created_serial_and_batch_bundle
 		):
+			if sle.voucher_type == "Stock Reconciliation":
+				# the reconciliation recalculates its current qty from the ledger
+				flush_sle_write_buffer(self)
 			self.update_outgoing_rate_on_transaction(sle)
 
 		if flt(old_stock_value_difference, self.currency_precision) == flt(
@@ -183,4 +285,39 @@ def process_sle(self, sle):
 			return
 
 		if self.args.item_code != sle.item_code or self.args.warehouse != sle.warehouse:
-			self.repost_affected_transaction.add((sle.voucher_type, sle.voucher_no))
\ No newline at end of file
+			self.repost_affected_transaction.add((sle.voucher_type, sle.voucher_no))
+
+def pack_stock_queue(queue):
+	"""Snapshot of a FIFO / LIFO queue as paired qty and rate arrays; the live list keeps changing."""
+	if isinstance(queue, str):
+		return queue
+	try:
+		return (array("d", (layer[0] for layer in queue)), array("d", (layer[1] for layer in queue)))
+	except (TypeError, IndexError):
+		return json.dumps(queue)
+
+def dump_stock_queue(packed):
+	if isinstance(packed, tuple):
+		return json.dumps([[qty, rate] for qty, rate in zip(*packed)])
+	return packed
+
+def collect_item_price_delta(self, sle, old_actual_qty, old_stock_value_difference):
+	if self.args.get("sle_id"):
+		# the entry is being posted now, none of it is on the Item Price yet
+		qty_delta = flt(sle.actual_qty)
+		value_delta = flt(sle.stock_value_difference)
+	else:
+		# a reconciliation left with no qty is cancelled by reset_actual_qty_for_stock_reco
+		qty_delta = (0.0 if sle.is_cancelled else flt(sle.actual_qty)) - old_actual_qty
+		value_delta = flt(sle.stock_value_difference) - flt(old_stock_value_difference)
+		if qty_delta:
+			self.availability_deltas.append((sle.item_code, sle.production_year, sle.warehouse, qty_delta))
+
+	delta = self.item_price_deltas.setdefault(
+		(sle.item_code, sle.production_year or ""),
+		{"qty": 0.0, "value": 0.0, "reread_reservations": False, "refresh": False},
+	)
+	delta["qty"] += qty_delta
+	delta["value"] += value_delta
+	delta["reread_reservations"] |= sle.voucher_type in RESERVATION_VOUCHER_TYPES
+	delta["refresh"] |= sle.voucher_type == "Stock Reconciliation"
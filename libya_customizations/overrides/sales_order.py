@@ -1,15 +1,20 @@
 import frappe
-import json
 from frappe import _
 from erpnext.selling.doctype.sales_order.sales_order import SalesOrder
-from libya_customizations.server_script.sales_order import get_customer_info
+from libya_customizations.customer_metrics import get_customer_metrics, invalidate_customer_metrics
 from libya_customizations.utils import check_roles_included
+from libya_customizations.libya_customizations.doctype.item_availability.item_availability import refresh_reserved_qty
 
 class CustomSalesOrder(SalesOrder):
     def update_status(self, *args, **kwargs):
         # Call the original update_status method from the parent class
         # old_status = self.status
         super().update_status(*args, **kwargs)
+        # closing / reopening releases or takes back the reservations
+        refresh_reserved_qty((row.item_code, row.production_year) for row in self.items)
+        # closed orders drop out of the unbilled amount
+        invalidate_customer_metrics(self)
+        self._customer_metrics = None
         # frappe.throw(self.status)
         if self.status not in ["Closed", "Completed"]:
             self.validate_before_submit_sales_order()
@@ -34,32 +39,12 @@ class CustomSalesOrder(SalesOrder):
         
     @frappe.whitelist()
     def get_customer_metrics(self):
-        """Fetches metrics from Redis cache first; falls back to DB only if cache is expired."""
-        if not self.customer:
-            return {}
-
-        # 1. Define a unique cache key for this specific customer
-        cache_key = f"customer_metrics:{self.customer}"
-        
-        # 2. Try to get the cached data from Redis
-        cached_data = frappe.cache().get_value(cache_key)
-        
-        if cached_data:
-            # Cache hit: parse the JSON string back into a Python dict
-            return json.loads(cached_data)
-            
-        # 3. Cache miss: execute your database/API logic
-        res = get_customer_info(customer=self.customer)
-        metrics = {}
-        
-        if res and isinstance(res, list) and len(res) > 0:
-            metrics = res[0]
-            
-            # 4. Save to Redis cache and set an expiration time (e.g., 300 seconds / 5 minutes)
-            # This ensures the data stays fresh but relieves database pressure completely.
-            frappe.cache().set_value(cache_key, json.dumps(metrics), expires_in_sec=300)
-            
-        return metrics
+        """Fetches metrics from Redis cache first; falls back to DB only if the customer's figures changed."""
+        # loaded once per document instance and shared by the properties below
+        cached = self.__dict__.get("_customer_metrics")
+        if not cached or cached[0] != self.customer:
+            cached = self._customer_metrics = (self.customer, get_customer_metrics(self.customer))
+        return cached[1]
 
     # ----------------------------------------------------
     # Properties remain completely unchanged and clean
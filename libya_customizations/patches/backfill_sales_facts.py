@@ -0,0 +1,8 @@
+import frappe
+from libya_customizations.libya_customizations.doctype.sales_fact.sales_fact import backfill_sales_facts
+
+def execute():
+    frappe.reload_doc("libya_customizations", "doctype", "sales_fact")
+    backfill_sales_facts()
+    frappe.db.commit()
+    print("[PATCH] Sales Fact backfilled from the invoices and the ledger")
@@ -0,0 +1,8 @@
+import frappe
+from libya_customizations.libya_customizations.doctype.account_balance_snapshot.account_balance_snapshot import rebuild_account_balance_snapshot
+
+def execute():
+    frappe.reload_doc("libya_customizations", "doctype", "account_balance_snapshot")
+    rebuild_account_balance_snapshot()
+    frappe.db.commit()
+    print("[PATCH] Account Balance Snapshot rebuilt from the GL")
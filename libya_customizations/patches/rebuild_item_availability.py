@@ -0,0 +1,8 @@
+import frappe
+from libya_customizations.libya_customizations.doctype.item_availability.item_availability import rebuild_item_availability
+
+def execute():
+    frappe.reload_doc("libya_customizations", "doctype", "item_availability")
+    rebuild_item_availability()
+    frappe.db.commit()
+    print("[PATCH] Item Availability rebuilt from the ledgers")
@@ -0,0 +1,9 @@
+import frappe
+
+UPSTREAM_REPOST_METHOD = "erpnext.stock.doctype.repost_item_valuation.repost_item_valuation.repost_entries"
+
+def execute():
+    # reposts are run by libya_customizations.events.schedule_repost_item_valuation
+    frappe.db.set_value("Scheduled Job Type", {"method": UPSTREAM_REPOST_METHOD}, "stopped", 1)
+    frappe.db.commit()
+    print("[PATCH] Stopped the upstream hourly repost_entries job")
@@ -3,7 +3,8 @@ from libya_customizations.server_script.item_price import update_stock_valuation
 def execute():
     print("Updating Item Prices to the latest value ...")
     try:
-        update_stock_valuation_rate()
+        result = update_stock_valuation_rate()
         frappe.db.commit()
+        print(f"Updated {result['changed']} of {result['total']} Item Prices in {result['elapsed']}s")
     except Exception as e:
         print(f"Problem with Updating Prices:{e}\n {frappe.get_traceback()}")
\ No newline at end of file
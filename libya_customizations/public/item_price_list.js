@@ -101,7 +101,17 @@ frappe.listview_settings['Item Price'] = {
                         filters: listview.filter_area.get()
                     },
                     callback: function (response) {
-                        if (response.message) {
+                        if (response.message && response.message.running) {
+                            frappe.show_alert({
+                                message: __('This export of {0} Item Prices is still running, you will be notified when the file is ready.', [response.message.rows]),
+                                indicator: 'orange'
+                            });
+                        } else if (response.message && response.message.queued) {
+                            frappe.show_alert({
+                                message: __('Exporting {0} Item Prices in the background, you will be notified when the file is ready.', [response.message.rows]),
+                                indicator: 'blue'
+                            });
+                        } else if (response.message) {
                             const download_link = document.createElement('a');
                             download_link.href = response.message;
                             download_link.download = 'Item Price.xlsx';
@@ -156,7 +166,18 @@ function upload_and_import(file) {
         freeze_message: __('Uploading and Importing Data...'),
         callback: function(response) {
             if (response.message) {
-                frappe.msgprint(__('File uploaded and Item Prices imported successfully.'));
+                const summary = response.message;
+                // a sheet with invalid rows is rejected as a whole
+                let message = summary.invalid
+                    ? __('No Item Prices were imported, {0} rows are invalid.', [summary.invalid])
+                    : __('Item Prices imported: {0} changed, {1} unchanged.', [summary.changed, summary.unchanged]);
+                if (summary.errors.length) {
+                    message += '<br><br>' + summary.errors
+                        // the error text can carry cell values from the uploaded sheet
+                        .map(error => __('Row {0}: {1}', [error.row, frappe.utils.escape_html(error.error)]))
+                        .join('<br>');
+                }
+                frappe.msgprint(message);
                 frappe.views.ListView.refresh();
             } else {
                 frappe.msgprint(__('Error occurred while importing the data.'));
@@ -1,4 +1,26 @@
 frappe.listview_settings["Sales Order"] = {
+    add_fields: ["customer"],
+    refresh: function(listview) {
+        // colour every row by its customer's credit index with one call for the whole page
+        const customers = [...new Set(listview.data.map(doc => doc.customer).filter(Boolean))];
+        if (!customers.length) return;
+
+        frappe.call({
+            method: "libya_customizations.server_script.sales_order.get_customers_info",
+            args: { customers: customers },
+            callback: function(r) {
+                const metrics = r.message || {};
+                listview.data.forEach(doc => {
+                    const customer_index = (metrics[doc.customer] || {}).customer_index;
+                    if (!customer_index) return;
+                    listview.$result
+                        .find(`.list-row-checkbox[data-name="${CSS.escape(doc.name)}"]`)
+                        .closest(".list-row")
+                        .css("border-left", `3px solid ${customer_index}`);
+                });
+            }
+        });
+    },
     get_indicator: function(doc) {
         if(!["On Hold", "Closed"].includes(doc.status)){
             if (doc.per_delivered === 0 && doc.docstatus == 1) {
@@ -0,0 +1,74 @@
+import hashlib
+import json
+import re
+
+import frappe
+from frappe.core.doctype.report.report import Report
+from frappe.utils import cstr, nowdate
+
+
+# entries of a moved table are never read again, the TTL only bounds memory
+CACHE_TTL = 24 * 60 * 60
+CACHED_MODULE = "Libya Customizations"
+TABLE_PATTERN = re.compile(r"`tab([^`]+)`")
+# the key only moves with the date, so queries reading the time of day are never cached
+TIME_PATTERN = re.compile(r"\b(NOW|CURTIME|CURRENT_TIME|CURRENT_TIMESTAMP|LOCALTIME|LOCALTIMESTAMP|SYSDATE|UTC_TIME|UTC_TIMESTAMP|UNIX_TIMESTAMP)\s*\(", re.I)
+# hash of per-table versions moved by writers that delete or rewrite rows in place,
+# which the latest `modified` of the table does not show
+TABLE_VERSIONS = "query_report_table_versions"
+
+_execute_query_report = Report.execute_query_report
+
+
+def execute_query_report(self, filters, *args, **kwargs):
+	"""Report.execute_query_report serving this app's Query Reports from Redis.
+
+	The cache key combines the report, its normalized filters, the date (queries compare
+	against CURDATE()) and the latest `modified` and version of every table the query
+	reads, so a cached result is served until one of its source tables moves. Queries
+	reading the time of day, such as NOW(), are always run.
+	"""
+	if self.module != CACHED_MODULE or not self.query or TIME_PATTERN.search(self.query):
+		return _execute_query_report(self, filters, *args, **kwargs)
+
+	cache_key = get_cache_key(self, filters)
+	cached_result = frappe.cache().get_value(cache_key)
+	if cached_result is not None:
+		return cached_result
+
+	result = _execute_query_report(self, filters, *args, **kwargs)
+	frappe.cache().set_value(cache_key, result, expires_in_sec=CACHE_TTL)
+	return result
+
+
+def get_cache_key(report, filters):
+	filters = {key: value for key, value in (filters or {}).items() if value not in (None, "", [])}
+	key = json.dumps(
+		[report.name, cstr(report.modified), nowdate(), filters, get_watermarks(report.query)],
+		sort_keys=True,
+		default=str,
+	)
+	return f"query_report:{report.name}:{hashlib.sha1(key.encode()).hexdigest()}"
+
+
+def bump_table_version(doctype):
+	"""Moves the watermark of a table once the transaction that deleted or rewrote its rows commits."""
+	frappe.db.after_commit.add(
+		lambda: frappe.cache().hset(TABLE_VERSIONS, doctype, frappe.generate_hash(length=10))
+	)
+
+
+def get_watermarks(query):
+	"""The latest `modified` and version of every table named in a query, tables without the column left out."""
+	doctypes = sorted({
+		doctype for doctype in TABLE_PATTERN.findall(query)
+		if frappe.db.table_exists(doctype) and frappe.db.has_column(doctype, "modified")
+	})
+	if not doctypes:
+		return []
+
+	# one index lookup per table
+	watermarks = frappe.db.sql(" UNION ALL ".join(
+		[f"(SELECT %s, MAX(`modified`) FROM `tab{doctype}`)" for doctype in doctypes]
+	), doctypes)
+	return [(doctype, modified, frappe.cache().hget(TABLE_VERSIONS, doctype)) for doctype, modified in watermarks]
@@ -1,11 +1,18 @@
 import frappe
-from openpyxl import Workbook
+from frappe import _
+from io import BytesIO
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import PatternFill, Border, Side, Alignment
 from openpyxl.utils import get_column_letter
 from frappe.utils.file_manager import save_file
-from frappe.utils import get_site_path
+import hashlib
 import json
 import math
+import time
+from frappe.utils import cint, cstr, flt
+from frappe.utils.background_jobs import is_job_enqueued
+from libya_customizations.utils import bulk_set_values
 
 @frappe.whitelist()
 def increase_item_price(filters, percent):
@@ -14,125 +21,254 @@ def increase_item_price(filters, percent):
     for item in items:
         frappe.db.set_value("Item Price", item.name, "price_list_rate", math.ceil(item.stock_valuation_rate*(100+int(percent))/100))
 
+ITEM_PRICE_EXPORT_FIELDS = ["name", "item_code", "item_name", "brand", "price_list_rate", "stock_valuation_rate", "stock_qty", "price_list"]
+# exports of more rows than this are built by a background job that notifies the user
+ITEM_PRICE_EXPORT_BACKGROUND_ROWS = 5000
+
 @frappe.whitelist()
 def export_item_price_data(filters):
-    # Define the fields for "Item Price" export
-    doctype = "Item Price"
-    fields = ["name", "item_code", "item_name", "brand", "price_list_rate", "stock_valuation_rate", "stock_qty", "price_list"]
     filters = json.loads(filters)
-    names = frappe.get_list(doctype, filters=filters)
-    
-    # Initialize the workbook and add header row
-    workbook = Workbook()
-    sheet = workbook.active
-    sheet.title = "Item Price Export"
-    sheet.append(fields)  # Add headers based on fields
+    # the permission-checked query, streamed by build_item_price_export
+    query = frappe.get_list("Item Price", filters=filters, fields=ITEM_PRICE_EXPORT_FIELDS, run=0)
+    rows = frappe.get_list("Item Price", filters=filters, fields=["count(name) as count"])[0].count
+
+    if rows > ITEM_PRICE_EXPORT_BACKGROUND_ROWS:
+        # one job per user and filters; asking again for an export still being built is reported, not queued
+        job_id = f"item_price_export::{frappe.session.user}::{hashlib.sha1(query.encode()).hexdigest()[:10]}"
+        if is_job_enqueued(job_id):
+            return {"running": True, "rows": rows}
+
+        frappe.enqueue(
+            build_item_price_export,
+            queue="long",
+            timeout=1500,
+            job_id=job_id,
+            deduplicate=True,
+            query=query,
+            notify=True,
+        )
+        return {"queued": True, "rows": rows}
+
+    return build_item_price_export(query)
+
+
+def build_item_price_export(query, notify=False):
+    """Streams the rows of `query` into a write-only workbook and saves it as a private File.
+
+    Returns the file URL; with `notify` the user also gets a notification linking to it.
+    """
+    fields = ITEM_PRICE_EXPORT_FIELDS
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Item Price Export")
+
+    # write-only sheets need their widths before the first row, so they come from one aggregate over the export
+    widths = frappe.db.sql(f"""
+        SELECT {", ".join(f"MAX(CHAR_LENGTH(`{field}`))" for field in fields)}
+        FROM ({query}) item_price
+    """)[0]
+    for col_num, (header, width) in enumerate(zip(fields, widths), start=1):
+        sheet.column_dimensions[get_column_letter(col_num)].width = max(len(header), cint(width)) + 2  # Add some padding
 
     # Define fill patterns
     green_fill = PatternFill(start_color="90EE90", end_color="90EE90", fill_type="solid")  # Light green
     blue_fill = PatternFill(start_color="ADD8E6", end_color="ADD8E6", fill_type="solid")   # Light blue
 
-    # Apply green fill to all header cells except "price_list_rate"
-    price_list_rate_index = fields.index("price_list_rate") + 1  # Column index of "price_list_rate"
-    for col_num, header in enumerate(fields, start=1):
-        header_cell = sheet.cell(row=1, column=col_num)
-        if col_num == price_list_rate_index:
-            header_cell.fill = blue_fill  # Blue fill for "price_list_rate" header
-        else:
-            header_cell.fill = green_fill  # Green fill for other headers
-
-    # Iterate over each selected document
-    for name in names:
-        # Fetch the document
-        item_price_doc = frappe.get_doc(doctype, name)
-        
-        # Prepare a row with the specified fields
-        row = [getattr(item_price_doc, field, "") for field in fields]
-        sheet.append(row)  # Append the row to the sheet
-
-        # Apply blue fill to the "price_list_rate" cell
-        price_list_rate_cell = sheet.cell(row=sheet.max_row, column=price_list_rate_index)
-        price_list_rate_cell.fill = blue_fill
-
-    # Auto-fit column widths to fit the content
-    for col in sheet.columns:
-        max_length = 0
-        column = col[0].column_letter  # Get the column letter (e.g., "A", "B", etc.)
-        for cell in col:
-            try:
-                # Calculate the length of the cell content
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        # Set the column width to fit the longest content, add padding
-        sheet.column_dimensions[column].width = max_length + 2  # Add some padding
-
-    # Define and save the Excel file path
-    file_path = get_site_path("private", "files", "Item_Price_Export.xlsx")
-    workbook.save(file_path)
+    # Blue fill for the "price_list_rate" header and cells, green for the other headers
+    price_list_rate_index = fields.index("price_list_rate")
+    sheet.append([
+        _filled_cell(sheet, header, blue_fill if col_num == price_list_rate_index else green_fill)
+        for col_num, header in enumerate(fields)
+    ])
+
+    with frappe.db.unbuffered_cursor():
+        for row in frappe.db.sql(query, as_list=True, as_iterator=True):
+            row[price_list_rate_index] = _filled_cell(sheet, row[price_list_rate_index], blue_fill)
+            sheet.append(row)
 
+    xlsx_file = BytesIO()
+    workbook.save(xlsx_file)
     # Save file in Frappe's File Manager to generate download URL
-    with open(file_path, "rb") as file:
-        file_doc = save_file(
-            "Item Price Export.xlsx",
-            file.read(),
-            "File",
-            frappe.session.user,
-            is_private=True
-        )
+    file_doc = save_file(
+        "Item Price Export.xlsx",
+        xlsx_file.getvalue(),
+        "File",
+        frappe.session.user,
+        is_private=True
+    )
+
+    if notify:
+        frappe.get_doc({
+            "doctype": "Notification Log",
+            "for_user": frappe.session.user,
+            "type": "Alert",
+            "subject": _("Item Price export is ready to download"),
+            "link": file_doc.file_url,
+        }).insert(ignore_permissions=True)
 
     return file_doc.file_url
 
 
-from frappe.utils.xlsxutils import read_xlsx_file_from_attached_file
-@frappe.whitelist(allow_guest=True)
-def import_item_price_data(file_url):
-    
+def _filled_cell(sheet, value, fill):
+    cell = WriteOnlyCell(sheet, value=value)
+    cell.fill = fill
+    return cell
+
+
+# errors listed back to the user, the rest are only counted
+IMPORT_ERRORS_SHOWN = 100
+
+@frappe.whitelist()
+def import_item_price_data(file_url, chunk_size=500):
+    """Applies the price_list_rate column of an Item Price export.
+
+    The sheet is read in read-only mode and checked chunk by chunk against the stored rates.
+    A sheet with any invalid row writes nothing; otherwise only the changed rows are written,
+    with one multi-row UPDATE per chunk, and the request commits them together.
+    Returns the number of changed, unchanged and invalid rows.
+    """
+    frappe.has_permission("Item Price", "write", throw=True)
+    started = time.monotonic()
+    chunk_size = cint(chunk_size) or 500
     file_doc = frappe.get_doc("File", {"file_url": file_url})
-    content = file_doc.get_content()
-    data = read_xlsx_file_from_attached_file(fcontent=content)
-    for row in data[1:]:
-        frappe.db.set_value("Item Price", row[0], "price_list_rate", row[4])
-    return data[1:]
+    workbook = load_workbook(file_doc.get_full_path(), read_only=True, data_only=True)
+
+    name_index = ITEM_PRICE_EXPORT_FIELDS.index("name")
+    rate_index = ITEM_PRICE_EXPORT_FIELDS.index("price_list_rate")
+    summary = {"total": 0, "changed": 0, "unchanged": 0, "invalid": 0, "errors": []}
+    seen, chunk, updates = set(), {}, {}
+    try:
+        for row_no, row in enumerate(workbook.active.iter_rows(min_row=2, values_only=True), start=2):
+            if not any(value not in (None, "") for value in row):
+                continue
+
+            summary["total"] += 1
+            name = cstr(row[name_index] if len(row) > name_index else "").strip()
+            rate = row[rate_index] if len(row) > rate_index else None
+            error = validate_item_price_row(name, rate, seen)
+            if error:
+                add_import_error(summary, row_no, name, error)
+                continue
+
+            seen.add(name)
+            chunk[name] = (row_no, flt(rate))
+            if len(chunk) >= chunk_size:
+                updates.update(get_changed_item_price_rates(chunk, summary))
+                chunk = {}
+
+        updates.update(get_changed_item_price_rates(chunk, summary))
+    finally:
+        workbook.close()
+
+    if not summary["invalid"]:
+        summary["changed"] = bulk_set_values("Item Price", updates, chunk_size=chunk_size)
+
+    summary["elapsed"] = round(time.monotonic() - started, 2)
+    return summary
+
+
+def validate_item_price_row(name, rate, seen):
+    if not name:
+        return _("Missing Item Price name")
+    if name in seen:
+        return _("Item Price {0} appears more than once").format(name)
+    if isinstance(rate, str):
+        rate = rate.strip().replace(",", "")
+    if rate in (None, "") or isinstance(rate, bool):
+        return _("Missing Price List Rate")
+    try:
+        rate = float(rate)
+    except (TypeError, ValueError):
+        return _("Price List Rate {0} is not a number").format(rate)
+    if math.isnan(rate) or rate < 0:
+        return _("Price List Rate {0} is not a valid price").format(rate)
+
+
+def get_changed_item_price_rates(chunk, summary):
+    """The rates of `{name: (row_no, rate)}` that differ from the stored ones, as bulk_set_values updates."""
+    if not chunk:
+        return {}
+
+    current_rates = dict(frappe.db.sql("""
+        SELECT name, price_list_rate
+        FROM `tabItem Price`
+        WHERE name IN %s
+    """, (list(chunk),)))
+
+    updates = {}
+    for name, (row_no, rate) in chunk.items():
+        if name not in current_rates:
+            add_import_error(summary, row_no, name, _("Item Price {0} does not exist").format(name))
+        elif flt(current_rates[name], 6) != flt(rate, 6):
+            updates[name] = {"price_list_rate": rate}
+        else:
+            summary["unchanged"] += 1
+    return updates
+
+
+def add_import_error(summary, row_no, name, error):
+    summary["invalid"] += 1
+    if len(summary["errors"]) < IMPORT_ERRORS_SHOWN:
+        summary["errors"].append({"row": row_no, "name": name, "error": error})
 
 @frappe.whitelist()
-def update_stock_valuation_rate():
-    item_prices = frappe.get_all("Item Price", fields=["name", "item_code", "production_year"])
-    
-    for ip in item_prices:
-        # Get Stock Valuation Rate (based on item_code)
-        avg_rate = frappe.db.sql("""
-            SELECT SUM(stock_value) / SUM(actual_qty)
-            FROM `tabBin`
-            WHERE item_code = %s AND actual_qty > 0
-        """, (ip.item_code,))[0][0]
-
-        # Get Stock Qty (based on item_code + production_year)
-        stock_qty = frappe.db.sql("""
-            SELECT IFNULL(SUM(actual_qty), 0)
+def update_stock_valuation_rate(chunk_size=500):
+    """Recomputes valuation, stock qty and available qty for every Item Price.
+
+    The figures are taken for all (item_code, production_year) pairs in three grouped
+    queries and only the rows whose stored figures differ are written back, in chunks.
+    """
+    started = time.monotonic()
+    item_prices = frappe.get_all(
+        "Item Price",
+        fields=["name", "item_code", "production_year", "stock_valuation_rate", "stock_qty", "available_qty"],
+    )
+
+    # Stock Valuation Rate (based on item_code)
+    valuation_rates = dict(frappe.db.sql("""
+        SELECT item_code, SUM(stock_value) / SUM(actual_qty)
+        FROM `tabBin`
+        WHERE actual_qty > 0
+        GROUP BY item_code
+    """))
+
+    # Stock Qty (based on item_code + production_year)
+    stock_qtys = {
+        (item_code, production_year): qty
+        for item_code, production_year, qty in frappe.db.sql("""
+            SELECT item_code, IFNULL(production_year, ''), SUM(actual_qty)
             FROM `tabStock Ledger Entry`
-            WHERE is_cancelled = 0 AND item_code = %s AND IFNULL(production_year, '') = IFNULL(%s, '')
-        """, (ip.item_code, ip.production_year))[0][0]
-
-        qty_to_deliver = frappe.db.sql("""
-            WITH reserved_qty AS (
-                SELECT so.name, IF(SUM(soi.qty - soi.delivered_qty) > 0, SUM(soi.qty - soi.delivered_qty), 0) AS qty_to_deliver
-                FROM `tabSales Order Item` soi
-                INNER JOIN `tabSales Order` so ON soi.parent = so.name
-                WHERE soi.docstatus = 1 AND so.docstatus = 1 AND so.status NOT IN ('Completed', 'Closed') AND soi.qty - soi.delivered_qty > 0
-                AND soi.item_code = %s AND IFNULL(soi.production_year, '') = IFNULL(%s, '')
-            )
-            SELECT IFNULL(SUM(qty_to_deliver), 0)
-            FROM reserved_qty
-        """, (ip.item_code, ip.production_year))[0][0]
-
-        available_qty = stock_qty - qty_to_deliver
-
-        frappe.db.set_value("Item Price", ip.name, {
-            "stock_valuation_rate": avg_rate or 0,
-            "stock_qty": stock_qty or 0,
-            "available_qty": available_qty or 0
-        })
-
-    frappe.db.commit()
\ No newline at end of file
+            WHERE is_cancelled = 0
+            GROUP BY item_code, IFNULL(production_year, '')
+        """)
+    }
+
+    qtys_to_deliver = {
+        (item_code, production_year): qty
+        for item_code, production_year, qty in frappe.db.sql("""
+            SELECT soi.item_code, IFNULL(soi.production_year, ''), SUM(soi.qty - soi.delivered_qty)
+            FROM `tabSales Order Item` soi
+            INNER JOIN `tabSales Order` so ON soi.parent = so.name
+            WHERE soi.docstatus = 1 AND so.docstatus = 1 AND so.status NOT IN ('Completed', 'Closed') AND soi.qty - soi.delivered_qty > 0
+            GROUP BY soi.item_code, IFNULL(soi.production_year, '')
+        """)
+    }
+
+    updates = {}
+    for ip in item_prices:
+        key = (ip.item_code, ip.production_year or "")
+        stock_qty = flt(stock_qtys.get(key))
+        values = {
+            "stock_valuation_rate": flt(valuation_rates.get(ip.item_code)),
+            "stock_qty": stock_qty,
+            "available_qty": stock_qty - flt(qtys_to_deliver.get(key)),
+        }
+        if any(flt(ip.get(field), 6) != flt(value, 6) for field, value in values.items()):
+            updates[ip.name] = values
+
+    bulk_set_values("Item Price", updates, chunk_size=cint(chunk_size) or 500, commit=True)
+
+    return {
+        "total": len(item_prices),
+        "changed": len(updates),
+        "elapsed": round(time.monotonic() - started, 2),
+    }
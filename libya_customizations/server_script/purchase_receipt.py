@@ -1,4 +1,14 @@
 import frappe
+from libya_customizations.libya_customizations.doctype.item_availability.item_availability import refresh_virtual_receipt_qty
+
+def update_item_availability(doc, method=None):
+    pairs = {(row.item_code, row.production_year) for row in doc.items}
+    previous = doc.get_doc_before_save() if method == "on_update" else None
+    if previous:
+        # rows removed from a draft virtual receipt still need their quantities released
+        pairs.update((row.item_code, row.production_year) for row in previous.items)
+    refresh_virtual_receipt_qty(pairs)
+
 def on_submit(doc, method):
     doctype = doc.doctype
     docname = doc.name
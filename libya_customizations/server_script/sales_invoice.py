@@ -1,7 +1,8 @@
 import frappe
 from frappe import _
 from frappe import json
-from libya_customizations.utils import reconcile_payments as reconcile_payments_entries
+from frappe.utils import flt, now
+from libya_customizations.utils import queue_reconciliation
 
 def get_default_company():
 	default_company = frappe.db.get_single_value("Global Defaults", "default_company")
@@ -31,102 +32,135 @@ def unreconcile_linked_payments(doc):
 
 def after_submit_sales_invoice_so(doc, method):
 	if not (doc.is_return or doc.update_stock or doc.is_opening == "Yes"):
-		rows = [{"name": row.so_detail, "qty": row.qty} for row in doc.items]
-		for row in rows:
-			qty = frappe.db.get_value("Sales Order Item", row["name"], "billed_qty")
-			qty = qty if qty else 0
-			frappe.db.set_value("Sales Order Item", row["name"], "billed_qty", qty + row["qty"])
-		docname = frappe.db.get_value("Sales Order Item", rows[0]['name'], "parent")
-		doc = frappe.get_doc("Sales Order", docname)
-		flag = True
-		for row in doc.items:
-			if row.qty != row.billed_qty:
-				flag = False
-				break
-		if flag and doc.per_billed < 100:
-			frappe.call("erpnext.selling.doctype.sales_order.sales_order.update_status", status="Closed", name=docname)
+		sales_orders = add_billed_qty("Sales Order Item", [(row.so_detail, row.qty) for row in doc.items])
+		for sales_order in get_billing_state("Sales Order Item", sales_orders):
+			if not sales_order.unbilled_rows and sales_order.per_billed < 100:
+				frappe.call("erpnext.selling.doctype.sales_order.sales_order.update_status", status="Closed", name=sales_order.parent)
 
 def after_submit_sales_invoice_dn(doc, method):
 	if not (doc.is_return or doc.update_stock or doc.is_opening == "Yes"):
-		rows = [{"name": row.dn_detail, "qty": row.qty} for row in doc.items]
+		delivery_notes = add_billed_qty("Delivery Note Item", [(row.dn_detail, row.qty) for row in doc.items])
+		update_delivery_note_billing_status(delivery_notes)
 
-		for row in rows:
-			qty = frappe.db.get_value("Delivery Note Item", row["name"], "billed_qty")
-			qty = qty if qty else 0
-			frappe.db.set_value("Delivery Note Item", row["name"], "billed_qty", qty + row["qty"])
-		docname = frappe.db.get_value("Delivery Note Item", rows[0]['name'], "parent")
-		total_billed_qty = frappe.db.get_value("Delivery Note Item", {'parent':docname}, 'sum(billed_qty)')
-		total_delivered_qty = frappe.db.get_value("Delivery Note Item", {'parent':docname}, 'sum(qty)')
-		if total_billed_qty == 0:
-			frappe.db.set_value('Delivery Note', docname, 'custom_per_billed', 0)
-			frappe.db.set_value('Delivery Note', docname, 'billing_status', 'Not Billed')
-		elif total_billed_qty > 0 and total_billed_qty < total_delivered_qty:
-			frappe.db.set_value('Delivery Note', docname, 'custom_per_billed', total_billed_qty / total_delivered_qty)
-			frappe.db.set_value('Delivery Note', docname, 'billing_status', 'Partly Billed')
-		else:
-			frappe.db.set_value('Delivery Note', docname, 'custom_per_billed', 100)
-			frappe.db.set_value('Delivery Note', docname, 'billing_status', 'Fully Billed')
-	
-		so = doc.items[0].sales_order
-		so_billing_status = frappe.db.get_value('Sales Order', so, 'billing_status')
-		so_delivery_status = frappe.db.get_value('Sales Order', so, 'delivery_status')
-		if so_billing_status == 'Partly Billed' and so_delivery_status == 'Fully Delivered':
-			frappe.db.set_value('Sales Order', so, 'status', 'Closed')
+		sales_orders = list({row.sales_order for row in doc.items if row.sales_order})
+		if sales_orders:
+			frappe.db.sql("""
+				UPDATE `tabSales Order`
+				SET status = 'Closed', modified = %s
+				WHERE name IN %s
+					AND billing_status = 'Partly Billed'
+					AND delivery_status = 'Fully Delivered'
+			""", (now(), sales_orders))
 		
 def before_cancel_sales_invoice_so(doc, method):
 	if not (doc.is_return or doc.update_stock or doc.is_opening == "Yes"):
-		rows = [{"name": row.so_detail, "qty": row.qty} for row in doc.items]
-
-		for row in rows:
-			qty = frappe.db.get_value("Sales Order Item", row["name"], "billed_qty")
-			qty = qty if qty else 0
-			frappe.db.set_value("Sales Order Item", row["name"], "billed_qty", qty - row["qty"])
-		docname = frappe.db.get_value("Sales Order Item", rows[0]['name'], "parent")
-		doc = frappe.get_doc("Sales Order", docname)
-		flag = False
-		for row in doc.items:
-			if row.qty != row.billed_qty:
-				flag = True
-				break
-		if flag:
-			frappe.call("erpnext.selling.doctype.sales_order.sales_order.update_status", status="Draft", name=docname)
+		sales_orders = add_billed_qty("Sales Order Item", [(row.so_detail, -row.qty) for row in doc.items])
+		for sales_order in get_billing_state("Sales Order Item", sales_orders):
+			if sales_order.unbilled_rows:
+				frappe.call("erpnext.selling.doctype.sales_order.sales_order.update_status", status="Draft", name=sales_order.parent)
 
 def before_cancel_sales_invoice_dn(doc, method):
 	if not (doc.is_return or doc.update_stock or doc.is_opening == "Yes"):
-		rows = [{"name": row.dn_detail, "qty": row.qty} for row in doc.items]
+		delivery_notes = add_billed_qty("Delivery Note Item", [(row.dn_detail, -row.qty) for row in doc.items])
+		update_delivery_note_billing_status(delivery_notes)
 
-		for row in rows:
-			qty = frappe.db.get_value("Delivery Note Item", row["name"], "billed_qty")
-			qty = qty if qty else 0
-			frappe.db.set_value("Delivery Note Item", row["name"], "billed_qty", qty - row["qty"])
-		docname = frappe.db.get_value("Delivery Note Item", rows[0]['name'], "parent")
-		total_billed_qty = frappe.db.get_value("Delivery Note Item", {'parent':docname}, 'sum(billed_qty)')
-		total_delivered_qty = frappe.db.get_value("Delivery Note Item", {'parent':docname}, 'sum(qty)')
-		if total_billed_qty == 0:
-			frappe.db.set_value('Delivery Note', docname, 'custom_per_billed', 0)
-			frappe.db.set_value('Delivery Note', docname, 'billing_status', 'Not Billed')
-		elif total_billed_qty > 0 and total_billed_qty < total_delivered_qty:
-			frappe.db.set_value('Delivery Note', docname, 'custom_per_billed', total_billed_qty / total_delivered_qty)
-			frappe.db.set_value('Delivery Note', docname, 'billing_status', 'Partly Billed')
-		else:
-			frappe.db.set_value('Delivery Note', docname, 'custom_per_billed', 100)
-			frappe.db.set_value('Delivery Note', docname, 'billing_status', 'Fully Billed')
+def add_billed_qty(doctype, rows):
+	"""Shifts billed_qty of the given (child row name, qty) pairs with one UPDATE and returns their parents."""
+	qty_by_row = {}
+	for name, qty in rows:
+		if name:
+			qty_by_row[name] = qty_by_row.get(name, 0) + flt(qty)
+	if not qty_by_row:
+		return []
+
+	values = []
+	for name, qty in qty_by_row.items():
+		values.extend((name, qty))
+	frappe.db.sql(f"""
+		UPDATE `tab{doctype}`
+		SET billed_qty = IFNULL(billed_qty, 0) + CASE name {" ".join(["WHEN %s THEN %s"] * len(qty_by_row))} END,
+			modified = %s
+		WHERE name IN %s
+	""", (*values, now(), list(qty_by_row)))
+
+	return frappe.db.sql_list(f"SELECT DISTINCT parent FROM `tab{doctype}` WHERE name IN %s", (list(qty_by_row),))
+
+def get_billing_state(doctype, parents):
+	"""Per parent: the number of rows whose billed_qty differs from qty, and the parent's per_billed."""
+	if not parents:
+		return []
+
+	parent_doctype = doctype[:-len(" Item")]
+	return frappe.db.sql(f"""
+		SELECT child.parent, SUM(child.qty != IFNULL(child.billed_qty, 0)) AS unbilled_rows, parent.per_billed
+		FROM `tab{doctype}` child
+		INNER JOIN `tab{parent_doctype}` parent ON child.parent = parent.name
+		WHERE child.parent IN %s
+		GROUP BY child.parent, parent.per_billed
+	""", (parents,), as_dict=True)
+
+def update_delivery_note_billing_status(delivery_notes):
+	if not delivery_notes:
+		return
+
+	frappe.db.sql("""
+		UPDATE `tabDelivery Note` delivery_note
+		INNER JOIN (
+			SELECT parent, IFNULL(SUM(billed_qty), 0) AS billed_qty, SUM(qty) AS qty
+			FROM `tabDelivery Note Item`
+			WHERE parent IN %(delivery_notes)s
+			GROUP BY parent
+		) delivery_note_item ON delivery_note.name = delivery_note_item.parent
+		SET delivery_note.custom_per_billed = CASE
+				WHEN delivery_note_item.billed_qty = 0 THEN 0
+				WHEN delivery_note_item.billed_qty > 0 AND delivery_note_item.billed_qty < delivery_note_item.qty THEN delivery_note_item.billed_qty / delivery_note_item.qty
+				ELSE 100
+			END,
+			delivery_note.billing_status = CASE
+				WHEN delivery_note_item.billed_qty = 0 THEN 'Not Billed'
+				WHEN delivery_note_item.billed_qty > 0 AND delivery_note_item.billed_qty < delivery_note_item.qty THEN 'Partly Billed'
+				ELSE 'Fully Billed'
+			END,
+			delivery_note.modified = %(modified)s
+	""", {"delivery_notes": delivery_notes, "modified": now()})
 
 			
 
 def before_submit_sales_invoice(doc, method):
-	rows = [{"name": row.name, "rate": row.net_rate, "valuation_rate": row.incoming_rate, "item_code": row.item_code, "item_name": row.item_name} for row in doc.items]
 	bypass_role = frappe.db.get_value("Company", get_default_company(), "role_bypass_price_list_validation")
+	roles = set(frappe.get_roles())
+
+	if doc.is_return or roles & {bypass_role, "Chief Sales Officer"}:
+		return
+
+	check_price_list = not roles & {"Sales Supervisor", "Chief Sales Officer"}
+	prices = get_price_list_rates(doc.selling_price_list, doc.items) if check_price_list else {}
+
+	errors = []
+	for row in doc.items:
+		if flt(row.net_rate) < flt(row.incoming_rate):
+			errors.append(_("<b>Net Rate</b> ({0}) of Item <b>{1}</b> is less than <b>Valuation Rate</b>").format('{:0.2f}'.format(flt(row.net_rate)), row.item_name))
+			continue
+
+		price_list_rate = prices.get((row.item_code, row.production_year or ""), prices.get((row.item_code, "")))
+		if check_price_list and price_list_rate is not None and flt(row.net_rate) < flt(price_list_rate):
+			errors.append(_("<b>Net Rate</b> ({0}) of Item <b>{1}</b> is less than <b>Price List Rate</b> ({2})").format('{:0.2f}'.format(flt(row.net_rate)), row.item_name, '{:0.2f}'.format(flt(price_list_rate))))
 
-	if not (frappe.db.get_value("Has Role", [["parent", "=", frappe.session.user], ['role', "in", [bypass_role, "Chief Sales Officer"]]]) or doc.is_return):
-		for row in rows:
-			if row['rate'] < row['valuation_rate']:
-				frappe.throw(_("<b>Net Rate</b> ({0}) of Item <b>{1}</b> is less than <b>Valuation Rate</b>").format('{:0.2f}'.format(row['rate']), row['item_name']))
-			elif not frappe.db.get_value("Has Role", [["parent", "=", frappe.session.user], ['role', "in", ["Sales Supervisor", "Chief Sales Officer"]]]):
-				for row in rows:
-					price_list_rate = frappe.db.get_value("Item Price", [["item_code","=", row['item_code']], ["price_list", "=", doc.selling_price_list]], "price_list_rate")
-					if row['rate'] < price_list_rate:
-						frappe.throw(_("<b>Net Rate</b> ({0}) of Item <b>{1}</b> is less than <b>Price List Rate</b> ({2})").format('{:0.2f}'.format(row['rate']), row['item_name'], '{:0.2f}'.format(price_list_rate)))
+	if errors:
+		frappe.throw("<br>".join(errors))
+
+def get_price_list_rates(price_list, items):
+	"""Price list rates of the invoice items keyed by (item_code, production_year), read with one query."""
+	item_codes = list({row.item_code for row in items})
+	if not item_codes:
+		return {}
+
+	prices = frappe.db.sql("""
+		SELECT item_code, IFNULL(production_year, '') AS production_year, price_list_rate
+		FROM `tabItem Price`
+		WHERE price_list = %s AND item_code IN %s
+	""", (price_list, item_codes), as_dict=True)
+	return {(price.item_code, price.production_year): price.price_list_rate for price in prices}
 
 def create_payment(doc, method):
 	doc = frappe.get_doc(doc)
@@ -268,10 +302,7 @@ def create_write_off(doc, method):
 		journal_entry.submit()
 
 def reconcile_payments(doc, method):
-	reconcile_payments_entries(doc.company, doc.debit_to, doc.customer)
-
-def reconcile_everything(doc, method):
-	frappe.call("erpnext.accounts.doctype.process_payment_reconciliation.process_payment_reconciliation.trigger_reconciliation_for_queued_docs")
+	queue_reconciliation(doc.company, doc.debit_to, doc.customer)
 
 def trigger_reconcile_everything():
 	frappe.call("erpnext.accounts.doctype.process_payment_reconciliation.process_payment_reconciliation.trigger_reconciliation_for_queued_docs")
@@ -2,6 +2,11 @@ import frappe
 from frappe import _
 from libya_customizations.server_script.stock_ledger_entry import update_item_price
 from libya_customizations.utils import check_roles_included
+from libya_customizations.availability import get_availability, get_availability_any_year
+from libya_customizations.customer_metrics import get_customer_metrics, get_customers_metrics
+from libya_customizations.libya_customizations.doctype.item_availability.item_availability import (
+    refresh_reserved_qty,
+)
 
 def get_default_company():
     default_company = frappe.db.get_single_value("Global Defaults", "default_company")
@@ -57,153 +62,18 @@ def get_items_with_prices(doc):
 
 def after_submit_sales_order(doc, method):
     flag = False
+    availability = get_availability(
+        [(row.item_code, row.production_year, doc.set_warehouse) for row in doc.items if row.production_year], memo=True
+    )
+    # rows without a production year are checked against the item's stock of every production year
+    availability.update(
+        ((item_code, "", warehouse), balances)
+        for (item_code, warehouse), balances in get_availability_any_year(
+            [(row.item_code, doc.set_warehouse) for row in doc.items if not row.production_year]
+        ).items()
+    )
     for row in doc.items:
-        if not row.production_year:
-            x1=''
-            x2=''
-        else:
-            x1=f"""and production_year = '{row.production_year}' """
-            x2=f"""and purchase_receipt_item.production_year = '{row.production_year}' """
-        balances = frappe.db.sql(f"""
-            SELECT
-                IF(sales_future.future_qty_to_deliver > purchase_future.future_balance, stock_actual.actual_balance - (sales_actual.actual_qty_to_deliver + (sales_future.future_qty_to_deliver - purchase_future.future_balance)), stock_actual.actual_balance-sales_actual.actual_qty_to_deliver) AS actual_available_qty,
-                (stock_actual.actual_balance + purchase_future.future_balance) - (sales_actual.actual_qty_to_deliver + sales_future.future_qty_to_deliver) AS future_available_qty
-            FROM
-                (
-                SELECT
-                    COALESCE(SUM(actual_qty), 0) AS actual_balance
-                FROM
-                    `tabStock Ledger Entry`
-                WHERE
-                    is_cancelled = 0
-                AND
-                    item_code = "{row.item_code}"
-                {x1}
-                AND
-                    warehouse="{doc.set_warehouse}"
-                ) stock_actual
-            LEFT JOIN
-                (
-                SELECT
-                    COALESCE(SUM(purchase_receipt_item.qty), 0) AS future_balance
-                FROM
-                    `tabPurchase Receipt Item` purchase_receipt_item
-                INNER JOIN
-                    `tabPurchase Receipt` purchase_receipt
-                ON
-                    purchase_receipt_item.parent = purchase_receipt.name
-                WHERE
-                    purchase_receipt_item.docstatus = 0
-                AND
-                    purchase_receipt.docstatus = 0
-                AND
-                    purchase_receipt.virtual_receipt = 1
-                AND
-                    purchase_receipt_item.item_code = "{row.item_code}"
-                {x2}
-                AND
-                    purchase_receipt_item.warehouse = "{doc.set_warehouse}"
-                ) purchase_future
-            ON
-                TRUE
-            LEFT JOIN
-                (
-                SELECT
-                    COALESCE(SUM(qty_to_deliver), 0) AS actual_qty_to_deliver
-                FROM
-                    (
-                    SELECT
-                        sales_order.name AS sales_order,
-                        sales_order.set_warehouse,
-                        sales_order_item.item_code,
-                        sales_order_item.production_year,
-                        IF(COALESCE(SUM(sales_order_item.qty - sales_order_item.delivered_qty), 0) > 0, COALESCE(SUM(sales_order_item.qty - sales_order_item.delivered_qty), 0), 0) AS qty_to_deliver
-                    FROM
-                        `tabSales Order Item` sales_order_item
-                    INNER JOIN
-                        `tabSales Order` sales_order
-                    ON
-                        sales_order_item.parent = sales_order.name
-                    INNER JOIN
-                        `tabItem` item
-                    ON
-                        sales_order_item.item_code = item.name
-                    WHERE
-                        sales_order.docstatus = 1
-                    AND
-                        sales_order_item.docstatus = 1
-                    AND
-                        sales_order.status NOT IN ('Completed', 'Closed')
-                    AND
-                        sales_order.reservation_status NOT IN ('Reserve against Future Receipts')
-                    AND
-                        sales_order_item.qty - sales_order_item.delivered_qty > 0
-                    AND
-                        item.is_stock_item = 1
-                    GROUP BY
-                        sales_order.name,
-                        sales_order.set_warehouse,
-                        sales_order_item.item_code,
-                        sales_order_item.production_year
-                    ) sales_order_item
-                WHERE
-                    item_code = "{row.item_code}"
-                {x1}
-                AND
-                    set_warehouse = "{doc.set_warehouse}"
-                ) sales_actual
-            ON
-                TRUE
-            LEFT JOIN
-                (
-                SELECT
-                    COALESCE(SUM(qty_to_deliver), 0) AS future_qty_to_deliver
-                FROM
-                    (
-                    SELECT
-                        sales_order.name AS sales_order,
-                        sales_order.set_warehouse,
-                        sales_order_item.item_code,
-                        sales_order_item.production_year,
-                        IF(COALESCE(SUM(sales_order_item.qty - sales_order_item.delivered_qty), 0) > 0, COALESCE(SUM(sales_order_item.qty - sales_order_item.delivered_qty), 0), 0) AS qty_to_deliver
-                    FROM
-                        `tabSales Order Item` sales_order_item
-                    INNER JOIN
-                        `tabSales Order` sales_order
-                    ON
-                        sales_order_item.parent = sales_order.name
-                    INNER JOIN
-                        `tabItem` item
-                    ON
-                        sales_order_item.item_code = item.name
-                    WHERE
-                        sales_order.docstatus = 1
-                    AND
-                        sales_order_item.docstatus = 1
-                    AND
-                        sales_order.status NOT IN ('Completed', 'Closed')
-                    AND
-                        sales_order.reservation_status IN ('Reserve against Future Receipts')
-                    AND
-                        sales_order_item.qty - sales_order_item.delivered_qty > 0
-                    AND
-                        item.is_stock_item = 1
-                    GROUP BY
-                        sales_order.name,
-                        sales_order.set_warehouse,
-                        sales_order_item.item_code,
-                        sales_order_item.production_year
-                    ) sales_order_item
-                WHERE
-                    item_code = "{row.item_code}"
-                {x1}
-                AND
-                    set_warehouse = "{doc.set_warehouse}"
-                ) sales_future
-            ON
-                TRUE
-        """, as_dict= True)
-        balances = balances[0]
+        balances = availability[(row.item_code, row.production_year or "", doc.set_warehouse)]
         if doc.reservation_status == "Reserve against Future Receipts" and check_roles_included("reserve_against_future_receipts"):
             if balances.future_available_qty < 0:
                 frappe.throw(_("Available Qty of Item <b>{0}</b> is not enough. The shortage qty is <b>{1}</b>").format(row.item_name, int(-balances.future_available_qty)))
@@ -215,6 +85,14 @@ def after_submit_sales_order(doc, method):
     if flag:
         raise frappe.ValidationError
     
+def update_item_availability(doc, method=None):
+    pairs = {(row.item_code, row.production_year) for row in doc.items}
+    previous = doc.get_doc_before_save()
+    if previous:
+        # rows removed through Update Items still need their reservations released
+        pairs.update((row.item_code, row.production_year) for row in previous.items)
+    refresh_reserved_qty(pairs)
+
 def before_save_sales_order(doc, method):
     doc = frappe.get_doc(doc)
     if  (
@@ -252,135 +130,26 @@ def validate_before_submit_sales_order(doc, method):
 
 @frappe.whitelist()
 def get_customer_info(customer):
-    sql = frappe.db.sql(f"""SELECT
-    gl_entry.customer_balance,
-    sales_invoice_actual.customer_actual_overdues,
-    sales_invoice_potential.customer_potential_overdues,
-    customer_credit_limit.customer_credit_limit,
-    sales_order_item.unbilled_sales_orders,
-    IF((gl_entry.customer_balance + sales_order_item.unbilled_sales_orders > customer_credit_limit.customer_credit_limit AND customer_credit_limit.customer_credit_limit > 0) OR sales_invoice_actual.customer_actual_overdues > 0, '#FF0000', IF((gl_entry.customer_balance + sales_order_item.unbilled_sales_orders > customer_credit_limit.customer_credit_limit * 0.85 AND customer_credit_limit.customer_credit_limit > 0) OR sales_invoice_potential.customer_potential_overdues > 0, '#FFA500', '#008000')) AS customer_index
-FROM
-    (
-    SELECT
-        COALESCE(SUM(debit - credit), 0) AS customer_balance
-    FROM
-        `tabGL Entry`
-    WHERE
-        is_cancelled = 0
-    AND
-        party_type = 'Customer'
-    AND
-        party = "{customer}"
-    ) gl_entry
-LEFT JOIN
-    (
-    SELECT
-        COALESCE(SUM(sales_invoice.outstanding_amount), 0) AS customer_actual_overdues
-    FROM
-        `tabSales Invoice` sales_invoice
-    LEFT JOIN
-        (
-        SELECT
-            customer.name,
-            COALESCE(payment_terms_template_detail.credit_days, 0) AS credit_days
-        FROM
-            `tabCustomer` customer
-        LEFT JOIN
-            `tabPayment Terms Template Detail` payment_terms_template_detail
-        ON
-            customer.payment_terms = payment_terms_template_detail.parent
-        ) customer
-    ON
-        sales_invoice.customer = customer.name
-    WHERE
-        sales_invoice.docstatus = 1
-    AND
-        sales_invoice.is_return = 0
-    AND
-        sales_invoice.outstanding_amount > 0
-    AND
-        DATE(DATE_ADD(NOW(), INTERVAL 2 HOUR)) >= DATE_ADD(sales_invoice.posting_date, INTERVAL customer.credit_days DAY)
-    AND
-        sales_invoice.customer = "{customer}"
-    ) sales_invoice_actual
-ON
-    TRUE
-LEFT JOIN
-    (
-    SELECT
-        COALESCE(SUM(sales_invoice.outstanding_amount), 0) AS customer_potential_overdues
-    FROM
-        `tabSales Invoice` sales_invoice
-    LEFT JOIN
-        (
-        SELECT
-            customer.name,
-            COALESCE(payment_terms_template_detail.credit_days, 0) AS credit_days
-        FROM
-            `tabCustomer` customer
-        LEFT JOIN
-            `tabPayment Terms Template Detail` payment_terms_template_detail
-        ON
-            customer.payment_terms = payment_terms_template_detail.parent
-        ) customer
-    ON
-        sales_invoice.customer = customer.name
-    WHERE
-        sales_invoice.docstatus = 1
-    AND
-        sales_invoice.is_return = 0
-    AND
-        sales_invoice.outstanding_amount > 0
-    AND
-        DATE(DATE_ADD(NOW(), INTERVAL 2 HOUR)) < DATE_ADD(sales_invoice.posting_date, INTERVAL customer.credit_days DAY)
-    AND
-        DATE(DATE_ADD(NOW(), INTERVAL 2 HOUR)) >= DATE_ADD(sales_invoice.posting_date, INTERVAL FLOOR(customer.credit_days * 0.85) DAY)
-    AND
-        sales_invoice.customer = "{customer}"
-    ) sales_invoice_potential
-ON
-    TRUE
-LEFT JOIN
-    (
-    SELECT
-        COALESCE(SUM(credit_limit), 0) AS customer_credit_limit
-    FROM
-        `tabCustomer Credit Limit`
-    WHERE
-        parenttype = 'Customer'
-    AND
-        parent = "{customer}"
-    
-    ) customer_credit_limit
-ON
-    TRUE
-LEFT JOIN
-    (
-    SELECT
-        COALESCE(SUM((sales_order_item.amount - sales_order_item.billed_amt) * sales_order.grand_total / sales_order.total), 0) AS unbilled_sales_orders
-    FROM
-        `tabSales Order Item` sales_order_item
-    INNER JOIN
-        `tabSales Order` sales_order
-    ON
-        sales_order_item.parent = sales_order.name
-    WHERE
-        sales_order_item.docstatus = 1
-    AND
-        sales_order.docstatus = 1
-    AND
-        sales_order.status NOT IN ('Closed', 'Completed')
-    AND
-        sales_order_item.amount - sales_order_item.billed_amt > 0
-    AND
-        sales_order.customer = "{customer}"
-    ) sales_order_item
-ON
-    TRUE""", as_dict=True)
-    return sql
+    """Credit figures of one customer, as a one-row list like the query it replaced returned."""
+    frappe.has_permission("Customer", "read", customer, throw=True)
+    return [frappe._dict(get_customer_metrics(customer))]
 
 import json
 
+# a full list view page
+MAX_CUSTOMERS_PER_CALL = 500
+
+@frappe.whitelist()
+def get_customers_info(customers):
+    """Credit figures of many customers in one call, keyed by customer, for list views and dashboards."""
+    frappe.has_permission("Customer", "read", throw=True)
+    if isinstance(customers, str):
+        customers = json.loads(customers)
+    if len(customers) > MAX_CUSTOMERS_PER_CALL:
+        frappe.throw(_("Customer figures can be fetched for at most {0} customers at a time").format(MAX_CUSTOMERS_PER_CALL))
+    return get_customers_metrics(customers)
+
+
 @frappe.whitelist()
 def create_dn_from_so(doc):
     doc = json.loads(doc)
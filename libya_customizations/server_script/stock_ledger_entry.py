@@ -1,11 +1,38 @@
 import frappe
-from frappe.utils import now_datetime
+from frappe.utils import flt, now_datetime
+from libya_customizations.availability import get_item_totals
+from libya_customizations.libya_customizations.doctype.item_availability.item_availability import (
+    add_actual_qty,
+    refresh_reserved_qty,
+)
+
+# vouchers that consume Sales Order reservations while they move stock
+RESERVATION_VOUCHER_TYPES = ("Delivery Note", "Sales Invoice")
 
 def update_item_price(doc, method=None):
+    if doc.get("doctype") == "Stock Ledger Entry" and method == "on_cancel":
+        if apply_item_price_delta(
+            doc.item_code, doc.production_year,
+            -flt(doc.actual_qty), -flt(doc.stock_value_difference),
+            reread_reservations=doc.voucher_type in RESERVATION_VOUCHER_TYPES,
+        ):
+            return
+
+    refresh_item_price(doc.item_code, doc.production_year)
+
+
+def update_item_availability(doc, method=None):
+    qty = -flt(doc.actual_qty) if method == "on_cancel" else flt(doc.actual_qty)
+    add_actual_qty([(doc.item_code, doc.production_year, doc.warehouse, qty)])
 
-    values = get_valuation_rate_and_qty(doc.item_code, doc.production_year)
+    if doc.voucher_type in RESERVATION_VOUCHER_TYPES:
+        refresh_reserved_qty([(doc.item_code, doc.production_year)])
+
+
+def refresh_item_price(item_code, production_year):
+    values = get_valuation_rate_and_qty(item_code, production_year)
     values["modified"] = now_datetime()
-    
+
     frappe.db.sql(
         """
         UPDATE `tabItem Price`
@@ -19,6 +46,84 @@ def update_item_price(doc, method=None):
     )
 
 
+def apply_item_price_delta(item_code, production_year, qty_delta, value_delta, reread_reservations=False):
+    """Moves the denormalized Item Price figures by the qty / value delta of one or more ledger entries.
+
+    `reread_reservations` is set when the entries came from vouchers that also moved
+    delivered_qty on Sales Orders, so available_qty has to be taken against the current
+    open reservations instead of being shifted by the qty delta.
+
+    Returns False when the stored figures cannot be moved safely (no Item Price for the
+    production year, or no stock on either side of the delta), in which case the caller
+    should fall back to `refresh_item_price`.
+    """
+    qty_delta, value_delta = flt(qty_delta), flt(value_delta)
+    if not qty_delta and not value_delta:
+        return True
+
+    production_year = production_year or ""
+    # every price list carries the same figures for an item / production year; the rows stay
+    # locked until commit, so concurrent deltas of one item are applied one after the other
+    priced_years = {row[0] for row in frappe.db.sql("""
+        SELECT IFNULL(production_year, '')
+        FROM `tabItem Price`
+        WHERE item_code = %s
+        FOR UPDATE
+    """, (item_code,))}
+    if production_year not in priced_years:
+        return False
+
+    # the rate spans every production year, priced or not, and Item Availability already
+    # counts the entries behind the delta
+    item_qty = flt(frappe.db.sql("""
+        SELECT SUM(actual_qty) FROM `tabItem Availability` WHERE item_code = %s
+    """, (item_code,))[0][0])
+    if item_qty <= 0 or item_qty - qty_delta <= 0:
+        return False
+
+    values = {
+        "item_code": item_code,
+        "production_year": production_year,
+        "qty_delta": qty_delta,
+        "value_delta": value_delta,
+        "item_qty": item_qty,
+        "modified": now_datetime(),
+    }
+
+    if reread_reservations:
+        values["qty_to_deliver"] = get_qty_to_deliver(item_code, production_year)
+        available_qty = "stock_qty + %(qty_delta)s - %(qty_to_deliver)s"
+    else:
+        available_qty = "available_qty + %(qty_delta)s"
+
+    frappe.db.sql(
+        f"""
+        UPDATE `tabItem Price`
+        SET available_qty = IF(IFNULL(production_year, '') = %(production_year)s, {available_qty}, available_qty),
+            stock_qty = IF(IFNULL(production_year, '') = %(production_year)s, stock_qty + %(qty_delta)s, stock_qty),
+            stock_valuation_rate = ((%(item_qty)s - %(qty_delta)s) * stock_valuation_rate + %(value_delta)s) / %(item_qty)s,
+            modified = %(modified)s
+        WHERE item_code = %(item_code)s
+        """, values,
+    )
+    return True
+
+
+def update_item_prices_by_delta(deltas):
+    """Applies coalesced deltas, keyed by (item_code, production_year), once per key.
+
+    Each value is a dict with `qty`, `value`, `reread_reservations` and `refresh`; keys
+    flagged with `refresh`, or that cannot be moved incrementally, are recomputed from
+    the ledger.
+    """
+    for (item_code, production_year), delta in deltas.items():
+        if delta["refresh"] or not apply_item_price_delta(
+            item_code, production_year, delta["qty"], delta["value"],
+            reread_reservations=delta["reread_reservations"],
+        ):
+            refresh_item_price(item_code, production_year)
+
+
 def get_valuation_rate_and_qty(item_code, production_year):
 
     avg_rate = frappe.db.sql("""
@@ -27,24 +132,9 @@ def get_valuation_rate_and_qty(item_code, production_year):
         WHERE item_code = %s AND is_cancelled = 0
     """, (item_code,))[0][0]
 
-    # Get Stock Qty (based on item_code + production_year)
-    stock_qty = frappe.db.sql("""
-        SELECT IFNULL(SUM(actual_qty), 0)
-        FROM `tabStock Ledger Entry`
-        WHERE is_cancelled = 0 AND item_code = %s AND IFNULL(production_year, '') = IFNULL(%s, '')
-    """, (item_code, production_year))[0][0]
-
-    qty_to_deliver = frappe.db.sql("""
-        WITH reserved_qty AS (
-            SELECT so.name, IF(SUM(soi.qty - soi.delivered_qty) > 0, SUM(soi.qty - soi.delivered_qty), 0) AS qty_to_deliver
-            FROM `tabSales Order Item` soi
-            INNER JOIN `tabSales Order` so ON soi.parent = so.name
-            WHERE soi.docstatus = 1 AND so.docstatus = 1 AND so.status NOT IN ('Completed', 'Closed') AND soi.qty - soi.delivered_qty > 0
-            AND soi.item_code = %s AND IFNULL(soi.production_year, '') = IFNULL(%s, '')
-        )
-        SELECT IFNULL(SUM(qty_to_deliver), 0)
-        FROM reserved_qty
-    """, (item_code, production_year))[0][0]
+    totals = get_item_totals(item_code, production_year)
+    stock_qty = totals.actual_qty
+    qty_to_deliver = totals.qty_to_deliver + totals.future_qty_to_deliver
 
     available_qty = stock_qty - qty_to_deliver
 
@@ -54,4 +144,9 @@ def get_valuation_rate_and_qty(item_code, production_year):
         "available_qty": available_qty or 0,
         "item_code": item_code,
         "production_year": production_year
-    }
\ No newline at end of file
+    }
+
+
+def get_qty_to_deliver(item_code, production_year):
+    totals = get_item_totals(item_code, production_year)
+    return totals.qty_to_deliver + totals.future_qty_to_deliver
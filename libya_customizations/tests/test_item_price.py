@@ -0,0 +1,119 @@
+import json
+from io import BytesIO
+from unittest.mock import patch
+
+import frappe
+from erpnext.stock.doctype.item.test_item import make_item
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import flt
+from openpyxl import Workbook, load_workbook
+
+from libya_customizations.server_script.item_price import (
+	ITEM_PRICE_EXPORT_FIELDS,
+	export_item_price_data,
+	import_item_price_data,
+)
+
+PRICE_LIST = "_Test Price List"
+
+
+class TestItemPriceImport(FrappeTestCase):
+	def setUp(self):
+		self.prices = [make_item_price(f"_Test Item Price Import {index}", rate) for index, rate in enumerate((100, 200))]
+
+	def tearDown(self):
+		frappe.db.rollback()
+
+	def test_changed_rates_are_applied(self):
+		file_url = make_price_sheet([(self.prices[0], 150), (self.prices[1], 200)])
+		summary = import_item_price_data(file_url)
+
+		self.assertEqual((summary["changed"], summary["unchanged"], summary["invalid"]), (1, 1, 0))
+		self.assertEqual(get_rates(self.prices), [150, 200])
+
+	def test_invalid_rows_reject_the_whole_sheet(self):
+		file_url = make_price_sheet([(self.prices[0], 150), (self.prices[1], "abc"), ("_Test Missing Price", 10)])
+		with patch.object(frappe.db, "commit") as commit:
+			# the second chunk is read after the first one's change was found
+			summary = import_item_price_data(file_url, chunk_size=1)
+
+		commit.assert_not_called()
+		self.assertEqual((summary["changed"], summary["invalid"]), (0, 2))
+		self.assertEqual([error["row"] for error in summary["errors"]], [3, 4])
+		self.assertEqual(get_rates(self.prices), [100, 200])
+
+
+class TestItemPriceExport(FrappeTestCase):
+	def setUp(self):
+		self.price = make_item_price("_Test Item Price Export", 125)
+
+	def tearDown(self):
+		frappe.db.rollback()
+
+	def test_small_exports_are_built_in_the_request(self):
+		file_url = export_item_price_data(json.dumps({"name": self.price}))
+
+		content = frappe.get_doc("File", {"file_url": file_url}).get_content()
+		rows = list(load_workbook(BytesIO(content), read_only=True).active.iter_rows(values_only=True))
+		self.assertEqual(list(rows[0]), ITEM_PRICE_EXPORT_FIELDS)
+		self.assertEqual(len(rows), 2)
+		self.assertEqual(rows[1][ITEM_PRICE_EXPORT_FIELDS.index("name")], self.price)
+		self.assertEqual(flt(rows[1][ITEM_PRICE_EXPORT_FIELDS.index("price_list_rate")]), 125)
+
+	@patch("libya_customizations.server_script.item_price.ITEM_PRICE_EXPORT_BACKGROUND_ROWS", 0)
+	def test_large_exports_are_queued_once_per_filters(self):
+		filters = json.dumps({"price_list": PRICE_LIST})
+		with (
+			patch("frappe.enqueue") as enqueue,
+			patch("libya_customizations.server_script.item_price.is_job_enqueued", return_value=False),
+		):
+			self.assertTrue(export_item_price_data(filters)["queued"])
+			self.assertTrue(export_item_price_data(filters)["queued"])
+			export_item_price_data(json.dumps({"name": self.price}))
+
+		job_ids = [call.kwargs["job_id"] for call in enqueue.call_args_list]
+		self.assertEqual(job_ids[0], job_ids[1])
+		self.assertNotEqual(job_ids[0], job_ids[2])
+		self.assertTrue(all(call.kwargs["deduplicate"] and call.kwargs["notify"] for call in enqueue.call_args_list))
+
+		with (
+			patch("frappe.enqueue") as enqueue,
+			patch("libya_customizations.server_script.item_price.is_job_enqueued", return_value=True),
+		):
+			self.assertTrue(export_item_price_data(filters)["running"])
+		enqueue.assert_not_called()
+
+
+def make_item_price(item_code, rate):
+	make_item(item_code, {"is_stock_item": 1})
+	return frappe.get_doc({
+		"doctype": "Item Price",
+		"item_code": item_code,
+		"price_list": PRICE_LIST,
+		"price_list_rate": rate,
+	}).insert().name
+
+
+def make_price_sheet(rates):
+	"""An Item Price export with the given (name, price_list_rate) rows, saved as a private File."""
+	workbook = Workbook()
+	sheet = workbook.active
+	sheet.append(ITEM_PRICE_EXPORT_FIELDS)
+	for name, rate in rates:
+		row = [None] * len(ITEM_PRICE_EXPORT_FIELDS)
+		row[ITEM_PRICE_EXPORT_FIELDS.index("name")] = name
+		row[ITEM_PRICE_EXPORT_FIELDS.index("price_list_rate")] = rate
+		sheet.append(row)
+
+	xlsx_file = BytesIO()
+	workbook.save(xlsx_file)
+	return frappe.get_doc({
+		"doctype": "File",
+		"file_name": f"{frappe.generate_hash(length=8)}.xlsx",
+		"content": xlsx_file.getvalue(),
+		"is_private": 1,
+	}).insert().file_url
+
+
+def get_rates(names):
+	return [flt(frappe.db.get_value("Item Price", name, "price_list_rate")) for name in names]
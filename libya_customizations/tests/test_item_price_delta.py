@@ -0,0 +1,43 @@
+import frappe
+from erpnext.stock.doctype.item.test_item import make_item
+from erpnext.stock.doctype.stock_entry.stock_entry_utils import make_stock_entry
+from frappe.tests.utils import FrappeTestCase
+
+from libya_customizations.server_script.stock_ledger_entry import apply_item_price_delta, refresh_item_price
+
+WAREHOUSE = "_Test Warehouse - _TC"
+FIGURES = ("stock_valuation_rate", "stock_qty", "available_qty")
+
+
+class TestItemPriceDelta(FrappeTestCase):
+	def setUp(self):
+		self.item_code = make_item("_Test Item Price Delta Item", {"is_stock_item": 1}).name
+		self.item_price = frappe.get_doc({
+			"doctype": "Item Price",
+			"item_code": self.item_code,
+			"price_list": "_Test Price List",
+			"price_list_rate": 500,
+		}).insert()
+
+	def tearDown(self):
+		frappe.db.rollback()
+
+	def test_delta_matches_refresh(self):
+		# the first receipt has no stock to move from and is refreshed, the rest go through the delta
+		make_stock_entry(item_code=self.item_code, target=WAREHOUSE, qty=10, basic_rate=100)
+		make_stock_entry(item_code=self.item_code, target=WAREHOUSE, qty=5, basic_rate=160)
+		make_stock_entry(item_code=self.item_code, source=WAREHOUSE, qty=3)
+		moved = self.get_figures()
+
+		refresh_item_price(self.item_code, None)
+		refreshed = self.get_figures()
+
+		self.assertEqual(refreshed.stock_qty, 12)
+		for field in FIGURES:
+			self.assertAlmostEqual(moved[field], refreshed[field], places=4)
+
+	def test_delta_without_stock_falls_back(self):
+		self.assertFalse(apply_item_price_delta(self.item_code, None, 5, 500))
+
+	def get_figures(self):
+		return frappe.db.get_value("Item Price", self.item_price.name, FIGURES, as_dict=True)
@@ -0,0 +1,53 @@
+import frappe
+from erpnext.stock.doctype.item.test_item import make_item
+from erpnext.stock.doctype.stock_entry.stock_entry_utils import make_stock_entry
+from erpnext.stock.doctype.stock_reconciliation.test_stock_reconciliation import create_stock_reconciliation
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_days, today
+
+from libya_customizations.events import get_ledger_variances
+
+WAREHOUSE = "_Test Warehouse - _TC"
+
+
+class TestLedgerVariances(FrappeTestCase):
+	def setUp(self):
+		self.item_code = make_item("_Test Ledger Variance Item", {"is_stock_item": 1}).name
+
+	def tearDown(self):
+		frappe.db.rollback()
+
+	def test_reconciliation_restarts_the_running_sums(self):
+		make_stock_entry(item_code=self.item_code, target=WAREHOUSE, qty=10, basic_rate=100, posting_date=add_days(today(), -4))
+		create_stock_reconciliation(
+			item_code=self.item_code, warehouse=WAREHOUSE, qty=4, rate=150, posting_date=add_days(today(), -3)
+		)
+		make_stock_entry(item_code=self.item_code, target=WAREHOUSE, qty=6, basic_rate=150, posting_date=add_days(today(), -2))
+		make_stock_entry(item_code=self.item_code, source=WAREHOUSE, qty=2, posting_date=add_days(today(), -1))
+
+		self.assertEqual(self.get_variances(), [])
+
+	def test_only_the_first_variance_is_reported(self):
+		make_stock_entry(item_code=self.item_code, target=WAREHOUSE, qty=10, basic_rate=100, posting_date=add_days(today(), -4))
+		corrupted = make_stock_entry(item_code=self.item_code, target=WAREHOUSE, qty=5, basic_rate=100, posting_date=add_days(today(), -3))
+		make_stock_entry(item_code=self.item_code, source=WAREHOUSE, qty=2, posting_date=add_days(today(), -2))
+		make_stock_entry(item_code=self.item_code, source=WAREHOUSE, qty=1, posting_date=add_days(today(), -1))
+
+		# the entry's qty no longer adds up to the running total, every later entry still does
+		frappe.db.set_value(
+			"Stock Ledger Entry",
+			{"voucher_no": corrupted.name, "is_cancelled": 0},
+			"actual_qty",
+			7,
+			update_modified=False,
+		)
+
+		self.assertEqual(self.get_variances(), [("Stock Entry", corrupted.name)])
+
+	def get_variances(self):
+		vouchers = frappe.get_all("Stock Ledger Entry", {"item_code": self.item_code}, pluck="voucher_no")
+		return [
+			(variance.voucher_type, variance.voucher_no)
+			for variance in get_ledger_variances("_Test Company")
+			if variance.voucher_no in vouchers
+		]
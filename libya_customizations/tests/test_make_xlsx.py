@@ -0,0 +1,28 @@
+from unittest.mock import patch
+
+from frappe.tests.utils import FrappeTestCase
+from openpyxl import load_workbook
+
+from libya_customizations.utils import make_xlsx
+
+
+class TestMakeXlsx(FrappeTestCase):
+	def test_rows_are_streamed_from_a_generator(self):
+		def rows():
+			yield ["Item", "Qty"]
+			for index in range(25):
+				yield [f"Item {index}\x01", index]
+
+		with patch("libya_customizations.utils.XLSX_WIDTH_SAMPLE_ROWS", 5):
+			xlsx_file = make_xlsx(rows(), "Stock Balance")
+
+		xlsx_file.seek(0)
+		sheet = load_workbook(xlsx_file).active
+		values = list(sheet.iter_rows(values_only=True))
+
+		self.assertEqual(values[0], ("Item", "Qty"))
+		self.assertEqual(len(values), 26)
+		# illegal characters are removed past the width sample too
+		self.assertEqual(values[-1], ("Item 24", 24))
+		self.assertTrue(sheet["A1"].font.bold)
+		self.assertEqual(sheet.column_dimensions["A"].width, (len("Item 0") + 2) * 1.2)
@@ -0,0 +1,48 @@
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from libya_customizations.utils import (
+	RECONCILIATION_QUEUE,
+	process_reconciliation_queue,
+	queue_reconciliation,
+)
+
+
+class TestReconciliationQueue(FrappeTestCase):
+	def tearDown(self):
+		frappe.cache().delete_value(RECONCILIATION_QUEUE)
+
+	def test_worker_drains_queued_keys(self):
+		queue_reconciliation("_Test Company", "Debtors - _TC", "_Test Customer")
+		queue_reconciliation("_Test Company", "Debtors - _TC", "_Test Customer")
+		# the key is only recorded once the transaction commits
+		self.assertFalse(frappe.cache().smembers(RECONCILIATION_QUEUE))
+		frappe.db.after_commit.run()
+		self.assertEqual(len(frappe.cache().smembers(RECONCILIATION_QUEUE)), 1)
+
+		with (
+			patch("libya_customizations.utils.reconcile_payments") as reconcile_payments,
+			patch.object(frappe.db, "commit"),
+			patch("frappe.call"),
+		):
+			process_reconciliation_queue()
+
+		reconcile_payments.assert_called_once_with("_Test Company", "Debtors - _TC", "_Test Customer")
+		self.assertFalse(frappe.cache().smembers(RECONCILIATION_QUEUE))
+
+	def test_worker_pops_one_batch_per_run(self):
+		for index in range(3):
+			frappe.cache().sadd(RECONCILIATION_QUEUE, f'["_Test Company", "Debtors - _TC", "_Test Customer {index}"]')
+
+		with (
+			patch("libya_customizations.utils.RECONCILIATION_BATCH_SIZE", 2),
+			patch("libya_customizations.utils.reconcile_payments") as reconcile_payments,
+			patch.object(frappe.db, "commit"),
+			patch("frappe.call"),
+		):
+			process_reconciliation_queue()
+
+		self.assertEqual(reconcile_payments.call_count, 2)
+		self.assertEqual(len(frappe.cache().smembers(RECONCILIATION_QUEUE)), 1)
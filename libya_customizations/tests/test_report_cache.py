@@ -0,0 +1,42 @@
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from libya_customizations.report_cache import CACHED_MODULE, execute_query_report, get_watermarks
+from libya_customizations.libya_customizations.doctype.sales_fact.sales_fact import refresh_sales_facts
+
+QUERY = "SELECT item_code, SUM(qty) FROM `tabSales Fact` GROUP BY item_code"
+
+
+class TestReportCache(FrappeTestCase):
+	def test_deleting_facts_moves_the_watermark(self):
+		before = get_watermarks(QUERY)
+
+		# a key without invoices or ledger entries only deletes, leaving MAX(`modified`) where it was
+		refresh_sales_facts([("2000-01-01", "_Test Item")])
+		self.assertEqual(get_watermarks(QUERY), before)
+
+		frappe.db.after_commit.run()
+		self.assertNotEqual(get_watermarks(QUERY), before)
+
+	def test_results_are_cached_once_per_key(self):
+		report = get_report(QUERY)
+		result = [["_Test Item", 1.5]], [{"item_code": "_Test Item"}]
+		with patch("libya_customizations.report_cache._execute_query_report", return_value=result) as execute:
+			self.assertEqual(execute_query_report(report, {}), result)
+			self.assertEqual(execute_query_report(report, {}), result)
+		execute.assert_called_once()
+
+	def test_time_of_day_queries_are_not_cached(self):
+		report = get_report("SELECT name FROM `tabSales Invoice` WHERE posting_date <= DATE(NOW())")
+		with patch("libya_customizations.report_cache._execute_query_report", return_value=([], [])) as execute:
+			execute_query_report(report, {})
+			execute_query_report(report, {})
+		self.assertEqual(execute.call_count, 2)
+
+
+def get_report(query):
+	return frappe._dict(
+		name=f"_Test Report {frappe.generate_hash(length=6)}", modified="2026-01-01", module=CACHED_MODULE, query=query
+	)
@@ -0,0 +1,106 @@
+import frappe
+from erpnext.stock.doctype.item.test_item import make_item
+from erpnext.stock.doctype.stock_entry.stock_entry_utils import make_stock_entry
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_days, add_to_date, getdate, now, today
+
+from libya_customizations.events import REPOST_RUN_TIMEOUT, plan_repost_item_valuations, repost_in_progress
+
+WAREHOUSE = "_Test Warehouse - _TC"
+
+
+class TestRepostPlanner(FrappeTestCase):
+	def setUp(self):
+		self.item_code = make_item("_Test Repost Planner Item", {"is_stock_item": 1}).name
+
+	def tearDown(self):
+		frappe.db.rollback()
+
+	def test_same_key_reposts_merge_into_the_earliest(self):
+		later = make_repost(item_code=self.item_code, posting_date=add_days(today(), -2))
+		earlier = make_repost(item_code=self.item_code, posting_date=add_days(today(), -4))
+
+		plan_repost_item_valuations()
+
+		self.assertEqual(get_status(earlier.name), "Queued")
+		self.assertEqual(get_status(later.name), "Skipped")
+		self.assertEqual(
+			getdate(frappe.db.get_value("Repost Item Valuation", earlier.name, "posting_date")),
+			getdate(add_days(today(), -4)),
+		)
+
+	def test_survivor_moves_back_to_an_earlier_voucher_repost(self):
+		stock_entry = make_stock_entry(
+			item_code=self.item_code, target=WAREHOUSE, qty=5, basic_rate=100, posting_date=add_days(today(), -5)
+		)
+		voucher_repost = make_repost(
+			based_on="Transaction",
+			voucher_type="Stock Entry",
+			voucher_no=stock_entry.name,
+			posting_date=add_days(today(), -5),
+		)
+		item_repost = make_repost(item_code=self.item_code, posting_date=add_days(today(), -1))
+
+		plan_repost_item_valuations()
+
+		self.assertEqual(get_status(voucher_repost.name), "Skipped")
+		self.assertEqual(get_status(item_repost.name), "Queued")
+		self.assertEqual(
+			getdate(frappe.db.get_value("Repost Item Valuation", item_repost.name, "posting_date")),
+			getdate(add_days(today(), -5)),
+		)
+
+	def test_repeated_voucher_reposts_merge(self):
+		stock_entry = make_stock_entry(
+			item_code=self.item_code, target=WAREHOUSE, qty=5, basic_rate=100, posting_date=add_days(today(), -3)
+		)
+		first, second = (
+			make_repost(
+				based_on="Transaction",
+				voucher_type="Stock Entry",
+				voucher_no=stock_entry.name,
+				posting_date=add_days(today(), -3),
+			)
+			for _ in range(2)
+		)
+
+		plan_repost_item_valuations()
+
+		self.assertEqual(get_status(first.name), "Queued")
+		self.assertEqual(get_status(second.name), "Skipped")
+
+	def test_running_repost_does_not_skip_queued_ones(self):
+		running = make_repost(item_code=self.item_code, posting_date=add_days(today(), -4))
+		running.db_set("status", "In Progress")
+		queued = make_repost(item_code=self.item_code, posting_date=add_days(today(), -2))
+
+		plan_repost_item_valuations()
+
+		self.assertEqual(get_status(queued.name), "Queued")
+
+	def test_live_repost_holds_the_run_back(self):
+		running = make_repost(item_code=self.item_code, posting_date=add_days(today(), -4))
+		running.db_set("status", "In Progress")
+		self.assertTrue(repost_in_progress())
+
+		# a repost its worker stopped saving long ago does not
+		running.db_set("modified", add_to_date(now(), seconds=-REPOST_RUN_TIMEOUT - 60), update_modified=False)
+		self.assertFalse(repost_in_progress())
+
+
+def make_repost(**kwargs):
+	repost = frappe.get_doc({
+		"doctype": "Repost Item Valuation",
+		"based_on": "Item and Warehouse",
+		"warehouse": WAREHOUSE,
+		"posting_time": "00:00:00",
+		"company": "_Test Company",
+		**kwargs,
+	})
+	repost.flags.dont_run_in_test = True
+	repost.submit()
+	return repost
+
+
+def get_status(name):
+	return frappe.db.get_value("Repost Item Valuation", name, "status")
@@ -0,0 +1,72 @@
+import json
+
+import frappe
+from erpnext.stock.doctype.delivery_note.test_delivery_note import create_delivery_note
+from erpnext.stock.doctype.item.test_item import make_item
+from erpnext.stock.doctype.stock_entry.stock_entry_utils import make_stock_entry
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_days, flt, today
+
+from libya_customizations.overrides.repost_sl import dump_stock_queue, pack_stock_queue
+
+WAREHOUSE = "_Test Warehouse - _TC"
+
+
+class TestRepostWriteBuffer(FrappeTestCase):
+	def test_return_reposted_with_its_delivery_takes_the_new_rate(self):
+		item_code = make_item("_Test Repost Buffer Item", {"is_stock_item": 1, "valuation_method": "FIFO"}).name
+		make_stock_entry(item_code=item_code, target=WAREHOUSE, qty=10, basic_rate=100, posting_date=add_days(today(), -5))
+		delivery_note = create_delivery_note(
+			item_code=item_code, warehouse=WAREHOUSE, qty=5, rate=500, posting_date=add_days(today(), -3)
+		)
+		return_note = create_delivery_note(
+			item_code=item_code,
+			warehouse=WAREHOUSE,
+			qty=-2,
+			rate=500,
+			is_return=1,
+			return_against=delivery_note.name,
+			posting_date=add_days(today(), -2),
+		)
+		self.assertEqual(flt(get_stock_value_difference(return_note.name)), 200)
+
+		# a receipt ahead of both reposts the delivery and its return in the same write buffer
+		make_stock_entry(item_code=item_code, target=WAREHOUSE, qty=10, basic_rate=300, posting_date=add_days(today(), -6))
+
+		self.assertEqual(flt(get_stock_value_difference(delivery_note.name)), -1500)
+		self.assertEqual(flt(get_stock_value_difference(return_note.name)), 600)
+
+	def test_moving_average_queue_is_passed_through(self):
+		item_code = make_item("_Test Repost Moving Average Item", {"is_stock_item": 1, "valuation_method": "Moving Average"}).name
+		make_stock_entry(item_code=item_code, target=WAREHOUSE, qty=10, basic_rate=100, posting_date=add_days(today(), -5))
+		delivery_note = create_delivery_note(
+			item_code=item_code, warehouse=WAREHOUSE, qty=5, rate=500, posting_date=add_days(today(), -3)
+		)
+		queues = get_stock_queues(item_code)
+
+		make_stock_entry(item_code=item_code, target=WAREHOUSE, qty=10, basic_rate=400, posting_date=add_days(today(), -4))
+
+		self.assertEqual(flt(get_stock_value_difference(delivery_note.name)), -1250)
+		self.assertEqual({name: queue for name, queue in get_stock_queues(item_code).items() if name in queues}, queues)
+
+
+class TestStockQueuePacking(FrappeTestCase):
+	def test_pack_and_dump_round_trip(self):
+		queue = [[10.0, 100.0], [2.5, 120.75], [-1.0, 99.125]]
+		self.assertEqual(dump_stock_queue(pack_stock_queue(queue)), json.dumps(queue))
+		self.assertEqual(dump_stock_queue(pack_stock_queue([])), json.dumps([]))
+
+	def test_stored_queue_is_passed_through(self):
+		self.assertEqual(dump_stock_queue(pack_stock_queue('[[5.0, 100.0]]')), '[[5.0, 100.0]]')
+
+
+def get_stock_queues(item_code):
+	return dict(frappe.get_all(
+		"Stock Ledger Entry", {"item_code": item_code, "is_cancelled": 0}, ["name", "stock_queue"], as_list=True
+	))
+
+
+def get_stock_value_difference(voucher_no):
+	return frappe.db.get_value(
+		"Stock Ledger Entry", {"voucher_no": voucher_no, "is_cancelled": 0}, "stock_value_difference"
+	)
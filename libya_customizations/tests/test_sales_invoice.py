@@ -0,0 +1,123 @@
+from unittest.mock import patch
+
+import frappe
+from erpnext.stock.doctype.delivery_note.test_delivery_note import create_delivery_note
+from frappe.utils import flt
+
+from libya_customizations.server_script import sales_invoice
+from libya_customizations.server_script.sales_invoice import (
+	after_submit_sales_invoice_dn,
+	before_cancel_sales_invoice_dn,
+	before_submit_sales_invoice,
+)
+from libya_customizations.tests.utils import WAREHOUSE, LedgerTestCase, make_stock_item, receive_stock
+
+PRICE_LIST = "_Test Price List"
+
+
+class TestDeliveryNoteBilling(LedgerTestCase):
+	def setUp(self):
+		item_code = make_stock_item("_Test Billed Qty Item")
+		receive_stock(item_code, 20, 100)
+		self.delivery_note = create_delivery_note(item_code=item_code, warehouse=WAREHOUSE, qty=10, rate=300)
+		self.row = self.delivery_note.items[0].name
+
+	def test_partial_billing_across_two_invoices(self):
+		first_invoice = make_invoice([(self.row, 4)])
+		after_submit_sales_invoice_dn(first_invoice, "on_submit")
+		self.assertEqual(get_billing(self.delivery_note.name), (4, "Partly Billed", 0.4))
+
+		# two lines of the same invoice billing one delivery row add up in the one UPDATE
+		second_invoice = make_invoice([(self.row, 2), (self.row, 4)])
+		after_submit_sales_invoice_dn(second_invoice, "on_submit")
+		self.assertEqual(get_billing(self.delivery_note.name), (10, "Fully Billed", 100))
+
+		before_cancel_sales_invoice_dn(second_invoice, "before_cancel")
+		self.assertEqual(get_billing(self.delivery_note.name), (4, "Partly Billed", 0.4))
+
+		before_cancel_sales_invoice_dn(first_invoice, "before_cancel")
+		self.assertEqual(get_billing(self.delivery_note.name), (0, "Not Billed", 0))
+
+	def test_returns_leave_billing_alone(self):
+		after_submit_sales_invoice_dn(make_invoice([(self.row, 4)], is_return=1), "on_submit")
+		self.assertEqual(get_billing(self.delivery_note.name)[0], 0)
+
+
+class TestSalesInvoiceRateValidation(LedgerTestCase):
+	def setUp(self):
+		self.items = [make_stock_item(f"_Test Rate Validation Item {index}") for index in range(3)]
+		if not frappe.db.exists("Production Year", "2024"):
+			frappe.get_doc({"doctype": "Production Year", "production_year": "2024"}).insert()
+		make_price(self.items[0], 100)
+		make_price(self.items[0], 120, production_year="2024")
+		make_price(self.items[1], 50)
+
+	@patch("frappe.get_roles", return_value=["Sales User"])
+	def test_every_violating_row_is_reported_at_once(self, get_roles):
+		invoice = frappe._dict(
+			is_return=0,
+			selling_price_list=PRICE_LIST,
+			items=[
+				# below the 2024 price
+				make_item_row(self.items[0], 110, production_year="2024"),
+				# a year without its own price falls back to the blank year one
+				make_item_row(self.items[0], 105, production_year="2025"),
+				make_item_row(self.items[1], 40),
+				# under the valuation rate, whatever the price list says
+				make_item_row(self.items[2], 5, incoming_rate=10),
+			],
+		)
+
+		with (
+			patch.object(sales_invoice, "get_price_list_rates", wraps=sales_invoice.get_price_list_rates) as get_rates,
+			self.assertRaises(frappe.ValidationError) as error,
+		):
+			before_submit_sales_invoice(invoice, "before_submit")
+
+		get_rates.assert_called_once()
+		message = str(error.exception)
+		self.assertIn(f"<b>{self.items[0]}</b> is less than <b>Price List Rate</b> (120.00)", message)
+		self.assertNotIn("(100.00)", message)
+		self.assertIn(f"<b>{self.items[1]}</b> is less than <b>Price List Rate</b> (50.00)", message)
+		self.assertIn(f"<b>{self.items[2]}</b> is less than <b>Valuation Rate</b>", message)
+
+	@patch("frappe.get_roles", return_value=["Sales User", "Sales Supervisor"])
+	def test_supervisors_skip_the_price_list(self, get_roles):
+		invoice = frappe._dict(is_return=0, selling_price_list=PRICE_LIST, items=[make_item_row(self.items[1], 40)])
+		before_submit_sales_invoice(invoice, "before_submit")
+
+
+def make_price(item_code, rate, production_year=None):
+	frappe.get_doc({
+		"doctype": "Item Price",
+		"item_code": item_code,
+		"price_list": PRICE_LIST,
+		"production_year": production_year,
+		"price_list_rate": rate,
+	}).insert()
+
+
+def make_item_row(item_code, net_rate, production_year=None, incoming_rate=1):
+	return frappe._dict(
+		item_code=item_code,
+		item_name=item_code,
+		production_year=production_year,
+		net_rate=net_rate,
+		incoming_rate=incoming_rate,
+	)
+
+
+def make_invoice(rows, is_return=0):
+	"""The fields the billing hooks read off a Sales Invoice, for (dn_detail, qty) lines."""
+	return frappe._dict(
+		is_return=is_return,
+		update_stock=0,
+		is_opening="No",
+		items=[frappe._dict(dn_detail=dn_detail, qty=qty, sales_order=None) for dn_detail, qty in rows],
+	)
+
+
+def get_billing(delivery_note):
+	billed_qty = frappe.db.get_value("Delivery Note Item", {"parent": delivery_note}, "sum(billed_qty)")
+	billing_status, per_billed = frappe.db.get_value("Delivery Note", delivery_note, ["billing_status", "custom_per_billed"])
+	return flt(billed_qty), billing_status, flt(per_billed, 2)
@@ -0,0 +1,28 @@
+import frappe
+from erpnext.stock.doctype.item.test_item import make_item
+from erpnext.stock.doctype.stock_entry.stock_entry_utils import make_stock_entry
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_days, today
+
+WAREHOUSE = "_Test Warehouse - _TC"
+
+
+class LedgerTestCase(FrappeTestCase):
+	"""Rolls back after every test, so the entries one test posts never reach the next."""
+
+	def tearDown(self):
+		frappe.db.rollback()
+
+	def run_before_commit(self):
+		"""Runs the work deferred to the commit, as frappe.db.commit would, without committing."""
+		frappe.db.before_commit.run()
+
+
+def make_stock_item(item_code, **properties):
+	return make_item(item_code, {"is_stock_item": 1, **properties}).name
+
+
+def receive_stock(item_code, qty, rate, days_ago=0):
+	return make_stock_entry(
+		item_code=item_code, target=WAREHOUSE, qty=qty, basic_rate=rate, posting_date=add_days(today(), -days_ago)
+	)
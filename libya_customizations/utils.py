@@ -1,14 +1,14 @@
+import hashlib
 import json
 import frappe
 from frappe import _
 from erpnext.controllers.accounts_controller import validate_and_delete_children, set_order_defaults
 from frappe.model.workflow import get_workflow_name, is_transition_condition_satisfied
-from frappe.utils import (flt, get_link_to_form, getdate)
+from frappe.utils import (cstr, flt, get_link_to_form, getdate, now)
 
 from erpnext.buying.utils import update_last_purchase_rate
 from erpnext.stock.doctype.packed_item.packed_item import make_packing_list
 from erpnext.stock.get_item_details import get_conversion_factor
-from erpnext.accounts.doctype.payment_entry.payment_entry import get_outstanding_reference_documents
 from erpnext.accounts.doctype.unreconcile_payment.unreconcile_payment import get_linked_payments_for_doc
 from erpnext.accounts.doctype.unreconcile_payment.unreconcile_payment import create_unreconcile_doc_for_selection
 
@@ -350,65 +350,81 @@ def update_child_qty_rate(parent_doctype, trans_items, parent_doctype_name, chil
 # excel sheets
 from frappe.utils.xlsxutils import INVALID_TITLE_REGEX, ILLEGAL_CHARACTERS_RE, handle_html
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import PatternFill, Font
+from openpyxl.utils import get_column_letter
 from io import BytesIO
+from itertools import chain, islice
 
-def make_xlsx(data, sheet_name, wb=None, column_widths=None):
-	column_widths = column_widths or []
+# rows the column widths of a streamed sheet are fitted to
+XLSX_WIDTH_SAMPLE_ROWS = 1000
+
+def make_xlsx(data, sheet_name, wb=None, column_widths=None, file=None):
+	"""Writes `data` to a sheet with a green bold header row and auto-fitted column widths.
+
+	The sheet is written in openpyxl write-only mode and `data` is consumed as an iterator, so
+	only the first XLSX_WIDTH_SAMPLE_ROWS rows, which the column widths are fitted to, are held
+	at once; pass `file` to stream the workbook into an open file handle instead of a BytesIO.
+	"""
 	if wb is None:
-		wb = Workbook()
+		wb = Workbook(write_only=True)
 
 	# Sanitize sheet name
 	sheet_name_sanitized = INVALID_TITLE_REGEX.sub(" ", sheet_name)
 	ws = wb.create_sheet(sheet_name_sanitized, 0)
 
-	# Define green fill for the first row
+	rows = sanitize_xlsx_rows(data, strip_html=sheet_name not in ["Data Import Template", "Data Export"])
+	# widths have to be set before the first row is written, so they are fitted to a leading sample
+	sample = list(islice(rows, XLSX_WIDTH_SAMPLE_ROWS))
+	for column, max_length in enumerate(get_xlsx_column_widths(sample), 1):
+		ws.column_dimensions[get_column_letter(column)].width = (max_length + 2) * 1.2  # Add some padding
+
+	# Green fill and bold font for the first row
 	green_fill = PatternFill(start_color="90EE90", end_color="90EE90", fill_type="solid")  # Light green
+	header_font = Font(name="Calibri", bold=True)
+	for index, row in enumerate(chain(sample, rows)):
+		if index == 0:
+			row = [_header_cell(ws, value, green_fill, header_font) for value in row]
+		ws.append(row)
 
-	# Apply green fill to the first row
+	xlsx_file = BytesIO() if file is None else file
+	wb.save(xlsx_file)
+	return xlsx_file
 
-	# Set bold font for the first row
-	row1 = ws.row_dimensions[1]
-	row1.font = Font(name="Calibri", bold=True)
 
-	# Process data and write to the sheet
+def sanitize_xlsx_rows(data, strip_html=True):
+	"""Yields the rows of `data` with HTML and characters Excel rejects removed from their strings."""
 	for row in data:
 		clean_row = []
 		for item in row:
-			if isinstance(item, str) and (sheet_name not in ["Data Import Template", "Data Export"]):
-				value = handle_html(item)
-			else:
-				value = item
-
-			if isinstance(item, str) and next(ILLEGAL_CHARACTERS_RE.finditer(value), None):
+			value = item
+			if isinstance(item, str):
+				if strip_html:
+					value = handle_html(item)
 				# Remove illegal characters from the string
 				value = ILLEGAL_CHARACTERS_RE.sub("", value)
-
 			clean_row.append(value)
+		yield clean_row
 
-		ws.append(clean_row)
-
-	for cell in ws[1]:
-		cell.fill = green_fill
-	# Auto-fit column widths
-	for col in ws.columns:
-		max_length = 0
-		column = col[0].column_letter  # Get the column letter (e.g., "A", "B", etc.)
-		for cell in col:
-			try:
-				# Calculate the length of the cell content
-				if len(str(cell.value)) > max_length:
-					max_length = len(str(cell.value))
-			except:
-				pass
-		# Set the column width to fit the longest content, add padding
-		adjusted_width = (max_length + 2) * 1.2  # Add some padding
-		ws.column_dimensions[column].width = adjusted_width
-
-	# Save the workbook to a BytesIO object
-	xlsx_file = BytesIO()
-	wb.save(xlsx_file)
-	return xlsx_file
+
+def get_xlsx_column_widths(rows):
+	"""Returns the length of the longest value of every column."""
+	widths = []
+	for row in rows:
+		for column, value in enumerate(row):
+			length = len(value) if isinstance(value, str) else len(str(value)) if value is not None else 0
+			if column == len(widths):
+				widths.append(length)
+			elif length > widths[column]:
+				widths[column] = length
+	return widths
+
+
+def _header_cell(ws, value, fill, font):
+	cell = WriteOnlyCell(ws, value=value)
+	cell.fill = fill
+	cell.font = font
+	return cell
 
 
 
@@ -516,21 +532,80 @@ def get_item_details(args, doc=None, for_validate=False, overwrite_warehouse=Tru
 	return out
 
 # Payment Reconciliation
-def reconcile_payments(company, account, customer):	
-	outstanding_documents = get_outstanding_reference_documents({"party_type":'Customer', "party":customer, "party_account":account}) or 0
-	flag = False
-	if outstanding_documents:
-		for i in outstanding_documents:
-			if i.outstanding_amount > 0:
-				flag = True
-				break
-	if flag:
-		unallocated_amount = frappe.db.get_value("Payment Entry", [["party", "=", customer], ["unallocated_amount", ">", 0], ["docstatus", "=", 1]], "sum(unallocated_amount)") or 0
-		credit_amount = frappe.db.get_value("Journal Entry Account", [["party", "=", customer], ["credit", ">", 0], ["reference_name", "=", None], ["docstatus", "=", 1]], "sum(credit)") or 0
-		cn_amount = frappe.db.get_value("Sales Invoice", [["customer", "=", customer], ["outstanding_amount", "<", 0], ["is_return", "=", 1], ["docstatus", "=", 1]], "sum(outstanding_amount)") or 0
-		if unallocated_amount or credit_amount or cn_amount:
-			_cancel_old_reconciliations(company, account, customer)
-			_create_reconciliation_entry(company, account, customer)
+RECONCILIATION_QUEUE = "payment_reconciliation_queue"
+RECONCILIATION_BATCH_SIZE = 500
+
+def reconcile_payments(company, account, customer):
+	if customer in get_reconciliation_candidates(company, account, [customer]):
+		_cancel_old_reconciliations(company, account, customer)
+		_create_reconciliation_entry(company, account, customer)
+
+def get_reconciliation_candidates(company, account, customers=None):
+	"""Enabled customers with a positive outstanding voucher on the account and unallocated credit
+	(unallocated payments, unreferenced journal credits or open credit notes) to allocate against it."""
+	return frappe.db.sql_list(f"""
+		SELECT customer.name
+		FROM `tabCustomer` customer
+		WHERE customer.disabled = 0
+			{"AND customer.name IN %(customers)s" if customers else ""}
+			AND customer.name IN (
+				SELECT party
+				FROM (
+					SELECT party, SUM(amount) AS outstanding
+					FROM `tabPayment Ledger Entry`
+					WHERE company = %(company)s
+						AND account = %(account)s
+						AND party_type = 'Customer'
+						AND delinked = 0
+						{"AND party IN %(customers)s" if customers else ""}
+					GROUP BY party, against_voucher_type, against_voucher_no
+					HAVING outstanding > 0
+				) outstanding_voucher
+			)
+			AND customer.name IN (
+				SELECT party
+				FROM `tabPayment Entry`
+				WHERE docstatus = 1 AND party_type = 'Customer' AND unallocated_amount > 0
+				UNION
+				SELECT party
+				FROM `tabJournal Entry Account`
+				WHERE docstatus = 1 AND party_type = 'Customer' AND credit > 0 AND IFNULL(reference_name, '') = ''
+				UNION
+				SELECT customer
+				FROM `tabSales Invoice`
+				WHERE docstatus = 1 AND is_return = 1 AND outstanding_amount < 0
+			)
+	""", {"company": company, "account": account, "customers": customers})
+
+def queue_reconciliation(company, account, customer):
+	"""Marks a customer account as needing reconciliation.
+
+	The key is recorded once the current transaction commits, and process_reconciliation_queue
+	reconciles every marked key once per run, however many documents were posted for it meanwhile.
+	"""
+	key = json.dumps([company, account, customer])
+	frappe.db.after_commit.add(lambda: frappe.cache().sadd(RECONCILIATION_QUEUE, key))
+
+def process_reconciliation_queue():
+	"""Scheduled every minute: reconciles the queued (company, account, customer) keys."""
+	cache = frappe.cache()
+	# RedisWrapper.spop pops a single member, the batch is popped in one round trip under the key sadd wrote
+	pipeline = cache.pipeline()
+	pipeline.spop(cache.make_key(RECONCILIATION_QUEUE), RECONCILIATION_BATCH_SIZE)
+	keys = pipeline.execute()[0]
+	if not keys:
+		return
+
+	for key in keys:
+		company, account, customer = json.loads(key)
+		try:
+			reconcile_payments(company, account, customer)
+			frappe.db.commit()
+		except Exception:
+			frappe.db.rollback()
+			frappe.log_error(f"Payment reconciliation failed for {customer} ({account})")
+
+	frappe.call("erpnext.accounts.doctype.process_payment_reconciliation.process_payment_reconciliation.trigger_reconciliation_for_queued_docs")
 
 def _cancel_old_reconciliations(company, account, customer):
 	reconciliations = frappe.get_all("Process Payment Reconciliation", filters={"party": customer, "company": company, "receivable_payable_account": account, "docstatus": 1, "status": ["!=", "Completed"]}, fields=["name"])
@@ -559,6 +634,58 @@ def update_remarks(doc_name, linked_doctype, affected_field, remarks):
 		frappe.db.set_value("GL Entry", {"voucher_no": linked_doc}, "remarks", remarks)
 		frappe.db.set_value(linked_doctype, linked_doc, affected_field, remarks)
 
+def bulk_set_values(doctype, updates, chunk_size=500, update_modified=True, commit=False):
+	"""Writes `{name: {fieldname: value}}` with one multi-row UPDATE per chunk of names.
+
+	Pass `commit` to release the row locks after every chunk on long refreshes.
+	Returns the number of documents written.
+	"""
+	names = list(updates)
+	modified = now()
+	for start in range(0, len(names), chunk_size):
+		chunk = names[start:start + chunk_size]
+		fields = sorted({field for name in chunk for field in updates[name]})
+		assignments = []
+		values = []
+		for field in fields:
+			cases = []
+			for name in chunk:
+				if field in updates[name]:
+					cases.append("WHEN %s THEN %s")
+					values.extend((name, updates[name][field]))
+			assignments.append(f"`{field}` = CASE `name` {' '.join(cases)} ELSE `{field}` END")
+		if update_modified:
+			assignments.append("`modified` = %s")
+			values.append(modified)
+		values.extend(chunk)
+
+		frappe.db.sql(f"""
+			UPDATE `tab{doctype}`
+			SET {', '.join(assignments)}
+			WHERE `name` IN ({', '.join(['%s'] * len(chunk))})
+		""", values)
+		if commit:
+			frappe.db.commit()
+	return len(names)
+
+# joins the key parts of a hashed name, passed to the SQL that names rows in INSERT ... SELECT too
+HASHED_NAME_SEPARATOR = "\n"
+
+def hashed_name(*parts):
+	"""The 20 character name of a row derived from its key parts, None taken as ""."""
+	key = HASHED_NAME_SEPARATOR.join(cstr(part) for part in parts)
+	return hashlib.sha1(key.encode()).hexdigest()[:20]
+
+def defer_until_commit(flag, keys, flush):
+	"""Collects `keys` in a set under frappe.flags[flag] and calls `flush(keys)` once with all of
+	them right before the transaction commits; the set is dropped if the transaction rolls back."""
+	pending = frappe.flags.get(flag)
+	if pending is None:
+		pending = frappe.flags[flag] = set()
+		frappe.db.before_commit.add(lambda: flush(frappe.flags.pop(flag, None) or ()))
+		frappe.db.after_rollback.add(lambda: frappe.flags.pop(flag, None))
+	pending.update(keys)
+
 # Roles Doctype
 @frappe.whitelist()
 def get_default_roles(role_type):